@@ -0,0 +1,401 @@
+import os
+import sys
+import time
+import queue
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from cache_clima import GRILLA_GRADOS
+import metricas
+
+# Almacén columnar de variables de clima compartido por la API (guarda cada descarga de Open-Meteo) y el
+# entrenamiento (backfill.py arma con él las filas que ya tiene y guarda las que descarga). Son archivos Arrow
+# IPC sin comprimir, particionados por día (UTC) y bloque de celdas de la grilla:
+#
+#   ALMACEN_DIR/fecha=2026-10-18/bloque=-35_-59/parte-<ns>-<pid>-<n>.arrow
+#
+# Cada archivo es inmutable. Se leen con mmap sin copiar y una consulta de N claves (lat, lon, hora) se resuelve
+# con un índice denso por partición (celda x hora -> fila). Si la misma celda y hora se escribió más de una vez
+# gana la escritura más nueva (la corrida de modelo más cercana a esa hora)
+
+ALMACEN_DIR = os.environ.get("ALMACEN_DIR", "")
+# Celda de la grilla en grados, la misma que la de la cache de clima
+ALMACEN_GRILLA = float(os.environ.get("ALMACEN_GRILLA", GRILLA_GRADOS or 0.05))
+# Lado del bloque de celdas de cada partición, en grados
+ALMACEN_BLOQUE_GRADOS = float(os.environ.get("ALMACEN_BLOQUE_GRADOS", 1.0))
+# Segundos que el escritor junta descargas antes de escribir un archivo por partición
+ALMACEN_TANDA_S = float(os.environ.get("ALMACEN_TANDA_S", 30))
+# Descargas esperando al escritor; con la cola llena se descartan en lugar de frenar al que descargó
+ALMACEN_COLA = int(os.environ.get("ALMACEN_COLA", 10000))
+# Particiones abiertas (mmap + índice) que se mantienen entre consultas
+ALMACEN_MAX_PARTICIONES = int(os.environ.get("ALMACEN_MAX_PARTICIONES", 512))
+
+# Columnas de cada fila además de las variables
+COLUMNAS_CLAVE = ["celda_lat", "celda_lon", "hora", "utc_offset", "elevacion", "escrito"]
+HORAS_DIA = 24
+SEGUNDOS_DIA = 86400
+
+
+def _clave_local(celda_lat, celda_lon, horas, celdas_bloque):
+    # Posición de (celda, hora) dentro de su partición: celdas_bloque² celdas x 24 horas
+    return ((celda_lat % celdas_bloque) * celdas_bloque + celda_lon % celdas_bloque) * HORAS_DIA \
+        + horas % SEGUNDOS_DIA // 3600
+
+def _a_numpy(tablas, nombre):
+    # Con un solo archivo (partición compactada) es una vista sobre el mmap; con varios, una copia
+    trozos = [trozo for tabla in tablas for trozo in tabla.column(nombre).chunks]
+    if len(trozos) == 1:
+        return trozos[0].to_numpy(zero_copy_only=False)
+    return np.concatenate([trozo.to_numpy(zero_copy_only=False) for trozo in trozos])
+
+def _ultimas(claves, escrito):
+    # Índice de la escritura más nueva de cada clave
+    orden = np.argsort(escrito, kind="stable")[::-1]
+    _, primeras = np.unique(claves[orden], return_index=True)
+    return orden[primeras]
+
+def _leer(ruta):
+    return ipc.open_file(pa.memory_map(ruta)).read_all()
+
+def _archivos(ruta):
+    return sorted(a for a in os.listdir(ruta) if a.endswith(".arrow"))
+
+
+class _Particion:
+    # Archivos de una partición que tienen todas las variables pedidas, abiertos con mmap, y su índice denso
+
+    def __init__(self, ruta, archivos, variables, celdas_bloque):
+        self.archivos = archivos
+        self.tablas = [tabla for tabla in (_leer(os.path.join(ruta, a)) for a in archivos)
+                       if all(var in tabla.schema.names for var in variables)]
+        self.indice = np.full(celdas_bloque * celdas_bloque * HORAS_DIA, -1, dtype=np.int64)
+        self._columnas = {}
+        if self.tablas:
+            claves = _clave_local(self.columna("celda_lat").astype(np.int64), self.columna("celda_lon").astype(np.int64),
+                                  self.columna("hora"), celdas_bloque)
+            filas = _ultimas(claves, self.columna("escrito"))
+            self.indice[claves[filas]] = filas
+
+    def columna(self, nombre):
+        if nombre not in self._columnas:
+            self._columnas[nombre] = _a_numpy(self.tablas, nombre)
+        return self._columnas[nombre]
+
+    def columnas(self, variables):
+        # Lista de arrays en el orden de variables, armada una vez por juego de variables
+        if variables not in self._columnas:
+            self._columnas[variables] = [self.columna(var) for var in variables]
+        return self._columnas[variables]
+
+    def tabla(self, variables):
+        # Una fila por celda y hora, ordenadas por celda y hora
+        columnas = COLUMNAS_CLAVE + list(variables)
+        tabla = pa.concat_tables([t.select(columnas) for t in self.tablas])
+        return tabla.take(self.indice[self.indice >= 0])
+
+
+class AlmacenClima:
+
+    def __init__(self, directorio=ALMACEN_DIR, grilla=ALMACEN_GRILLA, bloque_grados=ALMACEN_BLOQUE_GRADOS,
+                 tanda_s=ALMACEN_TANDA_S, max_cola=ALMACEN_COLA, max_particiones=ALMACEN_MAX_PARTICIONES):
+        self.directorio = directorio
+        self.grilla = grilla
+        self.celdas_bloque = max(1, round(bloque_grados / grilla))
+        self.tanda_s = tanda_s
+        self.max_particiones = max_particiones
+        # Filas (celda x hora) guardadas y descartadas por este proceso
+        self.escritas = 0
+        self.descartadas = 0
+        self._cola = queue.Queue(max_cola)
+        self._hilo = None
+        self._partes = 0
+        self._particiones = OrderedDict()
+        self._lock = threading.Lock()
+
+    def celda(self, lat, lon):
+        # Índices enteros de la celda, redondeando igual que cache_clima.celda
+        return (np.round(np.asarray(lat, dtype=np.float64) / self.grilla).astype(np.int64),
+                np.round(np.asarray(lon, dtype=np.float64) / self.grilla).astype(np.int64))
+
+    def _ruta(self, dia, bloque_lat, bloque_lon):
+        fecha = time.strftime("%Y-%m-%d", time.gmtime(int(dia) * SEGUNDOS_DIA))
+        grados = self.celdas_bloque * self.grilla
+        bloque = f"{round(int(bloque_lat) * grados, 4):g}_{round(int(bloque_lon) * grados, 4):g}"
+        return os.path.join(self.directorio, f"fecha={fecha}", f"bloque={bloque}")
+
+    # Escritura
+
+    def iniciar(self):
+        # Como captura.py: con gunicorn --preload se llama en el startup de cada worker
+        if not self.directorio or self._hilo is not None:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        self._hilo = threading.Thread(target=self._escribir, name="almacen", daemon=True)
+        self._hilo.start()
+        logging.info(f"Guardando el clima descargado en {self.directorio}")
+
+    def detener(self, timeout=10.0):
+        # Escribe lo que quedó en la cola
+        if self._hilo is None:
+            return
+        try:
+            self._cola.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning(f"Almacén: la cola no se vació a tiempo, se pierden {self._cola.qsize()} descargas")
+        self._hilo.join(timeout)
+        self._hilo = None
+
+    def agregar(self, lat, lon, datos):
+        # datos: DatosHorarios de la celda de lat/lon. Sin el hilo iniciado se escribe en el momento
+        if not self.directorio:
+            return
+        registro = (lat, lon, datos, time.time())
+        if self._hilo is None:
+            self.guardar([registro])
+            return
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            n = len(next(iter(datos.variables.values()), ()))
+            self.descartadas += n
+            metricas.ALMACEN.labels("descartada").inc(n)
+
+    def _escribir(self):
+        terminar = False
+        while not terminar:
+            tanda = [self._cola.get()]
+            limite = time.monotonic() + self.tanda_s
+            while tanda[-1] is not None and time.monotonic() < limite:
+                try:
+                    tanda.append(self._cola.get(timeout=max(0.0, limite - time.monotonic())))
+                except queue.Empty:
+                    break
+            if tanda[-1] is None:
+                terminar = True
+                tanda.pop()
+            if not tanda:
+                continue
+            try:
+                self.guardar(tanda)
+            except (OSError, ValueError, pa.ArrowException) as e:
+                n = sum(len(next(iter(datos.variables.values()), ())) for _, _, datos, _ in tanda)
+                self.descartadas += n
+                metricas.ALMACEN.labels("descartada").inc(n)
+                logging.error(f"Error guardando el clima en el almacén: {e}")
+
+    def guardar(self, registros):
+        # registros: [(lat, lon, DatosHorarios, escrito)]. Un archivo por partición y juego de variables
+        grupos = {}
+        for lat, lon, datos, escrito in registros:
+            celda_lat, celda_lon = (int(c) for c in self.celda(lat, lon))
+            horas = np.arange(datos.inicio, datos.fin, datos.intervalo, dtype=np.int64)
+            dias = horas // SEGUNDOS_DIA
+            variables = tuple(datos.variables)
+            for dia in np.unique(dias):
+                tramo = np.flatnonzero(dias == dia)
+                clave = (int(dia), celda_lat // self.celdas_bloque, celda_lon // self.celdas_bloque, variables)
+                grupos.setdefault(clave, []).append((celda_lat, celda_lon, horas[tramo], tramo, datos, escrito))
+
+        filas = 0
+        for (dia, bloque_lat, bloque_lon, variables), partes in grupos.items():
+            largos = [len(horas) for _, _, horas, _, _, _ in partes]
+            columnas = {
+                "celda_lat": np.repeat([p[0] for p in partes], largos).astype(np.int32),
+                "celda_lon": np.repeat([p[1] for p in partes], largos).astype(np.int32),
+                "hora": np.concatenate([p[2] for p in partes]),
+                "utc_offset": np.repeat([p[4].utc_offset for p in partes], largos).astype(np.int32),
+                "elevacion": np.repeat([p[4].elevacion for p in partes], largos).astype(np.float32),
+                "escrito": np.repeat([p[5] for p in partes], largos).astype(np.float64),
+            }
+            for var in variables:
+                columnas[var] = np.concatenate([np.asarray(p[4].variables[var], dtype=np.float32)[p[3]] for p in partes])
+            self._escribir_archivo(self._ruta(dia, bloque_lat, bloque_lon), pa.table(columnas))
+            filas += len(columnas["hora"])
+        self.escritas += filas
+        metricas.ALMACEN.labels("escrita").inc(filas)
+        return filas
+
+    def _escribir_archivo(self, directorio, tabla):
+        # Atómico: el archivo sólo aparece con su nombre final cuando está completo
+        os.makedirs(directorio, exist_ok=True)
+        with self._lock:
+            self._partes += 1
+            parte = self._partes
+        ruta = os.path.join(directorio, f"parte-{time.time_ns()}-{os.getpid()}-{parte}.arrow")
+        with pa.OSFile(ruta + ".tmp", "wb") as f, ipc.new_file(f, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+        os.replace(ruta + ".tmp", ruta)
+        return ruta
+
+    # Lectura
+
+    def _particion(self, ruta, variables):
+        try:
+            archivos = _archivos(ruta)
+        except FileNotFoundError:
+            return None
+        clave = (ruta, variables)
+        with self._lock:
+            particion = self._particiones.get(clave)
+            if particion is not None and particion.archivos == archivos:
+                self._particiones.move_to_end(clave)
+                return particion
+        try:
+            particion = _Particion(ruta, archivos, variables, self.celdas_bloque)
+        except FileNotFoundError:
+            # Una compactación borró un archivo entre el listado y la lectura: se vuelve a listar
+            return self._particion(ruta, variables)
+        with self._lock:
+            self._particiones[clave] = particion
+            while len(self._particiones) > self.max_particiones:
+                self._particiones.popitem(last=False)
+        return particion
+
+    def buscar(self, lat, lon, horas, variables):
+        # Variables de clima para N claves (lat, lon, hora UTC en epoch s) en una sola consulta. Devuelve la matriz
+        # [N, variables] en float32, utc_offset, elevación y qué claves se encontraron con todas las variables
+        variables = tuple(variables)
+        celda_lat, celda_lon = self.celda(lat, lon)
+        horas = np.asarray(horas, dtype=np.int64)
+        n = len(horas)
+        valores = np.full((n, len(variables)), np.nan, dtype=np.float32)
+        utc_offset = np.zeros(n, dtype=np.int64)
+        elevacion = np.full(n, np.nan, dtype=np.float32)
+        encontrado = np.zeros(n, dtype=bool)
+        if not n or not self.directorio:
+            return valores, utc_offset, elevacion, encontrado
+
+        claves = _clave_local(celda_lat, celda_lon, horas, self.celdas_bloque)
+        # Partición de cada clave en un solo entero (día, bloque de latitud, bloque de longitud)
+        particiones = ((horas // SEGUNDOS_DIA) << 24) + ((celda_lat // self.celdas_bloque + 2048) << 12) \
+            + (celda_lon // self.celdas_bloque + 2048)
+        orden = np.argsort(particiones, kind="stable")
+        unicas, desde = np.unique(particiones[orden], return_index=True)
+        limites = np.append(desde, n)
+        for k, particion in enumerate(unicas):
+            dia, bloque_lat, bloque_lon = particion >> 24, (particion >> 12 & 4095) - 2048, (particion & 4095) - 2048
+            particion = self._particion(self._ruta(dia, bloque_lat, bloque_lon), variables)
+            if particion is None or not particion.tablas:
+                continue
+            pedidas = orden[limites[k]:limites[k + 1]]
+            filas = particion.indice[claves[pedidas]]
+            if not (filas >= 0).all():
+                pedidas, filas = pedidas[filas >= 0], filas[filas >= 0]
+            for m, columna in enumerate(particion.columnas(variables)):
+                valores[pedidas, m] = columna[filas]
+            utc_offset[pedidas] = particion.columna("utc_offset")[filas]
+            elevacion[pedidas] = particion.columna("elevacion")[filas]
+            encontrado[pedidas] = True
+        return valores, utc_offset, elevacion, encontrado
+
+    def rutas(self, desde=None, hasta=None):
+        # Particiones con fecha entre desde y hasta ("YYYY-MM-DD", inclusive)
+        if not os.path.isdir(self.directorio):
+            return []
+        rutas = []
+        for fecha in sorted(os.listdir(self.directorio)):
+            dia = fecha.split("=", 1)[-1]
+            if not fecha.startswith("fecha=") or (desde and dia < desde) or (hasta and dia > hasta):
+                continue
+            for bloque in sorted(os.listdir(os.path.join(self.directorio, fecha))):
+                rutas.append(os.path.join(self.directorio, fecha, bloque))
+        return rutas
+
+    def escanear(self, variables, desde=None, hasta=None):
+        # Tabla con una fila por celda y hora entre desde y hasta, para armar un dataset sin ir a la red
+        tablas = []
+        for ruta in self.rutas(desde, hasta):
+            particion = self._particion(ruta, tuple(variables))
+            if particion is not None and particion.tablas:
+                tablas.append(particion.tabla(variables))
+        if not tablas:
+            return pa.table({c: [] for c in COLUMNAS_CLAVE + list(variables)})
+        return pa.concat_tables(tablas)
+
+    # Mantenimiento
+
+    def compactar(self, desde=None, hasta=None):
+        # Junta los archivos de cada partición en uno por juego de variables, con la escritura más nueva de cada
+        # celda y hora. Así la partición se lee sin copiar y sin duplicados. Los lectores que ya tenían abiertos
+        # los archivos viejos los siguen leyendo (mmap), los nuevos listan otra vez
+        antes = despues = 0
+        for ruta in self.rutas(desde, hasta):
+            por_variables = {}
+            for archivo in _archivos(ruta):
+                tabla = _leer(os.path.join(ruta, archivo))
+                variables = tuple(sorted(set(tabla.schema.names) - set(COLUMNAS_CLAVE)))
+                por_variables.setdefault(variables, []).append((archivo, tabla))
+            for variables, partes in por_variables.items():
+                if len(partes) < 2:
+                    continue
+                columnas = COLUMNAS_CLAVE + list(variables)
+                tabla = pa.concat_tables([t.select(columnas) for _, t in partes])
+                claves = _clave_local(_a_numpy([tabla], "celda_lat").astype(np.int64),
+                                      _a_numpy([tabla], "celda_lon").astype(np.int64),
+                                      _a_numpy([tabla], "hora"), self.celdas_bloque)
+                tabla = tabla.take(_ultimas(claves, _a_numpy([tabla], "escrito")))
+                tabla = tabla.sort_by([("celda_lat", "ascending"), ("celda_lon", "ascending"), ("hora", "ascending")])
+                self._escribir_archivo(ruta, tabla.combine_chunks())
+                for archivo, _ in partes:
+                    os.remove(os.path.join(ruta, archivo))
+                antes += len(partes)
+                despues += 1
+        return {"archivos_antes": antes, "archivos_despues": despues}
+
+    def exportar_parquet(self, destino, variables=None, desde=None, hasta=None):
+        # Copia en Parquet (misma partición) para herramientas que no leen Arrow IPC. Sin variables, las que
+        # tienen todos los archivos de cada partición
+        import pyarrow.parquet as pq
+        archivos = 0
+        for ruta in self.rutas(desde, hasta):
+            if variables is None:
+                esquemas = [set(ipc.open_file(pa.memory_map(os.path.join(ruta, a))).schema.names) for a in _archivos(ruta)]
+                comunes = set.intersection(*esquemas) - set(COLUMNAS_CLAVE) if esquemas else set()
+                variables_particion = sorted(comunes)
+            else:
+                variables_particion = list(variables)
+            particion = self._particion(ruta, tuple(variables_particion))
+            if particion is None or not particion.tablas:
+                continue
+            salida = os.path.join(destino, os.path.relpath(ruta, self.directorio))
+            os.makedirs(salida, exist_ok=True)
+            pq.write_table(particion.tabla(variables_particion), os.path.join(salida, "datos.parquet"))
+            archivos += 1
+        return archivos
+
+    def estadisticas(self):
+        rutas = self.rutas()
+        archivos = [os.path.join(r, a) for r in rutas for a in _archivos(r)]
+        return {
+            "activo": self._hilo is not None,
+            "directorio": self.directorio,
+            "particiones": len(rutas),
+            "archivos": len(archivos),
+            "mb": sum(os.path.getsize(a) for a in archivos) / 1e6,
+            "en_cola": self._cola.qsize(),
+            "escritas": self.escritas,
+            "descartadas": self.descartadas,
+        }
+
+
+if __name__ == "__main__":
+    # Uso: python almacen_clima.py compactar | estadisticas | exportar DESTINO [--desde AAAA-MM-DD --hasta AAAA-MM-DD]
+    parser = argparse.ArgumentParser(description="Mantenimiento del almacén de clima")
+    parser.add_argument("accion", choices=["compactar", "estadisticas", "exportar"])
+    parser.add_argument("destino", nargs="?", help="directorio de salida de exportar")
+    parser.add_argument("--directorio", default=ALMACEN_DIR)
+    parser.add_argument("--desde")
+    parser.add_argument("--hasta")
+    args = parser.parse_args()
+    if not args.directorio:
+        sys.exit("Falta ALMACEN_DIR o --directorio")
+    almacen = AlmacenClima(args.directorio)
+    if args.accion == "compactar":
+        print(almacen.compactar(args.desde, args.hasta))
+    elif args.accion == "exportar":
+        print(f"{almacen.exportar_parquet(args.destino, desde=args.desde, hasta=args.hasta)} particiones exportadas")
+    print(almacen.estadisticas())
@@ -1,15 +1,61 @@
 import logging
-from fastapi import FastAPI
+import os
+import time
+import asyncio
+from typing import List
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from catboost import CatBoostClassifier  # Importar CatBoost
-import pandas as pd
 from datetime import datetime, timezone, timedelta
-import numpy as np
 import weather as we
+from esquema import EsquemaFeatures
+from ensamblador import EnsambladorFeatures, armar_respuestas
+from planificador import PlanificadorInferencia
+from refrescador import RefrescadorClima
+from raster import RasterRecomendaciones
+from captura import CapturaPedidos
+from modelos import ModeloActivo
+import metricas
 
 app = FastAPI()
-model = CatBoostClassifier()  # Crear instancia vacía
-model.load_model("./modelo_catboost3.cbm")  # Cargar el modelo entrenado
+inicio_carga = time.perf_counter()
+# Modelo vigente: el de MODELO_DIR si reentrenar.py promovió alguno, si no el incluido en el repo.
+# Cada worker cambia a uno nuevo en caliente (modelos.py)
+modelo = ModeloActivo()
+
+# Las features y variables de clima salen del modelo; si no coinciden con lo que sabemos construir, no arrancamos.
+# Los modelos que se cargan después tienen que tener las mismas features y clases
+esquema = EsquemaFeatures.desde_modelo(modelo.model)
+esquema.validar(we.VARIABLES_HORARIAS)
+ensamblador = EnsambladorFeatures(esquema)
+
+def puntuar(filas):
+    with metricas.medir("armado"):
+        pool = ensamblador.armar(filas)
+    with metricas.medir("inferencia"):
+        return modelo.model.predict_proba(pool)
+
+# Micro-batching: los pedidos concurrentes comparten una sola llamada al modelo
+planificador = PlanificadorInferencia(puntuar)
+
+# Vuelve a descargar las celdas más pedidas cuando sale una corrida nueva de Open-Meteo
+refrescador = RefrescadorClima(lambda lat, lon: we.refrescar_celda(lat, lon, esquema.variables))
+
+# Recomendaciones precalculadas por celda y hora (raster.py); sin RASTER_DIR no se usa
+raster = RasterRecomendaciones()
+
+# Log de los pedidos a /predecir para reproducirlos después (bench/reproducir.py); sin CAPTURA_DIR no se usa
+captura = CapturaPedidos()
+
+# Máximo de ubicaciones aceptadas por /predecir_lote
+MAX_LOTE = int(os.environ.get("MAX_LOTE", 1000))
+# Horas hacia adelante que cubre /predecir_horizonte
+MAX_HORIZONTE = 48
+# Segundos que un pedido espera el clima de Open-Meteo; después se responde con la última corrida guardada
+# (marcada como vencida) o con 503 si no hay ninguna
+PLAZO_PEDIDO_S = float(os.environ.get("PLAZO_PEDIDO_S", 4))
+# Ubicaciones ("lat,lon;lat,lon") que cada worker descarga al arrancar, antes de marcarse listo
+CALENTAR_UBICACIONES = os.environ.get("CALENTAR_UBICACIONES", "-34.6037,-58.3816")
 
 # Configuración básica de logging
 logging.basicConfig(
@@ -23,73 +69,264 @@ class Ubicacion(BaseModel):
     lon: float
     lead: int
 
+class Lote(BaseModel):
+    ubicaciones: List[Ubicacion]
+
+class Horizonte(BaseModel):
+    lat: float
+    lon: float
+    horas: int = MAX_HORIZONTE
+
+
+def armar_base(ubicacion, id=0):
+    # Arma la fila de entrada (sin clima) para una ubicación y lead
+    hoy = datetime.now().astimezone(timezone.utc) + timedelta(hours=ubicacion.lead)
+    hora_actual = hoy.hour
+    minuto_actual = hoy.minute
+    half_day = 'AM' if hora_actual < 12 else 'PM'
+    # Hora más cercana: desde las 23:30 es la 0 del día siguiente, así el horizonte no repite las 23
+    objetivo = (hoy + timedelta(minutes=30)).replace(minute=0, second=0, microsecond=0)
+    hour_integer = objetivo.hour
+
+    return {
+        'Ambiente': 'afuera',
+        'alt': '13',
+        'lat': ubicacion.lat,
+        'lon': ubicacion.lon,
+        'Half_of_day': half_day,
+        'hour': hora_actual,
+        'minute': minuto_actual,
+        'month': objetivo.month,
+        'day': objetivo.day,
+        'month(text)': objetivo.strftime('%b'),
+        'date': objetivo.date(),
+        'hour_integer': hour_integer,
+        'id': id
+    }
+
+def plazo():
+    return time.monotonic() + PLAZO_PEDIDO_S
+
+def sin_clima():
+    # Open-Meteo no respondió y no hay ninguna corrida guardada para la celda: no es un error de la API
+    return JSONResponse({"error": "No hay datos meteorológicos disponibles en este momento"},
+                        status_code=503, headers={"Retry-After": "30"})
+
+def error_interno():
+    return JSONResponse({"error": "Ocurrió un error durante la predicción"}, status_code=500)
+
+async def predecir_filas(base, limite=None):
+    # Trae el clima de todas las filas de base y las puntúa con una sola llamada al modelo
+    _, respuestas = await _predecir_filas(base, limite)
+    return respuestas
+
+async def _predecir_filas(base, limite=None):
+    # Como predecir_filas pero también devuelve las filas con el clima (las features que vio el modelo)
+    refrescador.registrar(we.cache_clima.celda(fila['lat'], fila['lon']) for fila in base)
+    with metricas.medir("clima"):
+        filas = await we.obtener_filas_clima_async(base, esquema.variables, limite)
+    logging.info("Datos meteorológicos obtenidos correctamente")
+    if not filas:
+        return filas, {}
+
+    pred = await planificador.puntuar(filas)
+    logging.info(f"Predicción realizada correctamente ({len(filas)} filas)")
+
+    with metricas.medir("respuesta"):
+        return filas, armar_respuestas(filas, pred, modelo.model.classes_)
+
+def capturar(ubicacion, llegada, inicio, estado, fuente, respuesta=None, filas=()):
+    # Se encola tal cual: el hilo de captura.py lo serializa fuera del pedido
+    captura.registrar({
+        "t": llegada,
+        "lat": ubicacion.lat,
+        "lon": ubicacion.lon,
+        "lead": ubicacion.lead,
+        "estado": estado,
+        "fuente": fuente,
+        "duracion_ms": (time.perf_counter() - inicio) * 1000,
+        "features": filas[0] if filas else None,
+        "respuesta": respuesta,
+    })
+
+def calentar_modelo(model):
+    # Predicción sintética (sin red) para que la primera llamada real no pague la inicialización de CatBoost.
+    # Corre al importar, así con gunicorn --preload se hace una sola vez en el padre y los workers la heredan.
+    # Un modelo cargado en caliente pasa por acá antes de reemplazar al anterior
+    fila = {feature: 0.0 for feature in esquema.features}
+    fila.update(armar_base(Ubicacion(lat=0.0, lon=0.0, lead=0)), alt=0.0, hour_geo=12)
+    model.predict_proba(ensamblador.armar([fila]))
+
+calentar_modelo(modelo.model)
+modelo.calentar = calentar_modelo
+logging.info(f"Modelo cargado y calentado en {time.perf_counter() - inicio_carga:.2f} s")
+
+# Estado de arranque de este worker, para /listo
+arranque = {"listo": False, "calentamiento_s": None}
+
+async def calentar_worker():
+    # Pedido completo (Open-Meteo, planificador, modelo) para dejar la cache de clima y las conexiones calientes
+    inicio = time.perf_counter()
+    ubicaciones = [tuple(map(float, u.split(","))) for u in CALENTAR_UBICACIONES.split(";") if u.strip()]
+    base = [armar_base(Ubicacion(lat=lat, lon=lon, lead=0), id=i) for i, (lat, lon) in enumerate(ubicaciones)]
+    try:
+        await predecir_filas(base)
+    except Exception as e:
+        # Sin clima igual se atiende: el modelo ya está cargado y la cache se llena con el primer pedido
+        logging.warning(f"No se pudo calentar la cache de clima: {e}")
+    arranque["calentamiento_s"] = time.perf_counter() - inicio
+    arranque["listo"] = True
+    logging.info(f"Worker listo en {arranque['calentamiento_s']:.2f} s")
+
+@app.on_event("startup")
+async def arrancar():
+    # En segundo plano: el worker ya acepta conexiones pero /listo responde 503 hasta terminar
+    arranque["tarea"] = asyncio.create_task(calentar_worker())
+    refrescador.iniciar()
+    captura.iniciar()
+    modelo.iniciar()
+    if we.almacen is not None:
+        we.almacen.iniciar()
+
+@app.on_event("shutdown")
+async def cerrar_clientes():
+    await we.cerrar_cliente_async()
+    await planificador.detener()
+    await refrescador.detener()
+    captura.detener()
+    await modelo.detener()
+    if we.almacen is not None:
+        we.almacen.detener()
+
+@app.middleware("http")
+async def medir_pedido(request: Request, call_next):
+    inicio = time.perf_counter()
+    response = await call_next(request)
+    # Se etiqueta por ruta declarada (no por URL) para no crear series por cada path desconocido
+    ruta = request.scope.get("route")
+    if ruta is not None:
+        metricas.LATENCIA_PEDIDO.labels(ruta.path).observe(time.perf_counter() - inicio)
+    return response
+
+@app.get("/metrics")
+def exportar_metricas():
+    # La cache compartida cambia de corrida sin que nadie guarde: se recuenta antes de exportar
+    metricas.CELDAS_EN_CACHE.set(len(we.cache_clima))
+    contenido, tipo = metricas.exportar()
+    return Response(contenido, media_type=tipo)
+
+@app.get("/listo")
+def listo():
+    estado = {"listo": arranque["listo"], "calentamiento_s": arranque["calentamiento_s"],
+              "cache_celdas": len(we.cache_clima)}
+    return JSONResponse(estado, status_code=200 if arranque["listo"] else 503)
+
+@app.get("/planificador")
+def estadisticas_planificador():
+    return planificador.estadisticas()
+
+@app.get("/refrescador")
+def estadisticas_refrescador():
+    return refrescador.estadisticas()
+
+@app.get("/circuito")
+def estadisticas_circuito():
+    return we.circuito.estadisticas()
+
+@app.get("/raster")
+def estadisticas_raster():
+    return raster.estadisticas()
+
+@app.get("/captura")
+def estadisticas_captura():
+    return captura.estadisticas()
+
+@app.get("/modelo")
+def estadisticas_modelo():
+    return modelo.estadisticas()
+
+@app.get("/almacen")
+def estadisticas_almacen():
+    if we.almacen is None:
+        return {"activo": False}
+    return we.almacen.estadisticas()
+
 @app.post("/predecir")
-def predecir(ubicacion: Ubicacion):
+async def predecir(ubicacion: Ubicacion):
+    llegada, inicio = time.time(), time.perf_counter()
     try:
         logging.info(f"Petición recibida: lat={ubicacion.lat}, lon={ubicacion.lon}, lead={ubicacion.lead}")
-        
-        hoy = datetime.now().astimezone(timezone.utc) + timedelta(hours=ubicacion.lead)
-        hora_actual = hoy.hour
-        minuto_actual = hoy.minute
-        half_day = 'AM' if hora_actual < 12 else 'PM'
-        hour_integer = hora_actual + 1 if minuto_actual >= 30 else hora_actual
-        hour_integer = min(hour_integer, 23)
-
-        base = pd.DataFrame([{
-            'Ambiente': 'afuera',
-            'alt': '13',
-            'lat': ubicacion.lat,
-            'lon': ubicacion.lon,
-            'Half_of_day': half_day,
-            'hour': hora_actual,
-            'minute': minuto_actual,
-            'month': hoy.month,
-            'day': hoy.day,
-            'month(text)': hoy.strftime('%b'),
-            'date': hoy.date(),
-            'hour_integer': hour_integer,
-            'id': 0
-        }])
-
-        base['date'] = pd.to_datetime(base['date'])
-        df = we.obtener_data_clima(base)
-        logging.info("Datos meteorológicos obtenidos correctamente")
-
-        hour_geo = df['hour_geo']
-        precipitation_prob = (df['weather_rain'] + df['weather_snowfall'] + df['weather_showers']) / 3.0 
-
-        df.drop(columns=[
-            'hour', 'minute', 'day', 'date', 'id',
-            'weather_precipitation_probability',
-            'weather_boundary_layer_height',
-            'weather_total_column_integrated_water_vapour','hour_geo'
-        ], inplace=True)
-        df.drop(columns=['lat','lon','month(text)'], inplace=True)
-        df['season'] = df['month'].apply(lambda x: 'summer' if x in [12,1,2] else 'fall' if x in [3,4,5] else 'winter' if x in [6,7,8] else 'spring') 
-        df.drop(columns=['month'], inplace=True)
-
-        pred = model.predict_proba(df)
-        logging.info("Predicción realizada correctamente")
-
-        prob_df = pd.DataFrame({
-            'prob_1st': pred.max(axis=1),
-            'class_1st': model.classes_[pred.argmax(axis=1)],
-            'prob_2nd': np.sort(pred, axis=1)[:, -2],
-            'class_2nd': model.classes_[np.argsort(pred, axis=1)[:, -2]],
-            'temperature': df['weather_temperature_2m'],
-            'humidity': df['weather_relative_humidity_2m'],
-            'apparent_temperature': df['weather_apparent_temperature'],
-            'weather_wind_speed_10m': df['weather_wind_speed_10m'],
-            'hour_integer': df['hour_integer'],
-            'minute': minuto_actual,
-            'hour_geo': hour_geo,
-            'alt': df['alt'],
-            'precipitation_prob': precipitation_prob,
-            'precipitation': df['weather_precipitation']
-        })
-
-        return prob_df.iloc[0].to_dict()
-    
+
+        base = armar_base(ubicacion)
+        # Dentro de la región del raster se responde con un índice, sin clima ni modelo
+        if raster.directorio:
+            respuesta = raster.buscar(ubicacion.lat, ubicacion.lon, base)
+            metricas.RASTER.labels("acierto" if respuesta is not None else "fuera").inc()
+            if respuesta is not None:
+                capturar(ubicacion, llegada, inicio, 200, "raster", respuesta)
+                return respuesta
+
+        filas, respuestas = await _predecir_filas([base], plazo())
+        if 0 not in respuestas:
+            metricas.ERRORES.labels("/predecir").inc()
+            capturar(ubicacion, llegada, inicio, 503, "vivo")
+            return sin_clima()
+
+        capturar(ubicacion, llegada, inicio, 200, "vivo", respuestas[0], filas)
+        return respuestas[0]
+
     except Exception as e:
         logging.error(f"Error durante la predicción: {e}", exc_info=True)
-        return {"error": "Ocurrió un error durante la predicción"}
\ No newline at end of file
+        metricas.ERRORES.labels("/predecir").inc()
+        capturar(ubicacion, llegada, inicio, 500, "vivo")
+        return error_interno()
+
+@app.post("/predecir_lote")
+async def predecir_lote(lote: Lote):
+    try:
+        logging.info(f"Lote recibido: {len(lote.ubicaciones)} ubicaciones")
+        if len(lote.ubicaciones) > MAX_LOTE:
+            return {"error": f"El lote supera el máximo de {MAX_LOTE} ubicaciones"}
+
+        base = [armar_base(ubicacion, id=i) for i, ubicacion in enumerate(lote.ubicaciones)]
+        respuestas = await predecir_filas(base, plazo())
+
+        # Mismo orden que la entrada; las ubicaciones sin datos de clima devuelven error
+        resultados = []
+        for i in range(len(base)):
+            if i in respuestas:
+                resultados.append(respuestas[i])
+            else:
+                resultados.append({"error": "No se pudieron obtener datos meteorológicos"})
+        return {"resultados": resultados}
+
+    except Exception as e:
+        logging.error(f"Error durante la predicción del lote: {e}", exc_info=True)
+        metricas.ERRORES.labels("/predecir_lote").inc()
+        return error_interno()
+
+@app.post("/predecir_horizonte")
+async def predecir_horizonte(horizonte: Horizonte):
+    try:
+        logging.info(f"Horizonte pedido: lat={horizonte.lat}, lon={horizonte.lon}, horas={horizonte.horas}")
+        horas = max(0, min(horizonte.horas, MAX_HORIZONTE))
+
+        # Todas las filas comparten lat/lon, así que obtener_data_clima hace una sola descarga
+        base = [armar_base(Ubicacion(lat=horizonte.lat, lon=horizonte.lon, lead=lead), id=lead)
+                for lead in range(horas + 1)]
+        respuestas = await predecir_filas(base, plazo())
+        if not respuestas:
+            metricas.ERRORES.labels("/predecir_horizonte").inc()
+            return sin_clima()
+
+        timeline = []
+        for lead in sorted(respuestas):
+            fila = respuestas[lead]
+            fila['lead'] = lead
+            timeline.append(fila)
+        return {"horizonte": timeline}
+
+    except Exception as e:
+        logging.error(f"Error durante la predicción del horizonte: {e}", exc_info=True)
+        metricas.ERRORES.labels("/predecir_horizonte").inc()
+        return error_interno()
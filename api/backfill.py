@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+import requests
+import openmeteo_requests
+from retry_requests import retry
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import weather as we
+
+URL_HISTORICO = os.environ.get("OPEN_METEO_HISTORICO_URL", "https://historical-forecast-api.open-meteo.com/v1/forecast")
+
+# Hilos descargando en paralelo
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", 4))
+# Presupuesto de llamadas de Open-Meteo por minuto (plan gratuito: 600/min pero 5000/hora)
+BACKFILL_LLAMADAS_POR_MINUTO = float(os.environ.get("BACKFILL_LLAMADAS_POR_MINUTO", 80))
+# Coordenadas por pedido multi-ubicación
+BACKFILL_COORDS_POR_PEDIDO = int(os.environ.get("BACKFILL_COORDS_POR_PEDIDO", 20))
+BACKFILL_DIRECTORIO = os.environ.get("BACKFILL_DIRECTORIO", ".backfill")
+
+
+class LimitadorTokens:
+    # Token bucket compartido entre hilos: `tasa` tokens por segundo, hasta `capacidad` acumulados
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self._tokens = capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def adquirir(self, costo=1):
+        # Un pedido más caro que el balde entero espera a que se llene y lo deja en negativo,
+        # así los siguientes esperan la diferencia y la tasa promedio se respeta
+        necesario = min(costo, self.capacidad)
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.tasa)
+                self._ultimo = ahora
+                if self._tokens >= necesario:
+                    self._tokens -= costo
+                    return
+                espera = (necesario - self._tokens) / self.tasa
+            time.sleep(espera)
+
+
+def costo_llamadas(n_coords, n_variables, n_dias):
+    # Open-Meteo cuenta cada ubicación como una llamada, y más de 10 variables o 14 días como fracciones extra
+    return n_coords * max(1.0, n_variables / 10) * max(1.0, n_dias / 14)
+
+def armar_tramos(df, coords_por_pedido=BACKFILL_COORDS_POR_PEDIDO, variables=we.VARIABLES_HORARIAS):
+    # Agrupa las filas que comparten (lat, lon, ventana) y junta las ubicaciones de una misma ventana en pedidos multi-coordenada
+    ventanas = {}
+    for indice, row in df.iterrows():
+        current_date = pd.to_datetime(row['date'])
+        # Día anterior y día posterior, como siempre
+        start_date = (current_date - timedelta(days=1)).strftime('%Y-%m-%d')
+        end_date = (current_date + timedelta(days=1)).strftime('%Y-%m-%d')
+        fila = dict(row)
+        fila['_indice'] = indice
+        ventanas.setdefault((start_date, end_date), {}).setdefault((row['lat'], row['lon']), []).append(fila)
+
+    tramos = []
+    for (start_date, end_date), ubicaciones in sorted(ventanas.items()):
+        coords = sorted(ubicaciones)
+        for i in range(0, len(coords), coords_por_pedido):
+            parte = coords[i:i + coords_por_pedido]
+            # El id depende sólo de lo que se pide a Open-Meteo: el checkpoint guarda el clima, no las filas
+            clave = (f"{start_date}|{end_date}|" + ";".join(f"{lat},{lon}" for lat, lon in parte)
+                     + "|" + ",".join(variables))
+            tramos.append({
+                "id": hashlib.sha1(clave.encode()).hexdigest()[:16],
+                "start_date": start_date,
+                "end_date": end_date,
+                "coords": parte,
+                "filas": [ubicaciones[c] for c in parte]
+            })
+    return tramos
+
+
+_local = threading.local()
+
+def _cliente():
+    # Un cliente por hilo y sin requests-cache: los datos históricos se guardan en los checkpoints
+    if not hasattr(_local, "openmeteo"):
+        _local.openmeteo = openmeteo_requests.Client(session=retry(requests.Session(), retries=5, backoff_factor=0.2))
+    return _local.openmeteo
+
+def descargar_tramo(tramo, variables=we.VARIABLES_HORARIAS):
+    params = {
+        "latitude": [lat for lat, _ in tramo["coords"]],
+        "longitude": [lon for _, lon in tramo["coords"]],
+        "start_date": tramo["start_date"],
+        "end_date": tramo["end_date"],
+        "hourly": list(variables),
+        # "models": ["best_match", "ecmwf_aifs025_single", "ecmwf_ifs025", "cma_grapes_global", "bom_access_global", "kma_seamless", "kma_ldps", "kma_gdps", "gfs_seamless", "gfs_global", "gfs_graphcast025", "jma_seamless",
+        #         "jma_gsm", "icon_seamless", "icon_global", "gem_seamless", "gem_global", "meteofrance_seamless", "meteofrance_arpege_world", "knmi_seamless", "dmi_seamless", "ukmo_global_deterministic_10km", "ukmo_seamless"],
+        "timezone": "auto"
+    }
+
+    # Una respuesta por coordenada, en el mismo orden del pedido. Devuelve los DatosHorarios de cada una
+    responses = _cliente().weather_api(URL_HISTORICO, params=params)
+    decodificados = we.decodificar_horarios(responses, params["hourly"])
+    if we.almacen is not None:
+        for (lat, lon), datos in zip(tramo["coords"], decodificados):
+            we.almacen.agregar(lat, lon, datos)
+    return decodificados
+
+def extraer_tramo(tramo, decodificados, variables=we.VARIABLES_HORARIAS):
+    # Filas del df actual con el clima del checkpoint: un df cambiado o extendido se vuelve a extraer entero
+    results = []
+    for datos, filas in zip(decodificados, tramo["filas"]):
+        results.extend(we.extraer_filas(filas, datos, variables))
+    return results
+
+def desde_almacen(df, variables=we.VARIABLES_HORARIAS):
+    # Filas de df cuya celda y hora ya están en el almacén (almacen_clima.py) con todas las variables: se arman
+    # con las mismas columnas que extraer_filas, sin ir a la red. Devuelve (filas armadas, filas que faltan)
+    horas = np.array([we._epoch_dia(fecha) + 3600 * int(hora) for fecha, hora in zip(df['date'], df['hour_integer'])],
+                     dtype=np.int64)
+    valores, utc_offset, elevacion, encontrado = we.almacen.buscar(df['lat'].to_numpy(dtype=float),
+                                                                   df['lon'].to_numpy(dtype=float), horas, variables)
+    locales = df[encontrado]
+    clima = pd.DataFrame(valores[encontrado], columns=[f"weather_{var}" for var in variables], index=locales.index)
+    locales = pd.concat([locales, clima], axis=1).assign(
+        hour_geo=(horas[encontrado] + utc_offset[encontrado]) // 3600 % 24,
+        alt=elevacion[encontrado],
+        _indice=locales.index)
+    return locales, df[~encontrado]
+
+def _ruta(directorio, tramo):
+    return os.path.join(directorio, f"{tramo['id']}.clima.pkl")
+
+def get_data_training(df, directorio=BACKFILL_DIRECTORIO, workers=BACKFILL_WORKERS,
+                      llamadas_por_minuto=BACKFILL_LLAMADAS_POR_MINUTO,
+                      coords_por_pedido=BACKFILL_COORDS_POR_PEDIDO, variables=we.VARIABLES_HORARIAS):
+    os.makedirs(directorio, exist_ok=True)
+    # Con ALMACEN_DIR las filas que ya están en el almacén no se descargan, y lo que se descarga se guarda ahí
+    locales = pd.DataFrame()
+    if we.almacen is not None:
+        locales, df = desde_almacen(df, variables)
+        print(f"{len(locales)} filas armadas desde el almacén de clima")
+        we.almacen.iniciar()
+    tramos = armar_tramos(df, coords_por_pedido, variables)
+    pendientes = [t for t in tramos if not os.path.exists(_ruta(directorio, t))]
+    print(f"{len(df)} filas en {len(tramos)} pedidos; {len(tramos) - len(pendientes)} ya descargados")
+
+    limitador = LimitadorTokens(tasa=llamadas_por_minuto / 60, capacidad=max(1.0, llamadas_por_minuto / 6))
+    n_dias = 3  # día anterior, día objetivo y día posterior
+
+    def procesar(tramo):
+        limitador.adquirir(costo_llamadas(len(tramo["coords"]), len(variables), n_dias))
+        decodificados = descargar_tramo(tramo, variables)
+        # Checkpoint atómico del clima decodificado: el archivo sólo aparece completo
+        ruta = _ruta(directorio, tramo)
+        with open(ruta + ".tmp", "wb") as f:
+            pickle.dump(decodificados, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(ruta + ".tmp", ruta)
+        return len(decodificados)
+
+    hechos = 0
+    with ThreadPoolExecutor(max_workers=workers) as ejecutor:
+        futuros = {ejecutor.submit(procesar, t): t for t in pendientes}
+        for futuro in as_completed(futuros):
+            tramo = futuros[futuro]
+            hechos += 1
+            try:
+                n = futuro.result()
+                print(f"Pedido {hechos} de {len(pendientes)} ({tramo['start_date']}, {n} ubicaciones) - {(hechos/len(pendientes))*100:.1f}% completado")
+            except Exception as e:
+                # Sin checkpoint: se reintenta en la próxima corrida
+                print(f"Error procesando pedido {tramo['id']}: {str(e)}")
+    if we.almacen is not None:
+        we.almacen.detener()
+
+    # La extracción se hace siempre con las filas de esta corrida, también para los tramos ya descargados
+    results = []
+    for tramo in tramos:
+        if os.path.exists(_ruta(directorio, tramo)):
+            with open(_ruta(directorio, tramo), "rb") as f:
+                results.extend(extraer_tramo(tramo, pickle.load(f), variables))
+    partes = [p for p in [pd.DataFrame(results), locales] if not p.empty]
+    if not partes:
+        return pd.DataFrame()
+
+    # Mismo orden que df, como el recorrido fila por fila original. vencido sólo tiene sentido en la API
+    final_df = (pd.concat(partes).sort_values('_indice').drop(columns=['_indice', 'vencido'], errors='ignore')
+                .reset_index(drop=True))
+    return final_df
+
+
+if __name__ == "__main__":
+    # Uso: python backfill.py filas.csv salida.csv  (si se corta, volver a correrlo retoma donde quedó)
+    entrada, salida = sys.argv[1], sys.argv[2]
+    get_data_training(pd.read_csv(entrada)).to_csv(salida, index=False)
@@ -0,0 +1,143 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import OrderedDict
+from cache_compartida import CacheCompartida
+import metricas
+
+# Tamaño de la celda de la grilla en grados (0.05° ≈ 5 km). Con 0 se usa la coordenada exacta
+GRILLA_GRADOS = float(os.environ.get("CACHE_GRILLA", 0.05))
+# Cantidad máxima de celdas en memoria antes de desalojar la menos usada
+CACHE_MAX_CELDAS = int(os.environ.get("CACHE_MAX_CELDAS", 2000))
+# Open-Meteo actualiza sus modelos cada hora; los datos nuevos aparecen unos minutos después
+PERIODO_MODELO = int(os.environ.get("CACHE_PERIODO_MODELO", 3600))
+DEMORA_MODELO = int(os.environ.get("CACHE_DEMORA_MODELO", 600))
+# Corridas viejas que todavía se sirven mientras se refresca la celda en segundo plano (0 lo desactiva)
+CACHE_MAX_CORRIDAS_VENCIDAS = int(os.environ.get("CACHE_MAX_CORRIDAS_VENCIDAS", 3))
+# Archivo de la cache compartida entre workers (ver cache_compartida.py). Vacío: cache sólo en memoria del proceso
+CACHE_COMPARTIDA = os.environ.get("CACHE_COMPARTIDA", "")
+
+
+def celda(lat, lon, grilla=GRILLA_GRADOS):
+    # Ajusta lat/lon al centro de la celda de la grilla
+    if grilla <= 0:
+        return (lat, lon)
+    return (round(round(lat / grilla) * grilla, 4), round(round(lon / grilla) * grilla, 4))
+
+def corrida_actual(ahora=None, periodo=PERIODO_MODELO, demora=DEMORA_MODELO):
+    # Identificador de la última corrida de modelo disponible en Open-Meteo
+    ahora = time.time() if ahora is None else ahora
+    return int((ahora - demora) // periodo)
+
+
+class DatosHorarios:
+    # Arrays horarios ya decodificados de una respuesta de Open-Meteo
+
+    def __init__(self, inicio, fin, intervalo, utc_offset, elevacion, variables):
+        self.inicio = inicio          # epoch (s) de la primera hora
+        self.fin = fin                # epoch (s) final, excluido
+        self.intervalo = intervalo    # segundos entre valores
+        self.utc_offset = utc_offset  # segundos a sumar para obtener la hora local
+        self.elevacion = elevacion
+        self.variables = variables    # {nombre: np.ndarray}
+
+    def cubre(self, desde, hasta):
+        return self.inicio <= desde and hasta < self.fin
+
+    def indices(self, horas):
+        # Posición en los arrays de cada epoch (s) de horas, o -1 si cae fuera de [inicio, fin)
+        horas = np.asarray(horas, dtype=np.int64)
+        indices = (horas - self.inicio) // self.intervalo
+        return np.where((horas >= self.inicio) & (horas < self.fin), indices, -1)
+
+
+class CacheClima:
+    # Cache LRU en memoria de pronósticos horarios por (celda, corrida de modelo).
+    # Con archivo_compartido las entradas viven en un archivo mapeado que comparten todos los workers
+
+    def __init__(self, max_celdas=CACHE_MAX_CELDAS, grilla=GRILLA_GRADOS,
+                 periodo=PERIODO_MODELO, demora=DEMORA_MODELO, archivo_compartido=CACHE_COMPARTIDA):
+        # Sin copia local en el LRU: cada lectura de la cache compartida trae su propia copia del slot
+        self.compartida = CacheCompartida(archivo_compartido) if archivo_compartido else None
+        self.max_celdas = max_celdas
+        self.grilla = grilla
+        self.periodo = periodo
+        self.demora = demora
+        self.aciertos = 0
+        self.fallos = 0
+        self.vencidos = 0
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def celda(self, lat, lon):
+        return celda(lat, lon, self.grilla)
+
+    def obtener(self, lat, lon, variables=None):
+        clave = self.celda(lat, lon)
+        corrida = corrida_actual(periodo=self.periodo, demora=self.demora)
+        if self.compartida is not None:
+            return self._obtener_compartida(clave, corrida, variables)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] != corrida:
+                # Sin datos o de una corrida vieja (se conserva hasta que la desaloje el LRU, para obtener_vencido)
+                self.fallos += 1
+                return None
+            datos = entrada[1]
+            if variables is not None and not all(v in datos.variables for v in variables):
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return datos
+
+    def obtener_vencido(self, lat, lon, variables=None, max_corridas=CACHE_MAX_CORRIDAS_VENCIDAS):
+        # Datos de hasta max_corridas corridas atrás, para servir mientras se refresca (stale-while-revalidate)
+        clave = self.celda(lat, lon)
+        corrida = corrida_actual(periodo=self.periodo, demora=self.demora)
+        if max_corridas <= 0:
+            return None
+        if self.compartida is not None:
+            entrada = self.compartida.obtener(clave[0], clave[1], corrida - max_corridas, variables)
+            datos = DatosHorarios(*entrada[1]) if entrada is not None else None
+        else:
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if entrada is None or entrada[0] < corrida - max_corridas:
+                    return None
+                datos = entrada[1]
+            if variables is not None and not all(v in datos.variables for v in variables):
+                return None
+        if datos is not None:
+            self.vencidos += 1
+        return datos
+
+    def _obtener_compartida(self, clave, corrida, variables):
+        entrada = self.compartida.obtener(clave[0], clave[1], corrida, variables)
+        if entrada is None or entrada[0] != corrida:
+            self.fallos += 1
+            return None
+        self.aciertos += 1
+        return DatosHorarios(*entrada[1])
+
+    def guardar(self, lat, lon, datos):
+        clave = self.celda(lat, lon)
+        corrida = corrida_actual(periodo=self.periodo, demora=self.demora)
+        if self.compartida is not None:
+            self.compartida.guardar(clave[0], clave[1], corrida, datos.inicio, datos.fin, datos.intervalo,
+                                    datos.utc_offset, datos.elevacion, datos.variables)
+            metricas.CELDAS_EN_CACHE.set(len(self))
+            return
+        with self._lock:
+            self._entradas[clave] = (corrida, datos)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_celdas:
+                self._entradas.popitem(last=False)
+            # Explícito y no con set_function: con PROMETHEUS_MULTIPROC_DIR las funciones no se exportan
+            metricas.CELDAS_EN_CACHE.set(len(self._entradas))
+
+    def __len__(self):
+        if self.compartida is not None:
+            return self.compartida.ocupados(corrida_actual(periodo=self.periodo, demora=self.demora))
+        return len(self._entradas)
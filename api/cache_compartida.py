@@ -0,0 +1,173 @@
+import os
+import time
+import zlib
+import mmap
+import fcntl
+import struct
+import threading
+import numpy as np
+
+# Cache de pronósticos compartida entre procesos (workers de gunicorn) en un archivo mapeado en memoria.
+#
+# Formato del archivo:
+#   [encabezado de 64 bytes: MAGICO, cantidad de slots, bytes por slot]
+#   [tabla con una CABECERA por slot]
+#   [datos: por slot, los nombres de las variables (utf-8, alineados a 8) y una matriz float32 variables x horas]
+#
+# Cada celda va a un grupo de SONDEO slots consecutivos según un hash de lat/lon; al guardar se reutiliza el
+# slot de la misma celda, uno libre o de una corrida vieja, o se desaloja el menos usado del grupo.
+# La lectura no toma locks: copia la matriz del slot (~45 KB) y valida el número de secuencia (impar mientras
+# se escribe, se compara antes y después de copiar). No devuelve vistas sobre el mapa porque el mismo slot se
+# reescribe con cada corrida nueva de la celda (desde otro worker o desde un refresco de este mismo proceso) y
+# al cambiar de día cambian inicio y n_horas: quien tuviera índices calculados sobre una vista leería otra hora.
+# Las escrituras se serializan con flock. Un slot usado hace menos de PROTECCION_S no se desaloja.
+
+MAGICO = b"ABRIGO01"
+ENCABEZADO = struct.Struct("<8sqq")
+TAM_ENCABEZADO = 64
+CABECERA = np.dtype([
+    ("secuencia", "<u8"),
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("corrida", "<i8"),
+    ("huella", "<u8"),       # crc32 de la lista de variables
+    ("inicio", "<i8"),
+    ("fin", "<i8"),
+    ("intervalo", "<i4"),
+    ("utc_offset", "<i4"),
+    ("elevacion", "<f4"),
+    ("n_variables", "<i4"),
+    ("n_horas", "<i4"),
+    ("largo_nombres", "<i4"),
+    ("ultimo_uso", "<f8"),
+])
+
+# Cantidad de slots y tamaño de cada uno (66 variables x 7 días de horas en float32 ocupan ~45 KB)
+CACHE_COMPARTIDA_SLOTS = int(os.environ.get("CACHE_COMPARTIDA_SLOTS", 512))
+CACHE_COMPARTIDA_SLOT_KB = int(os.environ.get("CACHE_COMPARTIDA_SLOT_KB", 64))
+SONDEO = 8
+PROTECCION_S = 2.0
+
+
+def huella(variables):
+    return zlib.crc32(",".join(variables).encode())
+
+def _hash_celda(lat, lon):
+    return zlib.crc32(struct.pack("<dd", lat, lon))
+
+
+class CacheCompartida:
+
+    def __init__(self, archivo, slots=CACHE_COMPARTIDA_SLOTS, slot_kb=CACHE_COMPARTIDA_SLOT_KB):
+        self.archivo = archivo
+        self.slots = slots
+        self.slot_bytes = slot_kb * 1024
+        self.tamano = TAM_ENCABEZADO + slots * CABECERA.itemsize + slots * self.slot_bytes
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        # Se abre por proceso: flock es por descriptor y el descriptor heredado del fork lo comparten padre y workers
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.archivo, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.tamano or os.pread(fd, ENCABEZADO.size, 0) != \
+                    ENCABEZADO.pack(MAGICO, self.slots, self.slot_bytes):
+                # Archivo nuevo o con otra geometría: se reinicia vacío
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.tamano)
+                os.pwrite(fd, ENCABEZADO.pack(MAGICO, self.slots, self.slot_bytes), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mapa = mmap.mmap(fd, self.tamano)
+        self._cabeceras = np.frombuffer(self._mapa, dtype=CABECERA, count=self.slots, offset=TAM_ENCABEZADO)
+        self._inicio_datos = TAM_ENCABEZADO + self.slots * CABECERA.itemsize
+        self._pid = os.getpid()
+
+    def _grupo(self, lat, lon):
+        base = _hash_celda(lat, lon) % self.slots
+        return [(base + i) % self.slots for i in range(min(SONDEO, self.slots))]
+
+    def _es_celda(self, c, lat, lon):
+        return c["lat"] == lat and c["lon"] == lon
+
+    def obtener(self, lat, lon, corrida_minima, variables=None):
+        # Devuelve (corrida, (inicio, fin, intervalo, utc_offset, elevacion, {variable: vista})) o None
+        self._abrir()
+        for slot in self._grupo(lat, lon):
+            c = self._cabeceras[slot]
+            secuencia = int(c["secuencia"])
+            if secuencia == 0 or secuencia % 2 or not self._es_celda(c, lat, lon):
+                continue
+            if c["corrida"] < corrida_minima or (variables is not None and c["huella"] != huella(variables)):
+                return None
+            inicio_slot = self._inicio_datos + slot * self.slot_bytes
+            largo_nombres = int(c["largo_nombres"])
+            n_variables, n_horas = int(c["n_variables"]), int(c["n_horas"])
+            if variables is None:
+                nombres = bytes(self._mapa[inicio_slot:inicio_slot + largo_nombres]).rstrip(b"\0")
+                variables = nombres.decode().split(",")
+            matriz = np.frombuffer(self._mapa, dtype=np.float32, count=n_variables * n_horas,
+                                   offset=inicio_slot + largo_nombres).reshape(n_variables, n_horas).copy()
+            resultado = (int(c["corrida"]), (int(c["inicio"]), int(c["fin"]), int(c["intervalo"]),
+                         int(c["utc_offset"]), float(c["elevacion"]), dict(zip(variables, matriz))))
+            if int(c["secuencia"]) != secuencia:
+                # Se escribió mientras copiábamos
+                return None
+            c["ultimo_uso"] = time.time()
+            return resultado
+        return None
+
+    def _elegir_slot(self, lat, lon, corrida, ahora):
+        grupo = self._grupo(lat, lon)
+        for slot in grupo:
+            if self._es_celda(self._cabeceras[slot], lat, lon):
+                return slot
+        for slot in grupo:
+            c = self._cabeceras[slot]
+            if c["secuencia"] == 0 or c["corrida"] != corrida:
+                return slot
+        slot = min(grupo, key=lambda s: self._cabeceras[s]["ultimo_uso"])
+        if ahora - self._cabeceras[slot]["ultimo_uso"] < PROTECCION_S:
+            return None
+        return slot
+
+    def guardar(self, lat, lon, corrida, inicio, fin, intervalo, utc_offset, elevacion, variables):
+        # variables: {nombre: array}; devuelve False si no entra en un slot o el grupo está todo en uso
+        nombres = ",".join(variables).encode()
+        largo_nombres = (len(nombres) + 7) // 8 * 8
+        matriz = np.asarray(list(variables.values()), dtype=np.float32)
+        if largo_nombres + matriz.nbytes > self.slot_bytes:
+            return False
+
+        self._abrir()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                ahora = time.time()
+                slot = self._elegir_slot(lat, lon, corrida, ahora)
+                if slot is None:
+                    return False
+                c = self._cabeceras[slot]
+                c["secuencia"] += 1
+                inicio_slot = self._inicio_datos + slot * self.slot_bytes
+                self._mapa[inicio_slot:inicio_slot + largo_nombres] = nombres.ljust(largo_nombres, b"\0")
+                desde = inicio_slot + largo_nombres
+                self._mapa[desde:desde + matriz.nbytes] = matriz.tobytes()
+                c["lat"], c["lon"], c["corrida"], c["huella"] = lat, lon, corrida, huella(variables)
+                c["inicio"], c["fin"], c["intervalo"], c["utc_offset"] = inicio, fin, intervalo, utc_offset
+                c["elevacion"] = elevacion
+                c["n_variables"], c["n_horas"] = matriz.shape
+                c["largo_nombres"] = largo_nombres
+                c["ultimo_uso"] = ahora
+                c["secuencia"] += 1
+                return True
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def ocupados(self, corrida):
+        self._abrir()
+        return int(np.count_nonzero((self._cabeceras["secuencia"] > 0) & (self._cabeceras["corrida"] == corrida)))
@@ -0,0 +1,124 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import numpy as np
+import metricas
+
+# Captura del tráfico de /predecir: cada pedido, sus features ya resueltas y la respuesta se encolan sin bloquear
+# y un hilo aparte los escribe como JSON por línea. bench/reproducir.py vuelve a mandar un log capturado
+
+# Directorio de los logs. Vacío: no se captura
+CAPTURA_DIR = os.environ.get("CAPTURA_DIR", "")
+# Proporción de pedidos que se capturan (1 = todos)
+CAPTURA_MUESTREO = float(os.environ.get("CAPTURA_MUESTREO", 1.0))
+# Registros esperando al escritor; con la cola llena se descartan en lugar de frenar el pedido
+CAPTURA_COLA = int(os.environ.get("CAPTURA_COLA", 10000))
+# Tamaño a partir del cual se empieza otro archivo
+CAPTURA_ROTAR_MB = float(os.environ.get("CAPTURA_ROTAR_MB", 100))
+# Registros que el escritor junta antes de escribir y hacer flush
+CAPTURA_TANDA = 256
+
+
+def _a_json(registro):
+    # Las variables de clima son escalares de numpy: pasarlas antes a float evita que json.dumps llame a
+    # default por cada una. Lo que queda (fechas) va como texto
+    features = registro.get("features")
+    if features:
+        registro = dict(registro, features={k: v.item() if isinstance(v, np.generic) else v for k, v in features.items()})
+    return json.dumps(registro, default=str, ensure_ascii=False)
+
+
+class CapturaPedidos:
+
+    def __init__(self, directorio=CAPTURA_DIR, muestreo=CAPTURA_MUESTREO, max_cola=CAPTURA_COLA,
+                 rotar_mb=CAPTURA_ROTAR_MB):
+        self.directorio = directorio
+        self.muestreo = muestreo
+        self.rotar_bytes = int(rotar_mb * 1024 * 1024)
+        self.escritos = 0
+        self.descartados = 0
+        self._cola = queue.Queue(max_cola)
+        self._hilo = None
+        self._archivo = None
+        self._ruta = None
+        self._parte = 0
+
+    def iniciar(self):
+        # Se llama desde el startup de cada worker: con gunicorn --preload el hilo no sobreviviría al fork
+        if not self.directorio or self._hilo is not None:
+            return
+        os.makedirs(self.directorio, exist_ok=True)
+        self._hilo = threading.Thread(target=self._escribir, name="captura", daemon=True)
+        self._hilo.start()
+        logging.info(f"Capturando pedidos en {self.directorio} (muestreo {self.muestreo})")
+
+    def detener(self, timeout=5.0):
+        if self._hilo is None:
+            return
+        try:
+            self._cola.put(None, timeout=timeout)
+        except queue.Full:
+            logging.warning(f"Captura: la cola no se vació a tiempo, se pierden {self._cola.qsize()} registros")
+        self._hilo.join(timeout)
+        self._hilo = None
+
+    def registrar(self, registro):
+        # Desde el event loop: sólo encola. La serialización y la escritura las hace el hilo
+        if self._hilo is None or (self.muestreo < 1.0 and random.random() >= self.muestreo):
+            return
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+            metricas.CAPTURA.labels("descartado").inc()
+
+    def _abrir(self):
+        if self._archivo is not None:
+            self._archivo.close()
+        self._parte += 1
+        # Un archivo por proceso: con varios workers nadie escribe en el archivo de otro
+        nombre = f"captura_{time.strftime('%Y%m%dT%H%M%S')}_{os.getpid()}_{self._parte:03d}.jsonl"
+        self._ruta = os.path.join(self.directorio, nombre)
+        self._archivo = open(self._ruta, "a", encoding="utf-8")
+
+    def _escribir(self):
+        self._abrir()
+        terminar = False
+        while not terminar:
+            tanda = [self._cola.get()]
+            while len(tanda) < CAPTURA_TANDA:
+                try:
+                    tanda.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            if None in tanda:
+                terminar = True
+                tanda = [r for r in tanda if r is not None]
+            try:
+                self._archivo.write("".join(_a_json(r) + "\n" for r in tanda))
+                self._archivo.flush()
+                self.escritos += len(tanda)
+                metricas.CAPTURA.labels("escrito").inc(len(tanda))
+                if self._archivo.tell() >= self.rotar_bytes:
+                    self._abrir()
+            except (OSError, TypeError, ValueError) as e:
+                self.descartados += len(tanda)
+                metricas.CAPTURA.labels("descartado").inc(len(tanda))
+                logging.error(f"Error escribiendo la captura: {e}")
+        self._archivo.close()
+        self._archivo = None
+
+    def estadisticas(self):
+        return {
+            "activa": self._hilo is not None,
+            "directorio": self.directorio,
+            "archivo": self._ruta,
+            "muestreo": self.muestreo,
+            "en_cola": self._cola.qsize(),
+            "escritos": self.escritos,
+            "descartados": self.descartados,
+        }
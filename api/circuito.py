@@ -0,0 +1,78 @@
+import os
+import time
+import logging
+import metricas
+
+# Fallas seguidas de Open-Meteo que abren el circuito
+CIRCUITO_FALLAS = int(os.environ.get("CIRCUITO_FALLAS", 5))
+# Segundos que el circuito queda abierto antes de dejar pasar un pedido de prueba
+CIRCUITO_ESPERA_S = float(os.environ.get("CIRCUITO_ESPERA_S", 30))
+
+CERRADO, SEMIABIERTO, ABIERTO = "cerrado", "semiabierto", "abierto"
+
+
+class CircuitoAbierto(Exception):
+    pass
+
+
+class Circuito:
+    # Corta los pedidos a Open-Meteo después de varias fallas seguidas, para que un incidente del lado de
+    # Open-Meteo no deje cada pedido esperando timeouts y reintentos. Pasado CIRCUITO_ESPERA_S deja pasar
+    # un solo pedido de prueba (semiabierto): si sale bien se cierra, si falla vuelve a abrirse
+
+    def __init__(self, fallas=CIRCUITO_FALLAS, espera=CIRCUITO_ESPERA_S):
+        self.fallas = fallas
+        self.espera = espera
+        self.estado = CERRADO
+        self.aperturas = 0
+        self._seguidas = 0
+        self._abierto_desde = 0.0
+        self._prueba_en_curso = False
+        metricas.ESTADO_CIRCUITO.set(0)
+
+    def permitir(self):
+        if self.estado == CERRADO:
+            return True
+        if self.estado == ABIERTO and time.monotonic() - self._abierto_desde >= self.espera:
+            self._cambiar(SEMIABIERTO)
+        if self.estado == SEMIABIERTO and not self._prueba_en_curso:
+            self._prueba_en_curso = True
+            return True
+        return False
+
+    def verificar(self):
+        if not self.permitir():
+            raise CircuitoAbierto("Circuito de Open-Meteo abierto")
+
+    def exito(self):
+        self._seguidas = 0
+        self._prueba_en_curso = False
+        if self.estado != CERRADO:
+            self._cambiar(CERRADO)
+
+    def falla(self):
+        self._seguidas += 1
+        self._prueba_en_curso = False
+        if self.estado == SEMIABIERTO or (self.estado == CERRADO and self._seguidas >= self.fallas):
+            self._abierto_desde = time.monotonic()
+            self.aperturas += 1
+            metricas.APERTURAS_CIRCUITO.inc()
+            self._cambiar(ABIERTO)
+
+    def liberar(self):
+        # El pedido terminó sin resultado (cancelado): no cuenta como falla, pero si era la prueba del
+        # semiabierto el próximo pedido puede hacerla. Sin esto el circuito rechazaría todo para siempre
+        self._prueba_en_curso = False
+
+    def _cambiar(self, estado):
+        logging.warning(f"Circuito de Open-Meteo: {self.estado} -> {estado} ({self._seguidas} fallas seguidas)")
+        self.estado = estado
+        metricas.ESTADO_CIRCUITO.set({CERRADO: 0, SEMIABIERTO: 1, ABIERTO: 2}[estado])
+
+    def estadisticas(self):
+        return {
+            "estado": self.estado,
+            "fallas_seguidas": self._seguidas,
+            "aperturas": self.aperturas,
+            "abierto_hace_s": time.monotonic() - self._abierto_desde if self.estado != CERRADO else None,
+        }
@@ -0,0 +1,60 @@
+import numpy as np
+from operator import itemgetter
+from catboost import Pool
+
+ESTACIONES = {12: 'summer', 1: 'summer', 2: 'summer',
+              3: 'fall', 4: 'fall', 5: 'fall',
+              6: 'winter', 7: 'winter', 8: 'winter',
+              9: 'spring', 10: 'spring', 11: 'spring'}
+
+
+class EnsambladorFeatures:
+    # Arma la entrada del modelo directamente desde los diccionarios de cada fila, sin pasar por pandas
+
+    def __init__(self, esquema):
+        self.features = esquema.features
+        self.cat_features = [self.features.index(c) for c in esquema.categoricas]
+        # Getter precompilado: saca de cada fila los valores en el orden exacto del modelo
+        self._valores = itemgetter(*self.features)
+
+    def armar(self, filas):
+        datos = np.empty((len(filas), len(self.features)), dtype=object)
+        for i, fila in enumerate(filas):
+            fila['season'] = ESTACIONES[fila['month']]
+            datos[i] = self._valores(fila)
+        return Pool(datos, cat_features=self.cat_features)
+
+    def armar_columnas(self, columnas, n, etiquetas=None):
+        # Como armar pero desde un array (o un valor fijo) por feature, para lotes grandes como el del raster.
+        # Con etiquetas sirve para entrenar (reentrenar.py): CatBoost pide los nombres para seguir desde un modelo
+        datos = np.empty((n, len(self.features)), dtype=object)
+        for k, feature in enumerate(self.features):
+            datos[:, k] = columnas[feature]
+        return Pool(datos, label=etiquetas, cat_features=self.cat_features, feature_names=self.features)
+
+
+def armar_respuestas(filas, pred, clases):
+    # Lee la respuesta de cada fila directamente del array de probabilidades
+    orden = np.argsort(pred, axis=1)
+    respuestas = {}
+    for fila, p, o in zip(filas, pred, orden):
+        primera, segunda = o[-1], o[-2]
+        respuestas[fila['id']] = {
+            'prob_1st': float(p[primera]),
+            'class_1st': str(clases[primera]),
+            'prob_2nd': float(p[segunda]),
+            'class_2nd': str(clases[segunda]),
+            'temperature': float(fila['weather_temperature_2m']),
+            'humidity': float(fila['weather_relative_humidity_2m']),
+            'apparent_temperature': float(fila['weather_apparent_temperature']),
+            'weather_wind_speed_10m': float(fila['weather_wind_speed_10m']),
+            'hour_integer': int(fila['hour_integer']),
+            'minute': int(fila['minute']),
+            'hour_geo': int(fila['hour_geo']),
+            'alt': float(fila['alt']),
+            'precipitation_prob': float((fila['weather_rain'] + fila['weather_snowfall'] + fila['weather_showers']) / 3.0),
+            'precipitation': float(fila['weather_precipitation']),
+            # True si el clima es de una corrida anterior (Open-Meteo no respondió a tiempo)
+            'vencido': bool(fila.get('vencido', False))
+        }
+    return respuestas
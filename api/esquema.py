@@ -0,0 +1,39 @@
+# Esquema de features derivado del modelo: define qué variables se piden a Open-Meteo y en qué orden se arma cada fila
+
+PREFIJO_CLIMA = "weather_"
+# Features del modelo que no salen de Open-Meteo
+FEATURES_BASE = ['Ambiente', 'alt', 'Half_of_day', 'hour_integer', 'season']
+FEATURES_CATEGORICAS = ['Ambiente', 'Half_of_day', 'season']
+# Variables que la respuesta de la API necesita aunque el modelo no las use
+VARIABLES_RESPUESTA = ['temperature_2m', 'relative_humidity_2m', 'apparent_temperature', 'wind_speed_10m',
+                       'precipitation', 'rain', 'snowfall', 'showers']
+
+
+class EsquemaFeatures:
+
+    def __init__(self, features, categoricas):
+        self.features = list(features)
+        self.categoricas = list(categoricas)
+        self.variables_modelo = [f[len(PREFIJO_CLIMA):] for f in self.features if f.startswith(PREFIJO_CLIMA)]
+        # Variables a pedir y decodificar: las del modelo y después las que sólo usa la respuesta
+        self.variables = self.variables_modelo + [v for v in VARIABLES_RESPUESTA if v not in self.variables_modelo]
+
+    @classmethod
+    def desde_modelo(cls, model):
+        features = model.feature_names_
+        categoricas = [features[i] for i in model.get_cat_feature_indices()]
+        return cls(features, categoricas)
+
+    def validar(self, variables_disponibles):
+        # Falla al arrancar si el modelo pide algo que la API no sabe construir
+        desconocidas = [f for f in self.features
+                        if not f.startswith(PREFIJO_CLIMA) and f not in FEATURES_BASE]
+        if desconocidas:
+            raise ValueError(f"El modelo usa features que la API no sabe construir: {desconocidas}")
+
+        sin_origen = [v for v in self.variables if v not in variables_disponibles]
+        if sin_origen:
+            raise ValueError(f"Variables sin equivalente en Open-Meteo: {sin_origen}")
+
+        if sorted(self.categoricas) != sorted(c for c in FEATURES_CATEGORICAS if c in self.features):
+            raise ValueError(f"Features categóricas del modelo inesperadas: {self.categoricas}")
@@ -0,0 +1,53 @@
+import os
+import gc
+import sys
+import shutil
+import tempfile
+import subprocess
+
+# Arranque con gunicorn: el modelo se carga y se calienta una sola vez en el proceso padre (preload_app)
+# y los workers de uvicorn lo comparten por copy-on-write después del fork
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 60
+
+# Cache de clima compartida entre workers (cache_compartida.py). En /dev/shm vive en memoria y, como las
+# entradas se identifican por corrida de modelo, sigue sirviendo después de un reinicio
+_directorio_cache = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+os.environ.setdefault("CACHE_COMPARTIDA", os.path.join(_directorio_cache, "abrigo_cache_clima"))
+
+# Métricas con varios workers: cada proceso escribe las suyas en este directorio y /metrics las suma.
+# Se vacía antes de importar la app para no mezclar corridas anteriores
+_directorio_metricas = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if _directorio_metricas:
+    shutil.rmtree(_directorio_metricas, ignore_errors=True)
+    os.makedirs(_directorio_metricas)
+
+
+# Con RASTER_DIR y RASTER_GENERAR=1 el raster de recomendaciones se regenera en un proceso aparte del mismo
+# dyno (los workers lo leen del disco local), con menor prioridad de CPU que los workers. Cada dyno gasta
+# su propio RASTER_MAX_LLAMADAS_DIA de Open-Meteo: el consumo total es ese por la cantidad de dynos
+_generador_raster = None
+
+
+def when_ready(server):
+    global _generador_raster
+    # Lo cargado hasta acá (modelo incluido) pasa a la generación permanente del GC: los workers no lo
+    # recorren en cada colección y esas páginas no se copian, siguen compartidas con el padre
+    gc.freeze()
+    if os.environ.get("RASTER_DIR") and os.environ.get("RASTER_GENERAR") == "1":
+        os.makedirs(os.environ["RASTER_DIR"], exist_ok=True)
+        _generador_raster = subprocess.Popen([sys.executable, "raster.py", "--bucle"])
+        server.log.info(f"Generador del raster iniciado (pid {_generador_raster.pid})")
+
+def on_exit(server):
+    if _generador_raster is not None:
+        _generador_raster.terminate()
+
+def child_exit(server, worker):
+    if _directorio_metricas:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
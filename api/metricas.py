@@ -0,0 +1,79 @@
+import os
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+# Métricas de la API en formato Prometheus (expuestas en /metrics)
+
+# De 0.5 ms (armar el Pool) a 10 s (timeout de Open-Meteo)
+BUCKETS_SEGUNDOS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Etapas de una predicción:
+#   clima: todo obtener_filas_clima_async (cache + descargas + extracción)
+#   open_meteo: pedido HTTP a Open-Meteo, incluyendo reintentos
+#   decodificacion: FlatBuffers -> arrays de numpy
+#   extraccion: buscar la hora pedida y armar las filas con las variables de clima
+#   espera_lote: tiempo en la cola del planificador hasta entrar en un lote
+#   armado: filas -> Pool de CatBoost
+#   inferencia: model.predict_proba
+#   respuesta: probabilidades -> diccionarios de respuesta
+ETAPAS = ["clima", "open_meteo", "decodificacion", "extraccion", "espera_lote", "armado", "inferencia", "respuesta"]
+
+LATENCIA_ETAPA = Histogram("abrigo_etapa_segundos", "Duración de cada etapa de una predicción",
+                           ["etapa"], buckets=BUCKETS_SEGUNDOS)
+LATENCIA_PEDIDO = Histogram("abrigo_pedido_segundos", "Duración total de cada pedido HTTP",
+                            ["endpoint"], buckets=BUCKETS_SEGUNDOS)
+ERRORES = Counter("abrigo_errores", "Pedidos que terminaron con error", ["endpoint"])
+
+# "vencido": fallos que se respondieron con datos de una corrida anterior mientras se refresca
+# "respaldo": Open-Meteo falló, se agotó el plazo o el circuito está abierto y se usó la última corrida guardada
+CACHE_CLIMA = Counter("abrigo_cache_clima", "Consultas a la cache de clima", ["resultado"])
+DESCARGAS_COMPARTIDAS = Counter("abrigo_descargas_compartidas",
+                                "Pedidos que esperaron una descarga igual ya en curso (single-flight)")
+PEDIDOS_OPEN_METEO = Counter("abrigo_open_meteo_pedidos", "Pedidos HTTP a Open-Meteo", ["resultado"])
+REINTENTOS_OPEN_METEO = Counter("abrigo_open_meteo_reintentos", "Reintentos de pedidos a Open-Meteo", ["motivo"])
+PLAZOS_AGOTADOS = Counter("abrigo_plazos_agotados", "Celdas cuyo clima no llegó dentro del plazo del pedido")
+# 0 cerrado, 1 semiabierto, 2 abierto (con varios workers se muestra el peor)
+ESTADO_CIRCUITO = Gauge("abrigo_circuito_open_meteo", "Estado del circuito de Open-Meteo", multiprocess_mode="max")
+APERTURAS_CIRCUITO = Counter("abrigo_circuito_open_meteo_aperturas", "Veces que se abrió el circuito de Open-Meteo")
+
+REFRESCOS = Counter("abrigo_refrescos", "Celdas calientes refrescadas en segundo plano", ["resultado"])
+# "acierto": /predecir respondió desde el raster precalculado; "fuera": ubicación u hora fuera del raster
+RASTER = Counter("abrigo_raster", "Consultas al raster de recomendaciones", ["resultado"])
+# "escrito": registro guardado en el log de captura; "descartado": cola llena o error de escritura
+CAPTURA = Counter("abrigo_captura", "Pedidos capturados para reproducir (captura.py)", ["resultado"])
+# Filas (celda x hora) del almacén de clima: "escrita" o "descartada" (cola llena o error de escritura)
+ALMACEN = Counter("abrigo_almacen_clima", "Filas guardadas en el almacén de clima (almacen_clima.py)", ["resultado"])
+# Modelos nuevos vistos por cada worker: "cargado", "rechazado" (features o clases distintas) o "error"
+MODELO = Counter("abrigo_modelo_recargas", "Cambios de modelo en caliente (modelos.py)", ["resultado"])
+
+FILAS_POR_LOTE = Histogram("abrigo_lote_filas", "Filas por lote de inferencia",
+                           buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+# Se actualiza al guardar (cache_clima.py) y en cada /metrics. Con caches por worker se suman los vivos; con la
+# cache compartida todos ven las mismas celdas y se muestra el último valor escrito
+CELDAS_EN_CACHE = Gauge("abrigo_cache_clima_celdas", "Celdas guardadas en la cache de clima",
+                        multiprocess_mode="livemostrecent" if os.environ.get("CACHE_COMPARTIDA") else "livesum")
+
+# Hijos por etapa creados una vez, para no resolver labels en cada observación
+_por_etapa = {etapa: LATENCIA_ETAPA.labels(etapa) for etapa in ETAPAS}
+
+
+@contextmanager
+def medir(etapa):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _por_etapa[etapa].observe(time.perf_counter() - inicio)
+
+def observar(etapa, segundos):
+    _por_etapa[etapa].observe(segundos)
+
+def exportar():
+    # Con varios workers (gunicorn_conf.py) cada proceso escribe en PROMETHEUS_MULTIPROC_DIR y acá se suman
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+        return generate_latest(registro), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from catboost import CatBoostClassifier
+from esquema import EsquemaFeatures
+import metricas
+
+# Modelos promovidos por reentrenar.py: cada versión es un .cbm que no se modifica y actual.json apunta a la
+# vigente. La API y el raster cargan la vigente al arrancar y después miran cada MODELO_RECARGA_S si cambió.
+# El cambio es una sola asignación: cada lote se puntúa entero con el modelo viejo o con el nuevo
+
+# Directorio de los modelos promovidos. Vacío (o sin actual.json): se usa el modelo incluido en el repo
+MODELO_DIR = os.environ.get("MODELO_DIR", "")
+# Cada cuánto cada worker mira si hay un modelo nuevo
+MODELO_RECARGA_S = float(os.environ.get("MODELO_RECARGA_S", 30))
+# Versiones viejas que se conservan para volver atrás (python reentrenar.py volver VERSION)
+MODELO_CONSERVAR = 3
+
+# Modelo incluido en el repo: el vigente sin MODELO_DIR y la base del primer reentrenamiento
+MODELO_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelo_catboost3.cbm")
+ARCHIVO_ACTUAL = "actual.json"
+
+
+def leer_actual(directorio=MODELO_DIR):
+    # (versión, ruta del .cbm) del modelo vigente
+    if directorio:
+        try:
+            with open(os.path.join(directorio, ARCHIVO_ACTUAL)) as f:
+                version = json.load(f)["version"]
+            return version, os.path.join(directorio, f"{version}.cbm")
+        except (OSError, ValueError, KeyError):
+            pass
+    return "base", MODELO_BASE
+
+def cargar(ruta):
+    model = CatBoostClassifier()
+    model.load_model(ruta)
+    return model
+
+def incompatibilidad(actual, nuevo):
+    # Las variables que se piden a Open-Meteo, el armado de las filas y las clases de la respuesta salen del
+    # modelo cargado al arrancar: un modelo que cambie cualquiera de esas cosas necesita un deploy
+    a, b = EsquemaFeatures.desde_modelo(actual), EsquemaFeatures.desde_modelo(nuevo)
+    if a.features != b.features or a.categoricas != b.categoricas:
+        return "features distintas"
+    if list(actual.classes_) != list(nuevo.classes_):
+        return "clases distintas"
+    return None
+
+def versiones(directorio):
+    # De la más vieja a la más nueva (el nombre empieza con la fecha)
+    return sorted(archivo[:-4] for archivo in os.listdir(directorio) if archivo.endswith(".cbm"))
+
+def apuntar(directorio, version, meta=None):
+    # Puntero atómico: los workers leen el actual.json anterior o el nuevo, nunca uno a medias
+    temporal = os.path.join(directorio, f".{ARCHIVO_ACTUAL}")
+    with open(temporal, "w") as f:
+        json.dump(dict(meta or {}, version=version, publicado=time.time()), f)
+    os.replace(temporal, os.path.join(directorio, ARCHIVO_ACTUAL))
+
+def publicar(model, directorio, meta=None):
+    # Como el raster: primero el .cbm completo, después el puntero
+    os.makedirs(directorio, exist_ok=True)
+    # Con microsegundos: dos promociones seguidas no pisan el mismo archivo
+    version = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}_{os.getpid()}"
+    ruta = os.path.join(directorio, f"{version}.cbm")
+    model.save_model(ruta + ".tmp")
+    os.replace(ruta + ".tmp", ruta)
+    apuntar(directorio, version, meta)
+    for vieja in versiones(directorio)[:-(MODELO_CONSERVAR + 1)]:
+        os.remove(os.path.join(directorio, f"{vieja}.cbm"))
+    return version
+
+
+class ModeloActivo:
+    # El modelo que usa este proceso. Quien puntúa lee self.model una vez por lote y lo usa hasta terminar;
+    # el modelo nuevo se carga y se calienta en otro hilo y sólo después reemplaza a la referencia
+
+    def __init__(self, directorio=MODELO_DIR, recarga=MODELO_RECARGA_S, calentar=None):
+        self.directorio = directorio
+        self.recarga = recarga
+        self.calentar = calentar  # función: modelo -> None, una predicción sintética antes de atender con él
+        self.version, ruta = leer_actual(directorio)
+        self.model = cargar(ruta)
+        self.cargado = time.time()
+        self.recargas = 0
+        self.rechazada = None
+        self._tarea = None
+
+    def actualizar(self):
+        # Bloqueante (carga el .cbm): desde el event loop va en un hilo. True si cambió el modelo
+        version, ruta = leer_actual(self.directorio)
+        if version in (self.version, self.rechazada):
+            return False
+        inicio = time.perf_counter()
+        nuevo = cargar(ruta)
+        motivo = incompatibilidad(self.model, nuevo)
+        if motivo is not None:
+            # Se sigue con el modelo actual y no se vuelve a intentar con esta versión
+            self.rechazada = version
+            metricas.MODELO.labels("rechazado").inc()
+            logging.error(f"Modelo {version} rechazado: {motivo}")
+            return False
+        if self.calentar is not None:
+            self.calentar(nuevo)
+        self.model = nuevo
+        self.version = version
+        self.cargado = time.time()
+        self.recargas += 1
+        metricas.MODELO.labels("cargado").inc()
+        logging.info(f"Modelo {version} cargado en {time.perf_counter() - inicio:.2f} s")
+        return True
+
+    def iniciar(self):
+        # Desde el startup de cada worker, como el refrescador
+        if self.directorio and self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    async def _bucle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.recarga)
+            try:
+                await loop.run_in_executor(None, self.actualizar)
+            except Exception as e:
+                metricas.MODELO.labels("error").inc()
+                logging.error(f"Error cargando un modelo nuevo: {e}", exc_info=True)
+
+    def estadisticas(self):
+        return {
+            "version": self.version,
+            "directorio": self.directorio,
+            "arboles": self.model.tree_count_,
+            "cargado_hace_s": time.time() - self.cargado,
+            "recargas": self.recargas,
+            "rechazada": self.rechazada,
+        }
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import metricas
+
+# Cuánto esperar a que lleguen otros pedidos antes de llamar al modelo (0 desactiva el micro-batching)
+LOTE_VENTANA_MS = float(os.environ.get("LOTE_VENTANA_MS", 5))
+# Filas a partir de las cuales el lote sale sin esperar el resto de la ventana
+LOTE_MAX_FILAS = int(os.environ.get("LOTE_MAX_FILAS", 256))
+
+
+class PlanificadorInferencia:
+    # Junta las filas de pedidos concurrentes y las puntúa con un solo predict_proba
+
+    def __init__(self, predecir, ventana_ms=LOTE_VENTANA_MS, max_filas=LOTE_MAX_FILAS):
+        self.predecir = predecir  # función: lista de filas -> array de probabilidades
+        self.ventana = ventana_ms / 1000
+        self.max_filas = max_filas
+        # Un único hilo para el modelo: mientras puntúa un lote, el event loop junta el siguiente
+        self._ejecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inferencia")
+        self._cola = None
+        self._tarea = None
+        self.lotes = 0
+        self.filas = 0
+        self.pedidos = 0
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.lotes_separados = 0
+
+    async def puntuar(self, filas):
+        if self.ventana <= 0:
+            return await asyncio.get_running_loop().run_in_executor(self._ejecutor, self.predecir, filas)
+        if self._tarea is None:
+            self._cola = asyncio.Queue()
+            self._tarea = asyncio.create_task(self._bucle())
+        futuro = asyncio.get_running_loop().create_future()
+        await self._cola.put((filas, futuro, time.perf_counter()))
+        return await futuro
+
+    async def _juntar(self):
+        pendientes = [await self._cola.get()]
+        n = len(pendientes[0][0])
+        limite = time.perf_counter() + self.ventana
+        while n < self.max_filas:
+            restante = limite - time.perf_counter()
+            if restante <= 0:
+                break
+            try:
+                pedido = await asyncio.wait_for(self._cola.get(), restante)
+            except asyncio.TimeoutError:
+                break
+            pendientes.append(pedido)
+            n += len(pedido[0])
+        return pendientes
+
+    async def _bucle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pendientes = await self._juntar()
+            filas = [fila for pedido in pendientes for fila in pedido[0]]
+
+            inicio = time.perf_counter()
+            for _, _, llegada in pendientes:
+                espera = inicio - llegada
+                metricas.observar("espera_lote", espera)
+                self.espera_total += espera
+                self.espera_max = max(self.espera_max, espera)
+            self.lotes += 1
+            self.pedidos += len(pendientes)
+            self.filas += len(filas)
+            metricas.FILAS_POR_LOTE.observe(len(filas))
+
+            try:
+                pred = await loop.run_in_executor(self._ejecutor, self.predecir, filas)
+            except Exception as e:
+                if len(pendientes) == 1:
+                    logging.error(f"Error en el lote de inferencia: {e}", exc_info=True)
+                    if not pendientes[0][1].done():
+                        pendientes[0][1].set_exception(e)
+                    continue
+                # Una fila mala no tiene que hacer fallar a los demás pedidos del lote
+                logging.warning(f"Error en un lote de {len(pendientes)} pedidos ({e}): se puntúan por separado")
+                self.lotes_separados += 1
+                await self._puntuar_separados(pendientes)
+                continue
+
+            # Devolver a cada pedido su porción del resultado
+            desde = 0
+            for filas_pedido, futuro, _ in pendientes:
+                hasta = desde + len(filas_pedido)
+                if not futuro.done():
+                    futuro.set_result(pred[desde:hasta])
+                desde = hasta
+
+    async def _puntuar_separados(self, pendientes):
+        loop = asyncio.get_running_loop()
+        for filas_pedido, futuro, _ in pendientes:
+            if futuro.done():
+                continue
+            try:
+                pred = await loop.run_in_executor(self._ejecutor, self.predecir, filas_pedido)
+            except Exception as e:
+                logging.error(f"Error en la inferencia de un pedido: {e}", exc_info=True)
+                if not futuro.done():
+                    futuro.set_exception(e)
+                continue
+            if not futuro.done():
+                futuro.set_result(pred)
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+        self._ejecutor.shutdown(wait=False)
+
+    def estadisticas(self):
+        lotes = max(self.lotes, 1)
+        pedidos = max(self.pedidos, 1)
+        return {
+            "ventana_ms": self.ventana * 1000,
+            "max_filas": self.max_filas,
+            "lotes": self.lotes,
+            "pedidos": self.pedidos,
+            "filas": self.filas,
+            "filas_por_lote": self.filas / lotes,
+            "llenado_lote": self.filas / lotes / self.max_filas,
+            "espera_promedio_ms": self.espera_total / pedidos * 1000,
+            "espera_max_ms": self.espera_max * 1000,
+            "lotes_separados": self.lotes_separados
+        }
@@ -0,0 +1,357 @@
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import asyncio
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from numpy.lib.format import open_memmap
+import weather as we
+from cache_clima import PERIODO_MODELO, DEMORA_MODELO, corrida_actual
+from backfill import costo_llamadas
+from ensamblador import ESTACIONES
+from esquema import PREFIJO_CLIMA
+
+# Raster de recomendaciones precalculadas: para cada celda de una grilla regional y cada hora de las próximas
+# RASTER_HORAS se guardan las probabilidades por clase (float16) y las variables de la respuesta.
+# Un proceso aparte lo regenera cada hora (python raster.py --bucle) y /predecir lo consulta con un índice
+
+# Directorio del raster. Vacío: /predecir no lo usa
+RASTER_DIR = os.environ.get("RASTER_DIR", "")
+# Región "lat_min,lat_max,lon_min,lon_max" y paso de la grilla en grados. Cada celda es una ubicación
+# en el pedido a Open-Meteo, así que el tamaño de la región define cuántas llamadas se consumen por hora.
+# Por defecto CABA y alrededores: 4x4 celdas, unas 100 llamadas por generación
+RASTER_REGION = os.environ.get("RASTER_REGION", "-34.75,-34.45,-58.6,-58.3")
+RASTER_PASO = float(os.environ.get("RASTER_PASO", 0.1))
+# Llamadas a Open-Meteo por día que puede gastar el generador (plan gratuito: 10000/día). Es por proceso:
+# con RASTER_GENERAR=1 cada dyno corre su propio generador y el consumo se multiplica por la cantidad de dynos
+RASTER_MAX_LLAMADAS_DIA = float(os.environ.get("RASTER_MAX_LLAMADAS_DIA", 3000))
+# Horas desde la de generación (cubre leads de 0 a 48 aunque redondeen a la hora siguiente)
+RASTER_HORAS = int(os.environ.get("RASTER_HORAS", 50))
+# Coordenadas por pedido multi-ubicación a Open-Meteo (cada pedido se puntúa en un solo predict_proba)
+RASTER_COORDENADAS_POR_PEDIDO = int(os.environ.get("RASTER_COORDENADAS_POR_PEDIDO", 50))
+# Cada cuánto la API mira si hay un raster nuevo, y edad máxima con la que todavía se usa
+RASTER_RECARGA_S = float(os.environ.get("RASTER_RECARGA_S", 30))
+RASTER_MAX_EDAD_S = float(os.environ.get("RASTER_MAX_EDAD_S", 3 * 3600))
+# Versiones viejas que se conservan (un worker puede tener la anterior abierta)
+RASTER_CONSERVAR = 2
+
+# Columnas de auxiliares.npy, con los mismos nombres que la respuesta de /predecir
+AUXILIARES = ["temperature", "humidity", "apparent_temperature", "weather_wind_speed_10m",
+              "precipitation_prob", "precipitation"]
+ARCHIVO_ACTUAL = "actual.json"
+
+
+def region(texto=RASTER_REGION):
+    lat_min, lat_max, lon_min, lon_max = map(float, texto.split(","))
+    return lat_min, lat_max, lon_min, lon_max
+
+def grilla(texto=RASTER_REGION, paso=RASTER_PASO):
+    lat_min, lat_max, lon_min, lon_max = region(texto)
+    lats = np.round(lat_min + paso * np.arange(int(round((lat_max - lat_min) / paso)) + 1), 4)
+    lons = np.round(lon_min + paso * np.arange(int(round((lon_max - lon_min) / paso)) + 1), 4)
+    return lats, lons
+
+def hora_objetivo(base):
+    # Hora (en horas desde epoch, UTC) que usa la fila de armar_base para buscar el clima
+    fecha = datetime(base['date'].year, base['date'].month, base['date'].day, tzinfo=timezone.utc)
+    return int(fecha.timestamp()) // 3600 + base['hour_integer']
+
+
+class GeneradorRaster:
+    # Descarga la región en pedidos multi-ubicación y puntúa celda x hora en lotes grandes
+
+    def __init__(self, modelo, ensamblador, variables, directorio=RASTER_DIR, texto_region=RASTER_REGION,
+                 paso=RASTER_PASO, n_horas=RASTER_HORAS, por_pedido=RASTER_COORDENADAS_POR_PEDIDO):
+        self.modelo = modelo  # ModeloActivo (modelos.py)
+        self.ensamblador = ensamblador
+        self.variables = variables
+        self.directorio = directorio
+        self.region = texto_region
+        self.paso = paso
+        self.n_horas = n_horas
+        self.por_pedido = por_pedido
+
+    def llamadas_por_dia(self, periodo=PERIODO_MODELO):
+        # Costo de una generación como lo cuenta Open-Meteo (celdas, variables y días de la ventana) por las
+        # generaciones de un día, una por corrida
+        lats, lons = grilla(self.region, self.paso)
+        ahora = pd.Timestamp.now(tz="UTC")
+        params = we._params_forecast("", "", ahora, ahora, self.variables)
+        n_dias = (pd.Timestamp(params["end_date"]) - pd.Timestamp(params["start_date"])).days + 1
+        return costo_llamadas(len(lats) * len(lons), len(self.variables), n_dias) * 86400 / periodo
+
+    def verificar_presupuesto(self, maximo=RASTER_MAX_LLAMADAS_DIA):
+        llamadas = self.llamadas_por_dia()
+        if llamadas > maximo:
+            raise ValueError(f"El raster de {self.region} con paso {self.paso} consume {llamadas:.0f} llamadas "
+                             f"por día y el máximo es {maximo:.0f} (RASTER_MAX_LLAMADAS_DIA): achicar "
+                             f"RASTER_REGION o agrandar RASTER_PASO")
+        return llamadas
+
+    async def _descargar(self, celdas):
+        lats = ",".join(str(lat) for lat, _ in celdas)
+        lons = ",".join(str(lon) for _, lon in celdas)
+        ahora = pd.Timestamp.now(tz="UTC")
+        params = we._params_forecast(lats, lons, ahora, ahora, self.variables)
+        responses = await we.weather_api_async(we.URL_FORECAST, params)
+        datos_celdas = we.decodificar_horarios(responses, self.variables)
+        if we.almacen is not None:
+            for (lat, lon), datos in zip(celdas, datos_celdas):
+                we.almacen.agregar(lat, lon, datos)
+        return datos_celdas
+
+    def _columnas_tiempo(self, h0):
+        fechas = [datetime.fromtimestamp((h0 + t) * 3600, timezone.utc) for t in range(self.n_horas)]
+        horas = np.array([f.hour for f in fechas])
+        return {
+            'Ambiente': 'afuera',
+            'hour_integer': horas,
+            'Half_of_day': np.where(horas < 12, 'AM', 'PM').astype(object),
+            'season': np.array([ESTACIONES[f.month] for f in fechas], dtype=object),
+        }
+
+    def _puntuar(self, model, h0, datos_celdas, tiempo):
+        # datos_celdas: [DatosHorarios] que cubren las n_horas desde h0. Devuelve (probabilidades, auxiliares)
+        n, h = len(datos_celdas), self.n_horas
+        clima = {}
+        for var in self.variables:
+            clima[var] = np.stack([
+                d.variables[var][(h0 * 3600 - d.inicio) // d.intervalo:][:h] for d in datos_celdas
+            ]).astype(np.float32)
+        columnas = {f"{PREFIJO_CLIMA}{var}": valores.ravel() for var, valores in clima.items()}
+        columnas.update({nombre: np.tile(valor, n) if isinstance(valor, np.ndarray) else valor
+                         for nombre, valor in tiempo.items()})
+        columnas['alt'] = np.repeat([d.elevacion for d in datos_celdas], h)
+        pred = model.predict_proba(self.ensamblador.armar_columnas(columnas, n * h))
+
+        auxiliares = np.stack([
+            clima['temperature_2m'], clima['relative_humidity_2m'], clima['apparent_temperature'],
+            clima['wind_speed_10m'], (clima['rain'] + clima['snowfall'] + clima['showers']) / 3.0,
+            clima['precipitation'],
+        ], axis=-1)
+        return pred.reshape(n, h, -1), auxiliares
+
+    async def generar(self):
+        inicio = time.perf_counter()
+        h0 = int(time.time() // 3600)
+        lats, lons = grilla(self.region, self.paso)
+        loop = asyncio.get_running_loop()
+        # Un modelo promovido se toma entre generaciones, nunca en medio de una
+        try:
+            await loop.run_in_executor(None, self.modelo.actualizar)
+        except Exception as e:
+            logging.error(f"Error cargando un modelo nuevo para el raster: {e}", exc_info=True)
+        model, version_modelo = self.modelo.model, self.modelo.version
+        clases = [str(c) for c in model.classes_]
+        version = f"{h0}_{os.getpid()}"
+        temporal = os.path.join(self.directorio, f".{version}")
+        os.makedirs(temporal, exist_ok=True)
+
+        forma = (self.n_horas, len(lats), len(lons))
+        probabilidades = open_memmap(os.path.join(temporal, "probabilidades.npy"), "w+", np.float16,
+                                     forma + (len(clases),))
+        auxiliares = open_memmap(os.path.join(temporal, "auxiliares.npy"), "w+", np.float16,
+                                 forma + (len(AUXILIARES),))
+        altura = open_memmap(os.path.join(temporal, "altura.npy"), "w+", np.float32, forma[1:])
+        utc_offset = open_memmap(os.path.join(temporal, "utc_offset.npy"), "w+", np.int32, forma[1:])
+        probabilidades[:] = np.nan
+        auxiliares[:] = np.nan
+        altura[:] = np.nan
+
+        indices = [(i, j) for i in range(len(lats)) for j in range(len(lons))]
+        tandas = [indices[k:k + self.por_pedido] for k in range(0, len(indices), self.por_pedido)]
+        tiempo = self._columnas_tiempo(h0)
+        fallidas = 0
+
+        # Mientras se puntúa una tanda (en un hilo) ya se está descargando la siguiente
+        siguiente = asyncio.ensure_future(self._descargar([(lats[i], lons[j]) for i, j in tandas[0]]))
+        for k, tanda in enumerate(tandas):
+            descarga = siguiente
+            if k + 1 < len(tandas):
+                siguiente = asyncio.ensure_future(self._descargar([(lats[i], lons[j]) for i, j in tandas[k + 1]]))
+            try:
+                datos = await descarga
+            except Exception as e:
+                logging.error(f"Raster: no se pudo descargar la tanda {k}: {e}")
+                fallidas += len(tanda)
+                continue
+
+            validas = [(ij, d) for ij, d in zip(tanda, datos)
+                       if d.inicio <= h0 * 3600 and (h0 + self.n_horas) * 3600 <= d.fin]
+            fallidas += len(tanda) - len(validas)
+            if not validas:
+                continue
+            pred, aux = await loop.run_in_executor(None, self._puntuar, model, h0, [d for _, d in validas], tiempo)
+            for n, ((i, j), d) in enumerate(validas):
+                probabilidades[:, i, j] = pred[n]
+                auxiliares[:, i, j] = aux[n]
+                altura[i, j] = d.elevacion
+                utc_offset[i, j] = d.utc_offset
+
+        for array in (probabilidades, auxiliares, altura, utc_offset):
+            array.flush()
+        meta = {"version": version, "hora_inicio": h0, "n_horas": self.n_horas, "lat_min": float(lats[0]),
+                "lon_min": float(lons[0]), "paso": self.paso, "n_lat": len(lats), "n_lon": len(lons),
+                "clases": clases, "modelo": version_modelo, "auxiliares": AUXILIARES, "creado": time.time(),
+                "celdas_fallidas": fallidas}
+        with open(os.path.join(temporal, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        # Publicación atómica: primero el directorio completo, después el puntero que leen los workers
+        os.replace(temporal, os.path.join(self.directorio, version))
+        with open(os.path.join(self.directorio, f".{ARCHIVO_ACTUAL}"), "w") as f:
+            json.dump({"version": version}, f)
+        os.replace(os.path.join(self.directorio, f".{ARCHIVO_ACTUAL}"), os.path.join(self.directorio, ARCHIVO_ACTUAL))
+        self._limpiar(version)
+        logging.info(f"Raster {version}: {len(indices)} celdas x {self.n_horas} horas en {len(tandas)} pedidos, "
+                     f"{fallidas} celdas sin datos, {time.perf_counter() - inicio:.1f} s")
+        return meta
+
+    def _limpiar(self, version):
+        versiones = sorted((v for v in os.listdir(self.directorio) if v[0].isdigit() and v != version),
+                           key=lambda v: int(v.split("_")[0]))
+        for vieja in versiones[:max(0, len(versiones) - RASTER_CONSERVAR + 1)]:
+            shutil.rmtree(os.path.join(self.directorio, vieja), ignore_errors=True)
+
+    async def bucle(self, periodo=PERIODO_MODELO, demora=DEMORA_MODELO):
+        # Una generación ahora y otra por cada corrida nueva de Open-Meteo
+        while True:
+            try:
+                await self.generar()
+            except Exception as e:
+                logging.error(f"Error generando el raster: {e}", exc_info=True)
+            proxima = (corrida_actual(periodo=periodo, demora=demora) + 1) * periodo + demora
+            await asyncio.sleep(max(0.0, proxima - time.time()) + random.uniform(0, 60))
+
+
+class RasterRecomendaciones:
+    # Lectura del raster desde los workers: arrays mapeados en memoria (compartidos entre procesos por el
+    # page cache) y búsqueda por índice. Devuelve None si la ubicación u hora caen fuera del raster
+
+    def __init__(self, directorio=RASTER_DIR, recarga=RASTER_RECARGA_S, max_edad=RASTER_MAX_EDAD_S):
+        self.directorio = directorio
+        self.recarga = recarga
+        self.max_edad = max_edad
+        self.meta = None
+        self._revisado = 0.0
+        self._probabilidades = None
+        self._auxiliares = None
+        self._altura = None
+        self._utc_offset = None
+
+    def _revisar(self):
+        if self.directorio and time.monotonic() - self._revisado > self.recarga:
+            self._cargar()
+
+    def _cargar(self):
+        self._revisado = time.monotonic()
+        try:
+            with open(os.path.join(self.directorio, ARCHIVO_ACTUAL)) as f:
+                version = json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            return
+        if self.meta is not None and self.meta["version"] == version:
+            return
+        ruta = os.path.join(self.directorio, version)
+        try:
+            with open(os.path.join(ruta, "meta.json")) as f:
+                meta = json.load(f)
+            # Vistas ndarray del mapeo: indexar un np.memmap crea objetos memmap y cuesta varias veces más
+            self._probabilidades = np.load(os.path.join(ruta, "probabilidades.npy"), mmap_mode="r").view(np.ndarray)
+            self._auxiliares = np.load(os.path.join(ruta, "auxiliares.npy"), mmap_mode="r").view(np.ndarray)
+            self._altura = np.load(os.path.join(ruta, "altura.npy"), mmap_mode="r").view(np.ndarray)
+            self._utc_offset = np.load(os.path.join(ruta, "utc_offset.npy"), mmap_mode="r").view(np.ndarray)
+        except (OSError, ValueError) as e:
+            logging.warning(f"No se pudo abrir el raster {version}: {e}")
+            return
+        self.meta = meta
+        logging.info(f"Raster {version} cargado: {meta['n_lat']}x{meta['n_lon']} celdas, {meta['n_horas']} horas")
+
+    def buscar(self, lat, lon, base):
+        self._revisar()
+        meta = self.meta
+        if meta is None or time.time() - meta["creado"] > self.max_edad:
+            return None
+
+        i = round((lat - meta["lat_min"]) / meta["paso"])
+        j = round((lon - meta["lon_min"]) / meta["paso"])
+        # El raster deriva Half_of_day de hour_integer; /predecir lo saca de la hora sin redondear, así que
+        # entre las 11:30 y las 11:59 UTC (hour_integer 12 pero AM) y entre las 23:30 y las 23:59 (hour_integer 0
+        # pero PM) la fila no está en el raster
+        if base['Half_of_day'] != ('AM' if base['hour_integer'] < 12 else 'PM'):
+            return None
+        hora = hora_objetivo(base)
+        t = hora - meta["hora_inicio"]
+        if not (0 <= i < meta["n_lat"] and 0 <= j < meta["n_lon"] and 0 <= t < meta["n_horas"]):
+            return None
+        p = self._probabilidades[t, i, j].astype(np.float32)
+        if np.isnan(p[0]):
+            return None
+
+        orden = np.argsort(p)
+        primera, segunda = orden[-1], orden[-2]
+        respuesta = {
+            'prob_1st': float(p[primera]),
+            'class_1st': meta["clases"][primera],
+            'prob_2nd': float(p[segunda]),
+            'class_2nd': meta["clases"][segunda],
+        }
+        respuesta.update(zip(AUXILIARES, self._auxiliares[t, i, j].astype(float).tolist()))
+        respuesta.update({
+            'hour_integer': int(base['hour_integer']),
+            'minute': int(base['minute']),
+            'hour_geo': int((hora * 3600 + int(self._utc_offset[i, j])) // 3600 % 24),
+            'alt': float(self._altura[i, j]),
+            'vencido': False,
+        })
+        return respuesta
+
+    def estadisticas(self):
+        self._revisar()
+        if self.meta is None:
+            return {"cargado": False, "directorio": self.directorio}
+        return dict(self.meta, cargado=True, edad_s=time.time() - self.meta["creado"])
+
+
+def crear_generador(directorio=RASTER_DIR):
+    # Carga el modelo igual que api.py (el vigente de MODELO_DIR) pero sin importar la app
+    from modelos import ModeloActivo
+    from esquema import EsquemaFeatures
+    from ensamblador import EnsambladorFeatures
+    modelo = ModeloActivo()
+    esquema = EsquemaFeatures.desde_modelo(modelo.model)
+    return GeneradorRaster(modelo, EnsambladorFeatures(esquema), esquema.variables, directorio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera el raster de recomendaciones precalculadas")
+    parser.add_argument("--directorio", default=RASTER_DIR or "raster")
+    parser.add_argument("--bucle", action="store_true", help="regenerar con cada corrida nueva de Open-Meteo")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    os.makedirs(args.directorio, exist_ok=True)
+    generador = crear_generador(args.directorio)
+    try:
+        logging.info(f"Raster: {generador.verificar_presupuesto():.0f} llamadas por día a Open-Meteo")
+    except ValueError as e:
+        sys.exit(str(e))
+    if we.almacen is not None:
+        # Las celdas de cada pasada van al almacén en pocos archivos, no en uno por pedido
+        we.almacen.iniciar()
+    try:
+        if args.bucle:
+            # Debajo de los workers en prioridad de CPU: el raster puede esperar, un pedido no
+            os.nice(10)
+            asyncio.run(generador.bucle())
+        else:
+            meta = asyncio.run(generador.generar())
+            print(json.dumps({k: v for k, v in meta.items() if k != "clases"}), file=sys.stdout)
+    finally:
+        if we.almacen is not None:
+            we.almacen.detener()
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from catboost import CatBoostClassifier
+from esquema import EsquemaFeatures, PREFIJO_CLIMA
+from ensamblador import EnsambladorFeatures, ESTACIONES
+import modelos
+
+# Reentrenamiento incremental: sigue entrenando el modelo vigente (init_model de CatBoost) con filas nuevas
+# etiquetadas, con las columnas de get_data_training (backfill.py) más la prenda elegida. Antes de promover
+# compara el candidato con el vigente en precisión sobre una parte reservada de las filas nuevas, y con el
+# modelo del repo en latencia y tamaño; si pasa, lo publica en MODELO_DIR y la API y el raster lo toman sin
+# reiniciar (modelos.py)
+
+# Árboles que se agregan al modelo vigente
+REENTRENO_ITERACIONES = int(os.environ.get("REENTRENO_ITERACIONES", 200))
+# Tasa de aprendizaje de los árboles nuevos (menor que la del modelo original, para no desarmar lo aprendido)
+REENTRENO_TASA = float(os.environ.get("REENTRENO_TASA", 0.05))
+# Proporción de las filas nuevas que no se usa para entrenar y sirve para comparar los dos modelos
+REENTRENO_RESERVA = float(os.environ.get("REENTRENO_RESERVA", 0.2))
+# Cuántas veces más lento (p50 de predict_proba) y más pesado (.cbm) que el modelo del repo puede ser el
+# candidato. Contra el del repo y no contra el vigente: cada reentrenamiento agrega árboles, y comparado con
+# el anterior siempre pasaría. Con 1.5 entran unos 2 reentrenamientos de 200 árboles; después hace falta un
+# entrenamiento completo que reemplace a modelo_catboost3.cbm
+REENTRENO_MAX_LATENCIA = float(os.environ.get("REENTRENO_MAX_LATENCIA", 1.3))
+REENTRENO_MAX_TAMANO = float(os.environ.get("REENTRENO_MAX_TAMANO", 1.5))
+# Precisión en la reserva que puede perder el candidato respecto del vigente
+REENTRENO_MAX_PERDIDA = float(os.environ.get("REENTRENO_MAX_PERDIDA", 0.0))
+# Columna con la etiqueta (una de las clases del modelo vigente)
+REENTRENO_ETIQUETA = os.environ.get("REENTRENO_ETIQUETA", "abrigo")
+# Filas por predict_proba al medir la latencia: un pedido suelto y un lote lleno del planificador
+FILAS_LATENCIA = {1: 300, 256: 30}
+
+
+def preparar(df, esquema, clases, etiqueta=REENTRENO_ETIQUETA):
+    # Deja las filas listas para armar_columnas: season como la arma el ensamblador y sólo etiquetas conocidas
+    df = df.copy()
+    if "season" not in df:
+        meses = df["month"] if "month" in df else pd.to_datetime(df["date"]).dt.month
+        df["season"] = meses.map(ESTACIONES)
+    faltan = [c for c in esquema.features + [etiqueta] if c not in df]
+    if faltan:
+        raise ValueError(f"Faltan columnas en las filas nuevas: {faltan}")
+    df = df.dropna(subset=esquema.features + [etiqueta])
+    # Una clase nueva cambia la salida del modelo (y la respuesta de la API): eso es un entrenamiento completo
+    conocidas = df[etiqueta].isin(clases)
+    if not conocidas.all():
+        logging.warning(f"Se descartan {int((~conocidas).sum())} filas con etiquetas que el modelo no conoce: "
+                        f"{sorted(df.loc[~conocidas, etiqueta].astype(str).unique())}")
+    return df[conocidas].reset_index(drop=True)
+
+def armar_pool(df, ensamblador, etiqueta=None):
+    columnas = {feature: df[feature].to_numpy() for feature in ensamblador.features}
+    return ensamblador.armar_columnas(columnas, len(df), None if etiqueta is None else df[etiqueta].to_numpy())
+
+def dividir(df, reserva=REENTRENO_RESERVA, semilla=0):
+    orden = np.random.default_rng(semilla).permutation(len(df))
+    corte = int(round(len(df) * reserva))
+    return df.iloc[orden[corte:]], df.iloc[orden[:corte]]
+
+def completar_clases(df, clases, etiqueta=REENTRENO_ETIQUETA):
+    # CatBoost dimensiona la salida con las clases presentes en los datos y con init_model tienen que ser todas
+    # las del vigente (unas semanas de verano no traen "camperon"): por cada clase ausente se agrega una fila
+    # con peso 0, que no cambia el ajuste. Devuelve (filas, pesos)
+    presentes = set(df[etiqueta])
+    faltan = [c for c in clases if c not in presentes]
+    anclas = df.iloc[[0] * len(faltan)].assign(**{etiqueta: faltan})
+    return pd.concat([df, anclas], ignore_index=True), np.r_[np.ones(len(df)), np.zeros(len(faltan))]
+
+def entrenar(actual, df, ensamblador, iteraciones=REENTRENO_ITERACIONES, tasa=REENTRENO_TASA,
+             etiqueta=REENTRENO_ETIQUETA):
+    # Mismos parámetros que el vigente (profundidad, pérdida, semilla); init_model agrega árboles a los suyos
+    df, pesos = completar_clases(df, actual.classes_, etiqueta)
+    pool = armar_pool(df, ensamblador, etiqueta)
+    pool.set_weight(pesos)
+    parametros = dict(actual.get_params(), iterations=iteraciones, learning_rate=tasa, verbose=0,
+                      class_names=list(actual.classes_), allow_writing_files=False)
+    candidato = CatBoostClassifier(**parametros)
+    candidato.fit(pool, init_model=actual)
+    return candidato
+
+def evaluar(model, pool, etiquetas):
+    pred = model.predict_proba(pool)
+    indices = pd.Index(model.classes_).get_indexer(etiquetas)
+    return {
+        "precision": float(np.mean(model.classes_[pred.argmax(axis=1)] == etiquetas)),
+        "logloss": float(-np.mean(np.log(np.clip(pred[np.arange(len(pred)), indices], 1e-15, None)))),
+    }
+
+def medir_latencias(modelos_a_medir, df, ensamblador):
+    # p50 de predict_proba (armado incluido, como en puntuar) por modelo y tamaño de lote. Las mediciones de
+    # los modelos se intercalan para que el ruido de la máquina les toque a todos por igual
+    resultado = {}
+    for filas, repeticiones in FILAS_LATENCIA.items():
+        muestra = df.iloc[np.arange(filas) % len(df)]
+        tiempos = [[] for _ in modelos_a_medir]
+        for _ in range(repeticiones):
+            for k, model in enumerate(modelos_a_medir):
+                inicio = time.perf_counter()
+                model.predict_proba(armar_pool(muestra, ensamblador))
+                tiempos[k].append(time.perf_counter() - inicio)
+        resultado[filas] = [float(np.median(t)) * 1000 for t in tiempos]
+    return resultado
+
+def tamano(model):
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "modelo.cbm")
+        model.save_model(ruta)
+        return os.path.getsize(ruta)
+
+def comparar(actual, candidato, reserva, ensamblador, referencia=None, etiqueta=REENTRENO_ETIQUETA,
+             max_latencia=REENTRENO_MAX_LATENCIA, max_tamano=REENTRENO_MAX_TAMANO, max_perdida=REENTRENO_MAX_PERDIDA):
+    # Las tres compuertas de la promoción: precisión contra el vigente, latencia y tamaño contra la referencia
+    # (el modelo del repo; sin referencia, el vigente). Devuelve el reporte con los motivos de rechazo (vacío si pasa)
+    referencia = actual if referencia is None else referencia
+    reporte, motivos = {"filas_reserva": len(reserva)}, []
+    pool = armar_pool(reserva, ensamblador)
+    etiquetas = reserva[etiqueta].to_numpy()
+    for nombre, model in [("vigente", actual), ("candidato", candidato)]:
+        for metrica, valor in evaluar(model, pool, etiquetas).items():
+            reporte[f"{metrica}_{nombre}"] = valor
+    if reporte["precision_candidato"] < reporte["precision_vigente"] - max_perdida:
+        motivos.append(f"precisión {reporte['precision_candidato']:.3f} < {reporte['precision_vigente']:.3f}")
+
+    for filas, (referencia_ms, candidato_ms) in medir_latencias([referencia, candidato], reserva, ensamblador).items():
+        reporte[f"latencia_{filas}_referencia_ms"] = referencia_ms
+        reporte[f"latencia_{filas}_candidato_ms"] = candidato_ms
+        if candidato_ms > referencia_ms * max_latencia:
+            motivos.append(f"latencia con {filas} filas {candidato_ms:.2f} ms > "
+                           f"{max_latencia} x {referencia_ms:.2f} ms")
+
+    reporte["tamano_referencia_kb"] = tamano(referencia) / 1024
+    reporte["tamano_vigente_kb"] = tamano(actual) / 1024
+    reporte["tamano_candidato_kb"] = tamano(candidato) / 1024
+    if reporte["tamano_candidato_kb"] > reporte["tamano_referencia_kb"] * max_tamano:
+        motivos.append(f"tamaño {reporte['tamano_candidato_kb']:.0f} KB > "
+                       f"{max_tamano} x {reporte['tamano_referencia_kb']:.0f} KB")
+    reporte["arboles_referencia"] = referencia.tree_count_
+    reporte["arboles_vigente"] = actual.tree_count_
+    reporte["arboles_candidato"] = candidato.tree_count_
+    reporte["motivos"] = motivos
+    reporte["aprobado"] = not motivos
+    return reporte
+
+def reentrenar(df, directorio=modelos.MODELO_DIR, promover=True, iteraciones=REENTRENO_ITERACIONES,
+               tasa=REENTRENO_TASA, reserva=REENTRENO_RESERVA, etiqueta=REENTRENO_ETIQUETA):
+    # Pipeline completo: filas nuevas -> candidato -> compuertas -> publicación. Devuelve el reporte
+    version_base, ruta = modelos.leer_actual(directorio)
+    actual = modelos.cargar(ruta)
+    referencia = actual if ruta == modelos.MODELO_BASE else modelos.cargar(modelos.MODELO_BASE)
+    esquema = EsquemaFeatures.desde_modelo(actual)
+    ensamblador = EnsambladorFeatures(esquema)
+
+    if not any(c.startswith(PREFIJO_CLIMA) for c in df.columns):
+        # Filas sin clima: se completan como las del entrenamiento original (almacén de clima o Open-Meteo)
+        import backfill
+        df = backfill.get_data_training(df)
+    df = preparar(df, esquema, actual.classes_, etiqueta)
+    entrenamiento, reservadas = dividir(df, reserva)
+    if len(entrenamiento) == 0 or len(reservadas) == 0:
+        raise ValueError(f"Pocas filas para entrenar y comparar: {len(entrenamiento)} y {len(reservadas)}")
+
+    inicio = time.perf_counter()
+    candidato = entrenar(actual, entrenamiento, ensamblador, iteraciones, tasa, etiqueta)
+    reporte = {"base": version_base, "filas_entrenamiento": len(entrenamiento),
+               "entrenamiento_s": time.perf_counter() - inicio}
+    reporte.update(comparar(actual, candidato, reservadas, ensamblador, referencia, etiqueta))
+
+    if reporte["aprobado"] and promover:
+        if not directorio:
+            raise ValueError("Falta MODELO_DIR para publicar el modelo")
+        reporte["version"] = modelos.publicar(candidato, directorio, {"base": version_base, "reporte": reporte})
+        logging.info(f"Modelo {reporte['version']} promovido (base {version_base})")
+    elif not reporte["aprobado"]:
+        logging.warning(f"Candidato rechazado: {'; '.join(reporte['motivos'])}")
+    return reporte
+
+
+if __name__ == "__main__":
+    # Uso: python reentrenar.py entrenar filas.csv [--probar] | estado | volver VERSION
+    parser = argparse.ArgumentParser(description="Reentrenamiento incremental y promoción del modelo")
+    parser.add_argument("accion", choices=["entrenar", "estado", "volver"])
+    parser.add_argument("argumento", nargs="?", help="CSV de filas etiquetadas (entrenar) o versión (volver)")
+    parser.add_argument("--directorio", default=modelos.MODELO_DIR)
+    parser.add_argument("--iteraciones", type=int, default=REENTRENO_ITERACIONES)
+    parser.add_argument("--tasa", type=float, default=REENTRENO_TASA)
+    parser.add_argument("--probar", action="store_true", help="entrenar y comparar sin promover")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.accion == "entrenar":
+        if not args.argumento:
+            sys.exit("Falta el CSV con las filas etiquetadas")
+        reporte = reentrenar(pd.read_csv(args.argumento), args.directorio, not args.probar, args.iteraciones, args.tasa)
+        print(json.dumps(reporte, indent=2, ensure_ascii=False))
+        sys.exit(0 if reporte["aprobado"] else 1)
+    if not args.directorio:
+        sys.exit("Falta MODELO_DIR o --directorio")
+    if args.accion == "volver":
+        # Sin compuertas: la versión ya estuvo publicada
+        if args.argumento not in modelos.versiones(args.directorio):
+            sys.exit(f"No existe la versión {args.argumento}")
+        modelos.apuntar(args.directorio, args.argumento, {"base": "volver"})
+    version, _ = modelos.leer_actual(args.directorio)
+    print(json.dumps({"vigente": version, "versiones": modelos.versiones(args.directorio)}, indent=2))
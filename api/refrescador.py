@@ -0,0 +1,117 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from cache_clima import PERIODO_MODELO, DEMORA_MODELO, corrida_actual
+import metricas
+
+# Celdas que se refrescan como máximo en cada corrida nueva de Open-Meteo
+REFRESCO_PRESUPUESTO = int(os.environ.get("REFRESCO_PRESUPUESTO", 50))
+# Descargas simultáneas del refresco (comparten el límite de llamadas con los pedidos de usuarios)
+REFRESCO_CONCURRENCIA = int(os.environ.get("REFRESCO_CONCURRENCIA", 4))
+# Pedidos (con decaimiento) que necesita una celda para considerarse caliente
+REFRESCO_MIN_PEDIDOS = float(os.environ.get("REFRESCO_MIN_PEDIDOS", 2))
+# Vida media del conteo de pedidos por celda, en segundos
+REFRESCO_VIDA_MEDIA = float(os.environ.get("REFRESCO_VIDA_MEDIA", 6 * 3600))
+# Espera aleatoria extra al inicio de cada ciclo, para que los workers no refresquen todos a la vez
+REFRESCO_DISPERSION = float(os.environ.get("REFRESCO_DISPERSION", 60))
+# Celdas seguidas como máximo (se descartan las más frías)
+REFRESCO_MAX_CELDAS = 10000
+
+
+class RefrescadorClima:
+    # Cuenta los pedidos por celda y, cuando sale una corrida nueva, vuelve a descargar las más pedidas
+    # antes de que un usuario se encuentre con la cache vencida
+
+    def __init__(self, refrescar, presupuesto=REFRESCO_PRESUPUESTO, concurrencia=REFRESCO_CONCURRENCIA,
+                 min_pedidos=REFRESCO_MIN_PEDIDOS, vida_media=REFRESCO_VIDA_MEDIA,
+                 periodo=PERIODO_MODELO, demora=DEMORA_MODELO, dispersion=REFRESCO_DISPERSION):
+        self.refrescar = refrescar  # corrutina: (lat, lon) -> True si descargó
+        self.presupuesto = presupuesto
+        self.concurrencia = concurrencia
+        self.min_pedidos = min_pedidos
+        self.vida_media = vida_media
+        self.periodo = periodo
+        self.demora = demora
+        self.dispersion = dispersion
+        self._celdas = {}  # celda -> (puntaje, momento del último pedido)
+        self._tarea = None
+        self.ciclos = 0
+        self.refrescadas = 0
+        self.errores = 0
+
+    def _puntaje(self, celda, ahora):
+        puntaje, momento = self._celdas.get(celda, (0.0, ahora))
+        return puntaje * 0.5 ** ((ahora - momento) / self.vida_media)
+
+    def registrar(self, celdas):
+        ahora = time.time()
+        for celda in set(celdas):
+            self._celdas[celda] = (self._puntaje(celda, ahora) + 1, ahora)
+        if len(self._celdas) > REFRESCO_MAX_CELDAS:
+            self._celdas = {celda: (puntaje, ahora) for celda, puntaje in
+                            self.calientes(REFRESCO_MAX_CELDAS // 2, minimo=0)}
+
+    def calientes(self, n=None, minimo=None):
+        # Las n celdas con más pedidos recientes (todas si n es None), con su puntaje
+        ahora = time.time()
+        minimo = self.min_pedidos if minimo is None else minimo
+        puntajes = ((celda, self._puntaje(celda, ahora)) for celda in self._celdas)
+        ordenadas = sorted((p for p in puntajes if p[1] >= minimo), key=lambda p: p[1], reverse=True)
+        return ordenadas[:n]
+
+    def iniciar(self):
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    def _hasta_proxima_corrida(self):
+        # Segundos hasta que corrida_actual cambie, es decir hasta que Open-Meteo publique la siguiente
+        proxima = (corrida_actual(periodo=self.periodo, demora=self.demora) + 1) * self.periodo + self.demora
+        return max(0.0, proxima - time.time())
+
+    async def _bucle(self):
+        while True:
+            await asyncio.sleep(self._hasta_proxima_corrida() + random.uniform(0, self.dispersion))
+            try:
+                await self.refrescar_calientes()
+            except Exception as e:
+                logging.error(f"Error en el ciclo de refresco: {e}", exc_info=True)
+
+    async def refrescar_calientes(self):
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        celdas = [celda for celda, _ in self.calientes(self.presupuesto)]
+
+        async def refrescar(celda):
+            async with semaforo:
+                try:
+                    descargo = await self.refrescar(*celda)
+                except Exception as e:
+                    self.errores += 1
+                    metricas.REFRESCOS.labels("error").inc()
+                    logging.warning(f"No se pudo refrescar la celda {celda}: {e}")
+                    return
+                self.refrescadas += descargo
+                metricas.REFRESCOS.labels("descargada" if descargo else "al_dia").inc()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*[refrescar(celda) for celda in celdas])
+        self.ciclos += 1
+        logging.info(f"Refresco de {len(celdas)} celdas calientes en {time.perf_counter() - inicio:.1f} s")
+
+    def estadisticas(self):
+        return {
+            "celdas_seguidas": len(self._celdas),
+            "celdas_calientes": len(self.calientes()),
+            "presupuesto": self.presupuesto,
+            "concurrencia": self.concurrencia,
+            "proximo_ciclo_s": self._hasta_proxima_corrida(),
+            "ciclos": self.ciclos,
+            "refrescadas": self.refrescadas,
+            "errores": self.errores,
+        }
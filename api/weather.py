@@ -1,180 +1,369 @@
+import os
+import time
+import asyncio
+import logging
+import calendar
+import httpx
+import numpy as np
 import pandas as pd
-import openmeteo_requests
-from requests_cache import CachedSession
-from retry_requests import retry
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
 from datetime import timedelta
-import time
-import random
+from cache_clima import CacheClima, DatosHorarios
+from circuito import Circuito, CircuitoAbierto, ABIERTO
+import metricas
+
+# Cliente sincrónico con requests-cache: se crea en el primer uso porque importar openmeteo_requests y
+# requests_cache cuesta ~0.2 s en el arranque y los endpoints sólo usan el cliente asíncrono
+_openmeteo = None
+
+# Cache en memoria por celda de grilla y corrida de modelo, consultada antes de ir a la red
+cache_clima = CacheClima()
+
+# Se puede apuntar a un servidor local (ver bench/stub_open_meteo.py)
+URL_FORECAST = os.environ.get("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
+# Cliente asíncrono (se crea en el primer uso, dentro del event loop de la API)
+TIMEOUT_OPEN_METEO = float(os.environ.get("TIMEOUT_OPEN_METEO", 10))
+REINTENTOS = 5
+BACKOFF = 0.2
+# Tiempo máximo de una descarga con sus reintentos. Sigue en segundo plano aunque el pedido que la inició ya
+# haya respondido con datos vencidos, así que no depende del plazo de ningún pedido
+PLAZO_DESCARGA_S = float(os.environ.get("PLAZO_DESCARGA_S", 15))
+# Corridas viejas que se usan como respaldo cuando Open-Meteo no responde a tiempo (24: datos de hasta un día)
+CACHE_MAX_CORRIDAS_RESPALDO = int(os.environ.get("CACHE_MAX_CORRIDAS_RESPALDO", 24))
+# Respuestas que cuentan como falla de Open-Meteo para el circuito; sólo los 5xx se reintentan
+CODIGOS_FALLA = (429, 500, 502, 503, 504)
+CODIGOS_REINTENTO = (500, 502, 503, 504)
+# Se abre después de varias descargas fallidas seguidas (cada una ya con sus reintentos) y deja de mandar
+# pedidos por un rato (ver circuito.py)
+circuito = Circuito()
+_cliente_async = None
+# Almacén columnar compartido con el entrenamiento (almacen_clima.py): cada descarga se guarda ahí. Sin
+# ALMACEN_DIR no se importa pyarrow, que suma ~0.1 s al arranque
+almacen = None
+if os.environ.get("ALMACEN_DIR"):
+    from almacen_clima import AlmacenClima
+    almacen = AlmacenClima()
+# Descargas en curso por (celda, ventana): los pedidos concurrentes esperan la misma
+_en_vuelo = {}
+
+# Variables horarias que se piden a Open-Meteo
+VARIABLES_HORARIAS = ["temperature_2m","snow_depth", "relative_humidity_2m", "dew_point_2m", "apparent_temperature", "precipitation_probability", "precipitation", "rain", "showers", "snowfall", "weather_code", "pressure_msl", 
+                      "surface_pressure", "cloud_cover", "cloud_cover_low", "cloud_cover_mid", "cloud_cover_high", "evapotranspiration", "visibility", "et0_fao_evapotranspiration", "vapour_pressure_deficit", "wind_speed_10m", "wind_speed_80m", 
+                      "wind_speed_120m", "wind_speed_180m", "wind_direction_10m", "wind_direction_80m", "wind_direction_120m", "wind_direction_180m", "wind_gusts_10m", "temperature_80m", "temperature_120m", "temperature_180m", 
+                      "soil_temperature_0cm", "soil_temperature_6cm", "soil_temperature_18cm", "soil_temperature_54cm", "soil_moisture_0_to_1cm", "soil_moisture_1_to_3cm", "soil_moisture_3_to_9cm", "soil_moisture_9_to_27cm", 
+                      "soil_moisture_27_to_81cm", "uv_index", "uv_index_clear_sky", "is_day", "sunshine_duration", "wet_bulb_temperature_2m", "shortwave_radiation", "boundary_layer_height", "freezing_level_height", "convective_inhibition", 
+                      "lifted_index", "cape", "total_column_integrated_water_vapour", "direct_radiation", "diffuse_radiation", "direct_normal_irradiance", "global_tilted_irradiance", "terrestrial_radiation", "terrestrial_radiation_instant", 
+                      "global_tilted_irradiance_instant", "direct_normal_irradiance_instant", "diffuse_radiation_instant", "direct_radiation_instant", "shortwave_radiation_instant"]
+
+def decodificar_horario(response, variables):
+    # Pasa la parte horaria de una respuesta de Open-Meteo a arrays de numpy
+    with metricas.medir("decodificacion"):
+        hourly = response.Hourly()
+        datos = {}
+        for i, var_name in enumerate(variables):
+            datos[var_name] = hourly.Variables(i).ValuesAsNumpy()
+    return DatosHorarios(
+        inicio=hourly.Time(),
+        fin=hourly.TimeEnd(),
+        intervalo=hourly.Interval(),
+        utc_offset=response.UtcOffsetSeconds(),
+        elevacion=response.Elevation(),
+        variables=datos
+    )
+
+def decodificar_horarios(responses, variables):
+    # Respuesta multi-ubicación: un DatosHorarios por coordenada, en el orden del pedido
+    return [decodificar_horario(response, variables) for response in responses]
+
+def _params_forecast(lat, lon, desde, hasta, variables):
+    # Ventana canónica (ayer a pasado mañana + 2 días) para que cualquier lead de hasta 48 hs caiga en la misma entrada
+    hoy = pd.Timestamp.now(tz="UTC").normalize()
+    start_date = (min(desde, hoy) - timedelta(days=1)).strftime('%Y-%m-%d')
+    end_date = (max(hasta, hoy + timedelta(days=2)) + timedelta(days=2)).strftime('%Y-%m-%d')
+
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": start_date,
+        "end_date": end_date,
+        "hourly": list(variables),
+        "timezone": "auto"
+    }
+
+def _desde_cache(lat, lon, desde, hasta, variables):
+    datos = cache_clima.obtener(lat, lon, variables)
+    if datos is not None and datos.cubre(desde.timestamp(), hasta.timestamp()):
+        metricas.CACHE_CLIMA.labels("acierto").inc()
+        return datos
+    metricas.CACHE_CLIMA.labels("fallo").inc()
+    return None
+
+def obtener_horario(lat, lon, desde, hasta, variables=VARIABLES_HORARIAS):
+    # Devuelve los datos horarios de la celda de lat/lon que cubren [desde, hasta], usando la cache si se puede
+    datos = _desde_cache(lat, lon, desde, hasta, variables)
+    if datos is not None:
+        return datos
+
+    lat_celda, lon_celda = cache_clima.celda(lat, lon)
+    params = _params_forecast(lat_celda, lon_celda, desde, hasta, variables)
+
+    # Solicitud a la API
+    circuito.verificar()
+    try:
+        with metricas.medir("open_meteo"):
+            responses = _cliente_sync().weather_api(URL_FORECAST, params=params, timeout=TIMEOUT_OPEN_METEO)
+    except Exception:
+        circuito.falla()
+        raise
+    circuito.exito()
+    datos = decodificar_horario(responses[0], params["hourly"])
+    cache_clima.guardar(lat, lon, datos)
+    if almacen is not None:
+        almacen.agregar(lat_celda, lon_celda, datos)
+    return datos
+
+def _decodificar_respuestas(data):
+    # Mismo formato que openmeteo_requests: mensajes FlatBuffers precedidos por su largo
+    responses = []
+    pos = 0
+    while pos < len(data):
+        largo = int.from_bytes(data[pos:pos + 4], byteorder="little")
+        responses.append(WeatherApiResponse.GetRootAs(data, pos + 4))
+        pos += largo + 4
+    return responses
+
+def _cliente_sync():
+    global _openmeteo
+    if _openmeteo is None:
+        import openmeteo_requests
+        from requests_cache import CachedSession
+        from retry_requests import retry
+        cache_session = CachedSession('.cache', expire_after=3600)
+        retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+        _openmeteo = openmeteo_requests.Client(session=retry_session)
+    return _openmeteo
+
+def _cliente():
+    global _cliente_async
+    if _cliente_async is None:
+        _cliente_async = httpx.AsyncClient(timeout=TIMEOUT_OPEN_METEO)
+    return _cliente_async
+
+async def cerrar_cliente_async():
+    global _cliente_async
+    if _cliente_async is not None:
+        await _cliente_async.aclose()
+        _cliente_async = None
+
+async def weather_api_async(url, params, limite=None):
+    # Equivalente no bloqueante de openmeteo.weather_api. Los reintentos se cortan al llegar a limite
+    # (en time.monotonic()) o si el circuito se abre, así una caída de Open-Meteo no retiene pedidos.
+    # Para el circuito cada descarga es una sola falla o un solo éxito, con los reintentos que haya hecho
+    params = dict(params, format="flatbuffers")
+    limite = time.monotonic() + PLAZO_DESCARGA_S if limite is None else limite
+    with metricas.medir("open_meteo"):
+        circuito.verificar()
+        try:
+            r = await _pedir_con_reintentos(url, params, limite)
+        except asyncio.CancelledError:
+            circuito.liberar()
+            raise
+        except Exception:
+            circuito.falla()
+            raise
+        if r.status_code in CODIGOS_FALLA:
+            circuito.falla()
+        else:
+            circuito.exito()
+    metricas.PEDIDOS_OPEN_METEO.labels("ok" if r.is_success else "error").inc()
+    r.raise_for_status()
+    return _decodificar_respuestas(r.content)
+
+async def _pedir_con_reintentos(url, params, limite):
+    # Devuelve la última respuesta (puede ser un código de falla) o levanta el último error de conexión
+    intento = 0
+    while True:
+        timeout = max(0.1, min(TIMEOUT_OPEN_METEO, limite - time.monotonic()))
+        try:
+            r, error = await _cliente().get(url, params=params, timeout=timeout), None
+        except httpx.TransportError as e:
+            r, error = None, e
+        if error is None and r.status_code not in CODIGOS_FALLA:
+            return r
+
+        espera = BACKOFF * (2 ** intento)
+        reintentable = error is not None or r.status_code in CODIGOS_REINTENTO
+        if not reintentable or intento == REINTENTOS or time.monotonic() + espera >= limite:
+            if error is not None:
+                metricas.PEDIDOS_OPEN_METEO.labels("error").inc()
+                raise error
+            return r
+        metricas.REINTENTOS_OPEN_METEO.labels(type(error).__name__ if error else f"http_{r.status_code}").inc()
+        await asyncio.sleep(espera)
+        intento += 1
+        if circuito.estado == ABIERTO:
+            # Otras descargas lo abrieron mientras esta esperaba: no se insiste
+            raise CircuitoAbierto("Circuito de Open-Meteo abierto")
+
+async def _descargar_horario(lat, lon, params):
+    responses = await weather_api_async(URL_FORECAST, params)
+    datos = decodificar_horario(responses[0], params["hourly"])
+    cache_clima.guardar(lat, lon, datos)
+    if almacen is not None:
+        # Sólo encola: el hilo del almacén escribe fuera del event loop
+        almacen.agregar(params["latitude"], params["longitude"], datos)
+    return datos
+
+def _descarga_compartida(lat, lon, desde, hasta, variables):
+    lat_celda, lon_celda = cache_clima.celda(lat, lon)
+    params = _params_forecast(lat_celda, lon_celda, desde, hasta, variables)
+    clave = (lat_celda, lon_celda, params["start_date"], params["end_date"], tuple(variables))
+
+    # Single-flight: si ya hay una descarga igual en curso, se usa esa
+    tarea = _en_vuelo.get(clave)
+    if tarea is None:
+        tarea = asyncio.ensure_future(_descargar_horario(lat, lon, params))
+        _en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda _: _en_vuelo.pop(clave, None))
+    else:
+        metricas.DESCARGAS_COMPARTIDAS.inc()
+    return tarea
+
+def _registrar_error(tarea):
+    # Para descargas en segundo plano que nadie espera (con el circuito abierto fallan todas, no se loguean)
+    if not tarea.cancelled() and tarea.exception() is not None and not isinstance(tarea.exception(), CircuitoAbierto):
+        print(f"Error refrescando clima en segundo plano: {tarea.exception()}")
+
+async def obtener_horario_async(lat, lon, desde, hasta, variables=VARIABLES_HORARIAS, limite=None):
+    # Devuelve (datos, vencido). limite (en time.monotonic()) es el plazo del pedido: si la descarga no
+    # llega a tiempo, falla o el circuito está abierto, se responde con la última corrida guardada
+    datos = _desde_cache(lat, lon, desde, hasta, variables)
+    if datos is not None:
+        return datos, False
+
+    # Stale-while-revalidate: si hay datos de una corrida anterior se devuelven ya y se refresca en segundo plano
+    vencidos = cache_clima.obtener_vencido(lat, lon, variables)
+    if vencidos is not None and vencidos.cubre(desde.timestamp(), hasta.timestamp()):
+        metricas.CACHE_CLIMA.labels("vencido").inc()
+        _descarga_compartida(lat, lon, desde, hasta, variables).add_done_callback(_registrar_error)
+        return vencidos, True
+
+    tarea = _descarga_compartida(lat, lon, desde, hasta, variables)
+    try:
+        # shield: si un pedido se cancela o se le acaba el plazo no cancela la descarga que comparten los demás
+        restante = None if limite is None else max(0.0, limite - time.monotonic())
+        return await asyncio.wait_for(asyncio.shield(tarea), restante), False
+    except Exception as e:
+        if isinstance(e, asyncio.TimeoutError):
+            metricas.PLAZOS_AGOTADOS.inc()
+            tarea.add_done_callback(_registrar_error)
+        respaldo = cache_clima.obtener_vencido(lat, lon, variables, max_corridas=CACHE_MAX_CORRIDAS_RESPALDO)
+        if respaldo is None or not respaldo.cubre(desde.timestamp(), hasta.timestamp()):
+            raise
+        metricas.CACHE_CLIMA.labels("respaldo").inc()
+        logging.warning(f"Clima de respaldo para {cache_clima.celda(lat, lon)}: {type(e).__name__} {e}")
+        return respaldo, True
+
+async def refrescar_celda(lat, lon, variables=VARIABLES_HORARIAS):
+    # Descarga la celda para las próximas 48 hs salvo que la cache ya tenga la corrida actual.
+    # Devuelve True si hizo falta ir a Open-Meteo
+    desde = pd.Timestamp.now(tz="UTC").normalize()
+    hasta = desde + timedelta(days=2, hours=23)
+    datos = cache_clima.obtener(lat, lon, variables)
+    if datos is not None and datos.cubre(desde.timestamp(), hasta.timestamp()):
+        return False
+    await asyncio.shield(_descarga_compartida(lat, lon, desde, hasta, variables))
+    return True
+
+def _agrupar_por_celda(filas):
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault(cache_clima.celda(fila['lat'], fila['lon']), []).append(fila)
+    for celda, grupo in grupos.items():
+        fechas = [fila['date'] for fila in grupo]
+        desde = pd.Timestamp(min(fechas)).tz_localize("UTC")
+        hasta = pd.Timestamp(max(fechas)).tz_localize("UTC") + timedelta(hours=23)
+        yield celda, grupo, desde, hasta
 
-# Configuración del cliente API
-cache_session = CachedSession('.cache', expire_after=3600)
-retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-openmeteo = openmeteo_requests.Client(session=retry_session)
+def extraer_filas(grupo, datos, variables, vencido=False):
+    with metricas.medir("extraccion"):
+        return _extraer_filas(grupo, datos, variables, vencido)
 
-def obtener_data_clima(base):
-    url = "https://api.open-meteo.com/v1/forecast"
+def _epoch_dia(fecha):
+    # Epoch (s) de la medianoche UTC del día de fecha (date, datetime, Timestamp o texto)
+    if not hasattr(fecha, "year"):
+        fecha = pd.Timestamp(fecha)
+    return calendar.timegm((fecha.year, fecha.month, fecha.day, 0, 0, 0))
+
+def _extraer_filas(grupo, datos, variables, vencido=False):
+    # La hora objetivo de cada fila (día en UTC + hour_integer) se pasa a una posición en los arrays
+    # decodificados y se leen todas las filas del grupo de una vez, sin armar un DataFrame
+    horas = np.array([_epoch_dia(row['date']) + 3600 * int(row['hour_integer']) for row in grupo], dtype=np.int64)
+    indices = datos.indices(horas)
+    validos = np.flatnonzero(indices >= 0)
+    nombres = [f"weather_{var}" for var in variables]
+    valores = np.stack([datos.variables[var][indices[validos]] for var in variables], axis=1)
+    horas_geo = (horas[validos] + datos.utc_offset) // 3600 % 24
+
+    results = []
+    for k, i in enumerate(validos):
+        result_row = dict(grupo[i])
+        result_row.update(zip(nombres, valores[k]))
+        result_row['hour_geo'] = horas_geo[k]
+        result_row['alt'] = datos.elevacion
+        result_row['vencido'] = vencido
+        results.append(result_row)
+    if len(validos) < len(grupo):
+        for i in np.flatnonzero(indices < 0):
+            print(f"No se encontró hora {grupo[i]['hour_integer']} para fecha {grupo[i]['date']}")
+    return results
+
+def obtener_data_clima(base, variables=VARIABLES_HORARIAS):
     results = []
 
-    for index, row in base.iterrows():
+    # Una sola consulta por celda de grilla: la ventana cubre todas las fechas pedidas en esa celda
+    for celda, grupo, desde, hasta in _agrupar_por_celda(base.to_dict('records')):
         try:
-            
-            # Calcular rangos de fecha (día anterior y día posterior)
-            current_date = pd.to_datetime(row['date'])
-            start_date = (current_date - timedelta(days=1)).strftime('%Y-%m-%d')
-            end_date = (current_date + timedelta(days=2)).strftime('%Y-%m-%d')
-            target_date = current_date.strftime('%Y-%m-%d')
-            
-            params = {
-                "latitude": row['lat'],
-                "longitude": row['lon'],
-                "start_date": start_date,
-                "end_date": end_date,
-                "hourly": ["temperature_2m","snow_depth", "relative_humidity_2m", "dew_point_2m", "apparent_temperature", "precipitation_probability", "precipitation", "rain", "showers", "snowfall", "weather_code", "pressure_msl", 
-                        "surface_pressure", "cloud_cover", "cloud_cover_low", "cloud_cover_mid", "cloud_cover_high", "evapotranspiration", "visibility", "et0_fao_evapotranspiration", "vapour_pressure_deficit", "wind_speed_10m", "wind_speed_80m", 
-                        "wind_speed_120m", "wind_speed_180m", "wind_direction_10m", "wind_direction_80m", "wind_direction_120m", "wind_direction_180m", "wind_gusts_10m", "temperature_80m", "temperature_120m", "temperature_180m", 
-                        "soil_temperature_0cm", "soil_temperature_6cm", "soil_temperature_18cm", "soil_temperature_54cm", "soil_moisture_0_to_1cm", "soil_moisture_1_to_3cm", "soil_moisture_3_to_9cm", "soil_moisture_9_to_27cm", 
-                        "soil_moisture_27_to_81cm", "uv_index", "uv_index_clear_sky", "is_day", "sunshine_duration", "wet_bulb_temperature_2m", "shortwave_radiation", "boundary_layer_height", "freezing_level_height", "convective_inhibition", 
-                        "lifted_index", "cape", "total_column_integrated_water_vapour", "direct_radiation", "diffuse_radiation", "direct_normal_irradiance", "global_tilted_irradiance", "terrestrial_radiation", "terrestrial_radiation_instant", 
-                        "global_tilted_irradiance_instant", "direct_normal_irradiance_instant", "diffuse_radiation_instant", "direct_radiation_instant", "shortwave_radiation_instant"],
-                "timezone": "auto"
-            }
-            
-            # Solicitud a la API
-            responses = openmeteo.weather_api(url, params=params)
-            response = responses[0]
-            
-            # Procesar datos
-            hourly = response.Hourly()
-            hourly_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=hourly.Interval()),
-                    inclusive="left"
-                )
-            }
-            
-            # Añadir variables
-            for i, var_name in enumerate(params["hourly"]):
-                var = hourly.Variables(i)
-                hourly_data[var_name] = var.ValuesAsNumpy()
-            
-            hourly_df = pd.DataFrame(data=hourly_data)
-            hourly_df['date_corregida'] = hourly_df['date'] + timedelta(seconds=response.UtcOffsetSeconds())
-            
-            # Filtrar solo el día objetivo
-            hourly_df['date_only'] = hourly_df['date'].dt.date
-            target_date_only = pd.to_datetime(target_date).date()
-            daily_df = hourly_df[hourly_df['date_only'] == target_date_only].copy()
-            
-            # Filtrar por hour_integer
-            daily_df['hour'] = daily_df['date'].dt.hour
-            matching_row = daily_df[daily_df['hour'] == row['hour_integer']]
-            
-            if not matching_row.empty:
-                result_row = row.to_dict()
-                for var in params["hourly"]:
-                    result_row[f"weather_{var}"] = matching_row[var].values[0]
-                result_row['hour_geo'] = matching_row['date_corregida'].dt.hour.values[0]
-                result_row['alt'] = response.Elevation()
-                results.append(result_row)
-            else:
-                print(f"No se encontró hora {row['hour_integer']} para fecha {target_date}")
-        
+            datos = obtener_horario(celda[0], celda[1], desde, hasta, variables)
         except Exception as e:
-            print(f"Error procesando fila {index}: {str(e)}")
+            print(f"Error procesando celda {celda}: {str(e)}")
             continue
+        results.extend(extraer_filas(grupo, datos, variables))
 
     a_predecir_completo = pd.DataFrame(results)
 
     return a_predecir_completo
 
+async def obtener_filas_clima_async(filas, variables=VARIABLES_HORARIAS, limite=None):
+    # Como obtener_data_clima pero recibe y devuelve listas de diccionarios, sin armar DataFrames.
+    # Las filas con datos de una corrida anterior llevan vencido=True
+    results = []
+    grupos = list(_agrupar_por_celda(filas))
 
+    # Todas las celdas se consultan en paralelo sin bloquear el event loop
+    descargas = await asyncio.gather(
+        *[obtener_horario_async(celda[0], celda[1], desde, hasta, variables, limite)
+          for celda, _, desde, hasta in grupos],
+        return_exceptions=True
+    )
+    for (celda, grupo, _, _), descarga in zip(grupos, descargas):
+        if isinstance(descarga, CircuitoAbierto):
+            # Ya contado en /metrics; con Open-Meteo caído loguearlo en cada pedido sólo agrega ruido
+            continue
+        if isinstance(descarga, Exception):
+            print(f"Error procesando celda {celda}: {type(descarga).__name__} {descarga}")
+            continue
+        datos, vencido = descarga
+        results.extend(extraer_filas(grupo, datos, variables, vencido))
 
+    return results
 
 
-def get_data_training(df):
-    url = "https://historical-forecast-api.open-meteo.com/v1/forecast"
-    results = []
-    total_filas = len(df)  # Total de filas a procesar
 
-    for index, row in df.iterrows():
-        try:
-            print(f"\nProcesando fila {index+1} de {total_filas} - {((index+1)/total_filas)*100:.1f}% completado")
-            # Pausa aleatoria entre 1 y 3 segundos
-            sleep_time = random.uniform(2, 5)
-            print(f"Sleep time elegido: {(sleep_time):.1f} segundos")
-            time.sleep(sleep_time)
-            
-            # Calcular rangos de fecha (día anterior y día posterior)
-            current_date = pd.to_datetime(row['date'])
-            start_date = (current_date - timedelta(days=1)).strftime('%Y-%m-%d')
-            end_date = (current_date + timedelta(days=1)).strftime('%Y-%m-%d')
-            target_date = current_date.strftime('%Y-%m-%d')
-            
-            params = {
-                "latitude": row['lat'],
-                "longitude": row['lon'],
-                "start_date": start_date,
-                "end_date": end_date,
-                "hourly": ["temperature_2m","snow_depth", "relative_humidity_2m", "dew_point_2m", "apparent_temperature", "precipitation_probability", "precipitation", "rain", "showers", "snowfall", "weather_code", "pressure_msl", 
-                           "surface_pressure", "cloud_cover", "cloud_cover_low", "cloud_cover_mid", "cloud_cover_high", "evapotranspiration", "visibility", "et0_fao_evapotranspiration", "vapour_pressure_deficit", "wind_speed_10m", "wind_speed_80m", 
-                           "wind_speed_120m", "wind_speed_180m", "wind_direction_10m", "wind_direction_80m", "wind_direction_120m", "wind_direction_180m", "wind_gusts_10m", "temperature_80m", "temperature_120m", "temperature_180m", 
-                           "soil_temperature_0cm", "soil_temperature_6cm", "soil_temperature_18cm", "soil_temperature_54cm", "soil_moisture_0_to_1cm", "soil_moisture_1_to_3cm", "soil_moisture_3_to_9cm", "soil_moisture_9_to_27cm", 
-                           "soil_moisture_27_to_81cm", "uv_index", "uv_index_clear_sky", "is_day", "sunshine_duration", "wet_bulb_temperature_2m", "shortwave_radiation", "boundary_layer_height", "freezing_level_height", "convective_inhibition", 
-                           "lifted_index", "cape", "total_column_integrated_water_vapour", "direct_radiation", "diffuse_radiation", "direct_normal_irradiance", "global_tilted_irradiance", "terrestrial_radiation", "terrestrial_radiation_instant", 
-                           "global_tilted_irradiance_instant", "direct_normal_irradiance_instant", "diffuse_radiation_instant", "direct_radiation_instant", "shortwave_radiation_instant"],
-                # "models": ["best_match", "ecmwf_aifs025_single", "ecmwf_ifs025", "cma_grapes_global", "bom_access_global", "kma_seamless", "kma_ldps", "kma_gdps", "gfs_seamless", "gfs_global", "gfs_graphcast025", "jma_seamless", 
-                #         "jma_gsm", "icon_seamless", "icon_global", "gem_seamless", "gem_global", "meteofrance_seamless", "meteofrance_arpege_world", "knmi_seamless", "dmi_seamless", "ukmo_global_deterministic_10km", "ukmo_seamless"],
-                "timezone": "auto"
-            }
-            
-            # Solicitud a la API
-            responses = openmeteo.weather_api(url, params=params)
-            response = responses[0]
-            
-            # Procesar datos
-            hourly = response.Hourly()
-            hourly_data = {
-                "date": pd.date_range(
-                    start=pd.to_datetime(hourly.Time(), unit="s", utc=True),
-                    end=pd.to_datetime(hourly.TimeEnd(), unit="s", utc=True),
-                    freq=pd.Timedelta(seconds=hourly.Interval()),
-                    inclusive="left"
-                )
-            }
-            
-            # Añadir variables
-            for i, var_name in enumerate(params["hourly"]):
-                var = hourly.Variables(i)
-                hourly_data[var_name] = var.ValuesAsNumpy()
-            
-            hourly_df = pd.DataFrame(data=hourly_data)
-            hourly_df['date_corregida'] = hourly_df['date'] + timedelta(seconds=response.UtcOffsetSeconds())
-            
-            # Filtrar solo el día objetivo
-            hourly_df['date_only'] = hourly_df['date'].dt.date
-            target_date_only = pd.to_datetime(target_date).date()
-            daily_df = hourly_df[hourly_df['date_only'] == target_date_only].copy()
-            
-            # Filtrar por hour_integer
-            daily_df['hour'] = daily_df['date'].dt.hour
-            matching_row = daily_df[daily_df['hour'] == row['hour_integer']]
-            
-            if not matching_row.empty:
-                result_row = row.to_dict()
-                for var in params["hourly"]:
-                    result_row[f"weather_{var}"] = matching_row[var].values[0]
-                result_row['hour_geo'] = matching_row['date_corregida'].dt.hour.values[0]
-                result_row['alt'] = response.Elevation()
-                results.append(result_row)
-            else:
-                print(f"No se encontró hora {row['hour_integer']} para fecha {target_date}")
-        
-        except Exception as e:
-            print(f"Error procesando fila {index}: {str(e)}")
-            continue
 
-    final_df = pd.DataFrame(results)
 
-    return final_df
\ No newline at end of file
+def get_data_training(df, **kwargs):
+    # Backfill agrupado, en paralelo y reanudable; ver backfill.py
+    import backfill
+    return backfill.get_data_training(df, **kwargs)
@@ -0,0 +1,137 @@
+import os
+import sys
+import time
+import shutil
+import random
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+from correr import levantar_stub
+
+# Almacén de clima (api/almacen_clima.py):
+#   - consulta vectorizada de N claves (lat, lon, hora) antes y después de compactar, sobre un almacén sintético
+#     escrito como lo escribiría la API (una tanda por hora con varias corridas de la misma celda)
+#   - armado de un dataset de entrenamiento con backfill.py contra el stub: la primera vez descarga y guarda en
+#     el almacén, la segunda lo arma sólo con el almacén (sin checkpoints ni red) y se comparan las dos
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+CENTROS = [(-34.58, -58.43), (-31.42, -64.18), (-32.89, -68.85)]
+
+
+def datos_sinteticos(rng, inicio, dias, variables):
+    from cache_clima import DatosHorarios
+    n = dias * 24
+    return DatosHorarios(inicio, inicio + n * 3600, 3600, -3 * 3600, 25.0,
+                         {var: rng.normal(size=n).astype(np.float32) for var in variables})
+
+def escribir_sintetico(almacen, celdas, corridas, dias, variables, semilla=0):
+    # Una tanda por corrida (como el escritor de la API cada ALMACEN_TANDA_S) con todas las celdas
+    rng = np.random.default_rng(semilla)
+    inicio = int(time.time()) // 86400 * 86400 - 86400
+    escritas, segundos = 0, 0.0
+    for corrida in range(corridas):
+        registros = [(lat, lon, datos_sinteticos(rng, inicio, dias, variables), float(corrida)) for lat, lon in celdas]
+        t = time.perf_counter()
+        escritas += almacen.guardar(registros)
+        segundos += time.perf_counter() - t
+    return inicio, escritas, segundos
+
+def medir_busqueda(almacen, celdas, inicio, dias, variables, n, repeticiones, rnd):
+    elegidas = [rnd.choice(celdas) for _ in range(n)]
+    lat = np.array([c[0] for c in elegidas])
+    lon = np.array([c[1] for c in elegidas])
+    horas = inicio + 3600 * np.array([rnd.randrange(dias * 24) for _ in range(n)])
+    almacen.buscar(lat, lon, horas, variables)  # abre las particiones
+    t = time.perf_counter()
+    for _ in range(repeticiones):
+        encontrado = almacen.buscar(lat, lon, horas, variables)[3]
+    return (time.perf_counter() - t) / repeticiones * 1e6, float(encontrado.mean())
+
+def micro(celdas=300, corridas=4, dias=7, semilla=0):
+    from almacen_clima import AlmacenClima
+    import weather as we
+    variables = we.VARIABLES_HORARIAS
+    rnd = random.Random(semilla)
+    lista = sorted({(round(lat + rnd.uniform(-1, 1), 2), round(lon + rnd.uniform(-1, 1), 2))
+                    for lat, lon in (rnd.choice(CENTROS) for _ in range(celdas))})
+    directorio = tempfile.mkdtemp(prefix="almacen_")
+    try:
+        almacen = AlmacenClima(directorio)
+        inicio, escritas, segundos = escribir_sintetico(almacen, lista, corridas, dias, variables, semilla)
+        resultado = {"celdas": len(lista), "filas_escritas": escritas, "escritura_filas_por_s": escritas / segundos}
+        for estado in ["sin_compactar", "compactado"]:
+            if estado == "compactado":
+                t = time.perf_counter()
+                almacen.compactar()
+                resultado["compactar_s"] = time.perf_counter() - t
+            resultado[f"archivos_{estado}"] = almacen.estadisticas()["archivos"]
+            for n, repeticiones in [(1, 2000), (100, 200), (10000, 10)]:
+                us, encontradas = medir_busqueda(almacen, lista, inicio, dias, variables, n, repeticiones, rnd)
+                resultado[f"buscar_{n}_{estado}_us"] = us
+                resultado[f"encontradas_{n}_{estado}"] = encontradas
+        resultado["mb"] = almacen.estadisticas()["mb"]
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+    return resultado
+
+def filas_entrenamiento(n, semilla=0):
+    # Filas como las del dataset de entrenamiento: ubicación, fecha y hora de una observación
+    rnd = random.Random(semilla)
+    hoy = pd.Timestamp.now(tz="UTC").normalize().tz_localize(None)
+    filas = []
+    for _ in range(n):
+        lat, lon = rnd.choice(CENTROS)
+        filas.append({"lat": round(lat + rnd.uniform(-0.3, 0.3), 4), "lon": round(lon + rnd.uniform(-0.3, 0.3), 4),
+                      "date": (hoy - pd.Timedelta(days=rnd.randrange(2, 30))).strftime("%Y-%m-%d"),
+                      "hour_integer": rnd.randrange(24)})
+    return pd.DataFrame(filas)
+
+def entrenamiento(filas=2000, puerto_stub=8081, latencia_ms=50.0, semilla=0):
+    import backfill
+    from almacen_clima import AlmacenClima
+    # Lo mismo que ALMACEN_DIR y OPEN_METEO_HISTORICO_URL, que se leen al importar weather y backfill
+    directorio = tempfile.mkdtemp(prefix="almacen_")
+    backfill.we.almacen = AlmacenClima(os.path.join(directorio, "almacen"))
+    backfill.URL_HISTORICO = f"http://127.0.0.1:{puerto_stub}/v1/forecast"
+    stub = levantar_stub(puerto_stub, latencia_ms)
+    try:
+        df = filas_entrenamiento(filas, semilla)
+        tramos = backfill.armar_tramos(df)
+        llamadas = sum(backfill.costo_llamadas(len(t["coords"]), len(backfill.we.VARIABLES_HORARIAS), 3) for t in tramos)
+        t = time.perf_counter()
+        descargado = backfill.get_data_training(df, os.path.join(directorio, "ckpt1"), llamadas_por_minuto=1e6)
+        primera = time.perf_counter() - t
+        backfill.we.almacen.compactar()
+        t = time.perf_counter()
+        local = backfill.get_data_training(df, os.path.join(directorio, "ckpt2"), llamadas_por_minuto=1e6)
+        segunda = time.perf_counter() - t
+        columnas = [c for c in descargado.columns if c.startswith("weather_")]
+        iguales = np.isclose(descargado[columnas].to_numpy(float), local[columnas].to_numpy(float), equal_nan=True)
+        return {
+            "filas": len(df),
+            "pedidos": len(tramos),
+            "llamadas_open_meteo": llamadas,
+            "crawl_estimado_min": llamadas / backfill.BACKFILL_LLAMADAS_POR_MINUTO,
+            "descarga_s": primera,
+            "desde_almacen_s": segunda,
+            "filas_locales": len(local),
+            "filas_iguales": float(iguales.all(axis=1).mean()),
+            "almacen_mb": backfill.we.almacen.estadisticas()["mb"],
+        }
+    finally:
+        stub.terminate()
+        stub.wait()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Almacén de clima: consultas vectorizadas y armado de datasets")
+    parser.add_argument("--celdas", type=int, default=300)
+    parser.add_argument("--corridas", type=int, default=4, help="veces que se escribe cada celda (corridas de modelo)")
+    parser.add_argument("--filas", type=int, default=2000, help="filas del dataset de entrenamiento")
+    parser.add_argument("--puerto-stub", type=int, default=8081)
+    args = parser.parse_args()
+    for clave, valor in list(micro(args.celdas, args.corridas).items()) + list(entrenamiento(args.filas, args.puerto_stub).items()):
+        print(f"{clave:>32}: {valor:12.2f}" if isinstance(valor, float) else f"{clave:>32}: {valor}")
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+import httpx
+
+# Mide el arranque en frío de la API: tiempo de import, tiempo hasta /listo, primera respuesta y memoria por proceso.
+# Compara uvicorn solo contra gunicorn con --preload (gunicorn_conf.py)
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DIRECTORIO_API = os.path.join(RAIZ, "api")
+
+MODOS = {
+    "uvicorn": lambda puerto, workers: [sys.executable, "-m", "uvicorn", "api:app", "--port", str(puerto),
+                                        "--workers", str(workers), "--log-level", "warning"],
+    "gunicorn": lambda puerto, workers: [sys.executable, "-m", "gunicorn", "api:app", "-c", "gunicorn_conf.py",
+                                         "--log-level", "warning"],
+}
+
+
+def tiempo_import():
+    codigo = "import time; t = time.perf_counter(); import api; print(time.perf_counter() - t)"
+    salida = subprocess.check_output([sys.executable, "-c", codigo], cwd=DIRECTORIO_API, text=True,
+                                     stderr=subprocess.DEVNULL)
+    return float(salida.strip().splitlines()[-1])
+
+def procesos(pid):
+    # El proceso y todos sus descendientes
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(h) for h in f.read().split())
+        except FileNotFoundError:
+            pass
+    return pids
+
+def memoria(pid):
+    # RSS cuenta las páginas compartidas en cada proceso; PSS las reparte, así que la suma es la memoria real
+    valores = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for linea in f:
+            campo = linea.split(":")[0]
+            if campo in ("Rss", "Pss"):
+                valores[campo.lower()] = int(linea.split()[1]) / 1024
+    return valores
+
+def medir(modo, puerto, workers, url_stub):
+    entorno = dict(os.environ, PORT=str(puerto), WEB_CONCURRENCY=str(workers))
+    if url_stub:
+        entorno["OPEN_METEO_URL"] = url_stub
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(MODOS[modo](puerto, workers), cwd=DIRECTORIO_API, env=entorno,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{puerto}"
+        primera_conexion = None
+        while True:
+            try:
+                r = httpx.get(f"{url}/listo", timeout=1)
+                primera_conexion = primera_conexion or time.perf_counter() - inicio
+                if r.status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.perf_counter() - inicio > 120:
+                raise RuntimeError(f"{modo} no quedó listo en 120 s")
+            time.sleep(0.05)
+        listo = time.perf_counter() - inicio
+
+        t = time.perf_counter()
+        httpx.post(f"{url}/predecir", json={"lat": -31.42, "lon": -64.18, "lead": 1}, timeout=30)
+        primera_respuesta = time.perf_counter() - t
+
+        # Dar tiempo a que todos los workers terminen de calentar antes de medir memoria
+        time.sleep(2)
+        memorias = [memoria(p) for p in procesos(proceso.pid)]
+        return {
+            "modo": modo,
+            "workers": workers,
+            "acepta_conexiones_s": primera_conexion,
+            "listo_s": listo,
+            "primera_prediccion_ms": primera_respuesta * 1000,
+            "procesos": len(memorias),
+            "rss_total_mb": sum(m["rss"] for m in memorias),
+            "pss_total_mb": sum(m["pss"] for m in memorias),
+            "rss_por_proceso_mb": [round(m["rss"], 1) for m in memorias],
+            "pss_por_proceso_mb": [round(m["pss"], 1) for m in memorias],
+        }
+    finally:
+        proceso.terminate()
+        proceso.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Arranque en frío de la API")
+    parser.add_argument("--puerto", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--stub", default="http://127.0.0.1:8081/v1/forecast",
+                        help="URL del stub de Open-Meteo (vacío para usar la API real)")
+    args = parser.parse_args()
+
+    print(f"import api: {tiempo_import():.2f} s")
+    for modo in MODOS:
+        resultado = medir(modo, args.puerto, args.workers, args.stub)
+        for clave, valor in resultado.items():
+            print(f"{clave:>22}: {valor:.2f}" if isinstance(valor, float) else f"{clave:>22}: {valor}")
+        print()
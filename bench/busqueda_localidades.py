@@ -0,0 +1,54 @@
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+# Nomenclador del bot: cuánto tarda resolver un nombre (exacto, mal escrito, ambiguo) y encontrar la localidad
+# más cercana con el KD-tree contra una recorrida lineal, y si las dos búsquedas dan lo mismo
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+from localidades import localidades, a_esfera
+
+NOMBRES = {
+    "exacto": ["Rosario", "cba", "Mar del Plata", "Merlo, San Luis"],
+    "prefijo": ["mar del", "gualeguayc", "san carlos"],
+    "mal_escrito": ["rosaro", "cordba", "bariloch", "neuquen capital"],
+    "ambiguo": ["villa", "san", "qwerty"],
+}
+
+
+def medir(funcion, argumentos, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for argumento in argumentos:
+            funcion(*argumento)
+    return (time.perf_counter() - inicio) / (repeticiones * len(argumentos)) * 1e6
+
+def cercana_lineal(lat, lon):
+    punto = a_esfera(lat, lon)
+    return min(localidades.localidades, key=lambda l: math.dist(a_esfera(l.lat, l.lon), punto))
+
+def correr(puntos=2000, repeticiones=200, semilla=0):
+    rnd = random.Random(semilla)
+    coordenadas = [(rnd.uniform(-55, -22), rnd.uniform(-73, -54)) for _ in range(puntos)]
+    distintas = sum(1 for lat, lon in coordenadas
+                    if localidades.cercana(lat, lon, max_km=math.inf)[0] is not cercana_lineal(lat, lon))
+
+    resultado = {"localidades": len(localidades)}
+    for tipo, nombres in NOMBRES.items():
+        resultado[f"resolver_{tipo}_us"] = medir(localidades.resolver, [(n,) for n in nombres], repeticiones)
+    resultado["cercana_kd_us"] = medir(localidades.cercana, coordenadas, 1)
+    resultado["cercana_lineal_us"] = medir(cercana_lineal, coordenadas[:200], 1)
+    resultado["kd_distinta_de_lineal"] = distintas
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia del nomenclador de localidades del bot")
+    parser.add_argument("--puntos", type=int, default=2000)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    for clave, valor in correr(args.puntos, args.repeticiones).items():
+        print(f"{clave:>24}: {valor:10.1f}" if isinstance(valor, float) else f"{clave:>24}: {valor}")
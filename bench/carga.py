@@ -0,0 +1,78 @@
+import time
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+
+# Generador de carga para la API: N clientes concurrentes durante un tiempo fijo, reporta p50/p95/p99 y pedidos/s
+
+# Ubicaciones alrededor de las ciudades con más tráfico
+CENTROS = [(-34.58, -58.43), (-31.42, -64.18), (-32.89, -68.85)]
+
+
+def ubicacion_aleatoria(rnd, dispersion=0.2):
+    lat, lon = rnd.choice(CENTROS)
+    return round(lat + rnd.uniform(-dispersion, dispersion), 4), round(lon + rnd.uniform(-dispersion, dispersion), 4)
+
+def armar_pedido(endpoint, rnd, tam_lote):
+    lat, lon = ubicacion_aleatoria(rnd)
+    if endpoint == "/predecir_lote":
+        return {"ubicaciones": [dict(zip(("lat", "lon"), ubicacion_aleatoria(rnd)), lead=rnd.randint(0, 48))
+                                for _ in range(tam_lote)]}
+    if endpoint == "/predecir_horizonte":
+        return {"lat": lat, "lon": lon}
+    return {"lat": lat, "lon": lon, "lead": rnd.randint(0, 48)}
+
+def resumir(latencias, errores, duracion):
+    lat_ms = np.array(latencias) * 1000 if latencias else np.array([np.nan])
+    return {
+        "pedidos": len(latencias),
+        "errores": errores,
+        "pedidos_por_s": len(latencias) / duracion,
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p95_ms": float(np.percentile(lat_ms, 95)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "max_ms": float(np.max(lat_ms)),
+    }
+
+async def correr(url, endpoint="/predecir", concurrencia=20, duracion=10.0, tam_lote=100, semilla=0):
+    rnd = random.Random(semilla)
+    latencias = []
+    errores = 0
+    fin = time.perf_counter() + duracion
+
+    async def cliente(http):
+        nonlocal errores
+        while time.perf_counter() < fin:
+            payload = armar_pedido(endpoint, rnd, tam_lote)
+            inicio = time.perf_counter()
+            try:
+                r = await http.post(endpoint, json=payload)
+                if r.status_code != 200 or "error" in r.json():
+                    errores += 1
+                    continue
+            except httpx.HTTPError:
+                errores += 1
+                continue
+            latencias.append(time.perf_counter() - inicio)
+
+    limites = httpx.Limits(max_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limites) as http:
+        inicio = time.perf_counter()
+        await asyncio.gather(*[cliente(http) for _ in range(concurrencia)])
+        return resumir(latencias, errores, time.perf_counter() - inicio)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga sobre la API de predicción")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="/predecir",
+                        choices=["/predecir", "/predecir_lote", "/predecir_horizonte"])
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--duracion", type=float, default=10.0)
+    parser.add_argument("--tam-lote", type=int, default=100)
+    args = parser.parse_args()
+    resultado = asyncio.run(correr(args.url, args.endpoint, args.concurrencia, args.duracion, args.tam_lote))
+    for clave, valor in resultado.items():
+        print(f"{clave:>14}: {valor:.2f}" if isinstance(valor, float) else f"{clave:>14}: {valor}")
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import httpx
+import numpy as np
+import telegram_falso
+
+# Carga sobre el bot contra el Telegram falso: N chats mandan "/abrigo" y sus coordenadas sin esperar respuesta.
+# Mide cuánto tarda cada chat en recibir la recomendación y verifica que los mensajes de cada chat lleguen
+# en orden (si el bot procesara los dos updates de un chat en paralelo, las coordenadas se perderían).
+
+DIRECTORIO_BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+TOKEN = "123456:falso"
+
+
+def update(update_id, chat_id, texto):
+    msg = {"message_id": update_id, "date": int(time.time()), "text": texto,
+           "chat": {"id": chat_id, "type": "private"},
+           "from": {"id": chat_id, "is_bot": False, "first_name": f"usuario{chat_id}"}}
+    if texto.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto)}]
+    return {"update_id": update_id, "message": msg}
+
+def esperar_puerto(puerto, timeout=30):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", puerto)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f"El bot no abrió el puerto {puerto}")
+
+def correr(chats=50, concurrencia=32, modo="webhook", latencia_api_ms=200, puerto_falso=8082, puerto_bot=8443,
+           timeout=60):
+    estado, servidor = telegram_falso.servir(puerto_falso, latencia_api_ms / 1000)
+    url_falso = f"http://127.0.0.1:{puerto_falso}"
+    entorno = dict(os.environ, TOKEN=TOKEN, BOT_TELEGRAM_URL=url_falso, API_URL=f"{url_falso}/predecir",
+                   BOT_CONCURRENCIA=str(concurrencia), PORT=str(puerto_bot), BOT_WEBHOOK_SECRETO="secreto")
+    url_webhook = f"http://127.0.0.1:{puerto_bot}/webhook"
+    if modo == "webhook":
+        entorno["BOT_WEBHOOK_URL"] = url_webhook
+    else:
+        entorno.pop("BOT_WEBHOOK_URL", None)
+    bot = subprocess.Popen([sys.executable, "bot.py"], cwd=DIRECTORIO_BOT, env=entorno,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if modo == "webhook":
+            esperar_puerto(puerto_bot)
+        else:
+            while "getUpdates" not in estado.metodos:
+                time.sleep(0.1)
+
+        # Coordenadas distintas por chat para que no acierte la cache de recomendaciones del bot
+        updates = []
+        for chat in range(1, chats + 1):
+            updates.append(update(2 * chat, chat, "/abrigo"))
+            updates.append(update(2 * chat + 1, chat, f"{-34 - chat * 0.02:.2f},-58.42"))
+
+        inicio = time.perf_counter()
+        if modo == "webhook":
+            with httpx.Client() as http:
+                for u in updates:
+                    http.post(url_webhook, json=u, headers={"X-Telegram-Bot-Api-Secret-Token": "secreto"})
+        else:
+            for u in updates:
+                estado.encolar(u)
+
+        # Cada chat termina con 3 mensajes: pedido de coordenadas, recomendación y pregunta por la lluvia
+        limite = time.time() + timeout
+        while time.time() < limite and sum(len(estado.enviados.get(c, [])) >= 3 for c in range(1, chats + 1)) < chats:
+            time.sleep(0.05)
+
+        tiempos, en_orden = [], 0
+        for chat in range(1, chats + 1):
+            enviados = estado.enviados.get(chat, [])
+            textos = [texto for _, texto in enviados]
+            if len(textos) >= 3 and textos[0].startswith("Por favor") and "Te recomiendo" in textos[1]:
+                en_orden += 1
+                tiempos.append(enviados[1][0] - inicio)
+        tiempos_ms = np.array(tiempos or [np.nan]) * 1000
+        return {
+            "modo": modo,
+            "concurrencia": concurrencia,
+            "chats": chats,
+            "chats_en_orden": en_orden,
+            "pedidos_api": estado.pedidos_api,
+            "total_s": time.perf_counter() - inicio,
+            "p50_ms": float(np.percentile(tiempos_ms, 50)),
+            "p95_ms": float(np.percentile(tiempos_ms, 95)),
+            "max_ms": float(np.max(tiempos_ms)),
+        }
+    finally:
+        bot.terminate()
+        bot.wait()
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga sobre el bot con un Telegram falso")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--concurrencia", type=int, default=32, help="BOT_CONCURRENCIA (1 = secuencial)")
+    parser.add_argument("--modo", choices=["webhook", "polling"], default="webhook")
+    parser.add_argument("--latencia-api-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    resultado = correr(args.chats, args.concurrencia, args.modo, args.latencia_api_ms)
+    for clave, valor in resultado.items():
+        print(f"{clave:>15}: {valor:.1f}" if isinstance(valor, float) else f"{clave:>15}: {valor}")
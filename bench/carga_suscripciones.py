@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+from types import SimpleNamespace
+import numpy as np
+import telegram_falso
+
+# Envío de la recomendación diaria a N suscriptos contra el Telegram falso: cuántos pedidos a la API hacen falta
+# (una ubicación por celda de SUSCRIPCION_GRILLA, en lotes de SUSCRIPCION_LOTE) y cuánto tarda el envío pausado.
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+
+async def correr(suscriptos=2000, latencia_api_ms=200, puerto=8082, semilla=0):
+    estado, servidor = telegram_falso.servir(puerto, latencia_api_ms / 1000)
+    url = f"http://127.0.0.1:{puerto}"
+    os.environ["API_URL"] = f"{url}/predecir"
+    from telegram import Bot
+    import cliente_api as ca
+    from suscripciones import suscripciones, envios, enviar_suscripciones
+
+    # Suscriptos repartidos en el AMBA y en Córdoba, todos a las 8
+    rng = np.random.default_rng(semilla)
+    centros = np.array([[-34.60, -58.45], [-31.42, -64.19]])
+    elegidos = centros[rng.integers(0, len(centros), suscriptos)]
+    puntos = elegidos + rng.normal(0, 0.15, (suscriptos, 2))
+    for chat_id, (lat, lon) in enumerate(puntos, start=1):
+        await suscripciones.agregar(chat_id, float(lat), float(lon), 8)
+
+    bot = Bot("123456:falso", base_url=f"{url}/bot")
+    await bot.initialize()
+    await ca.cliente.iniciar()
+    envios.iniciar(bot)
+    try:
+        inicio = time.perf_counter()
+        await enviar_suscripciones(SimpleNamespace(job=SimpleNamespace(data=8)))
+        encolado = time.perf_counter() - inicio
+        while envios.enviados + envios.errores < suscriptos:
+            await asyncio.sleep(0.05)
+        total = time.perf_counter() - inicio
+    finally:
+        await envios.detener()
+        await ca.cliente.cerrar()
+        await bot.shutdown()
+        servidor.shutdown()
+
+    return {
+        "suscriptos": suscriptos,
+        "celdas": len(suscripciones.agrupar(8)),
+        "pedidos_api": estado.pedidos_api,
+        "ubicaciones_api": estado.ubicaciones_api,
+        "enviados": envios.enviados,
+        "errores": envios.errores,
+        "prediccion_s": encolado,
+        "total_s": total,
+        "mensajes_por_s": envios.enviados / total,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Envío de la recomendación diaria con un Telegram falso")
+    parser.add_argument("--suscriptos", type=int, default=2000)
+    parser.add_argument("--latencia-api-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    resultado = asyncio.run(correr(args.suscriptos, args.latencia_api_ms))
+    for clave, valor in resultado.items():
+        print(f"{clave:>15}: {valor:.2f}" if isinstance(valor, float) else f"{clave:>15}: {valor}")
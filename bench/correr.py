@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+import subprocess
+import httpx
+
+import carga
+import micro
+
+# Corre todo el benchmark sin red: levanta el stub de Open-Meteo y la API, mide carga y microbenchmarks.
+# Guardando la salida con --salida en cada commit se pueden comparar resultados.
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BENCH = os.path.join(RAIZ, "bench")
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def esperar(url, timeout=60):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} no respondió en {timeout} s")
+
+def levantar_stub(puerto_stub, latencia_ms):
+    stub = subprocess.Popen([sys.executable, os.path.join(BENCH, "stub_open_meteo.py"),
+                             "--puerto", str(puerto_stub), "--latencia-ms", str(latencia_ms)])
+    esperar(f"http://127.0.0.1:{puerto_stub}/v1/forecast")
+    return stub
+
+def levantar_api(puerto_api, puerto_stub, entorno_extra=None):
+    entorno = dict(os.environ, OPEN_METEO_URL=f"http://127.0.0.1:{puerto_stub}/v1/forecast", **(entorno_extra or {}))
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--port", str(puerto_api), "--log-level", "warning"],
+                           cwd=os.path.join(RAIZ, "api"), env=entorno)
+    esperar(f"http://127.0.0.1:{puerto_api}/docs")
+    return api
+
+def levantar(puerto_api, puerto_stub, latencia_ms, entorno_extra=None):
+    stub = levantar_stub(puerto_stub, latencia_ms)
+    return [stub, levantar_api(puerto_api, puerto_stub, entorno_extra)]
+
+def commit_actual():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark completo sin red")
+    parser.add_argument("--puerto-api", type=int, default=8000)
+    parser.add_argument("--puerto-stub", type=int, default=8081)
+    parser.add_argument("--latencia-ms", type=float, default=50.0, help="latencia simulada de Open-Meteo")
+    parser.add_argument("--duracion", type=float, default=10.0)
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = {"commit": commit_actual(), "latencia_stub_ms": args.latencia_ms, "carga": {}}
+    procesos = levantar(args.puerto_api, args.puerto_stub, args.latencia_ms)
+    try:
+        url = f"http://127.0.0.1:{args.puerto_api}"
+        for endpoint in ["/predecir", "/predecir_lote", "/predecir_horizonte"]:
+            resultado = asyncio.run(carga.correr(url, endpoint, args.concurrencia, args.duracion))
+            resultados["carga"][endpoint] = resultado
+            print(f"{endpoint}: {resultado['pedidos_por_s']:.1f} pedidos/s, p50 {resultado['p50_ms']:.1f} ms, "
+                  f"p95 {resultado['p95_ms']:.1f} ms, p99 {resultado['p99_ms']:.1f} ms, {resultado['errores']} errores")
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+            proceso.wait()
+
+    resultados["micro"] = micro.correr()
+    for clave, valor in resultados["micro"].items():
+        print(f"{clave}: {valor:.1f} us")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import argparse
+import requests
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import weather as we
+from stub_open_meteo import DIRECTORIO_GRABACIONES
+
+# Graba respuestas reales de Open-Meteo (FlatBuffers crudo) para que el stub las reproduzca sin red.
+# Es lo único del benchmark que necesita conexión; alcanza con correrlo una vez.
+
+UBICACIONES = {
+    "caba": (-34.5821438, -58.4303663),
+    "cordoba": (-31.4580911, -64.2199552),
+    "mendoza": (-32.8894587, -68.8458386),
+    "bariloche": (-41.1334722, -71.3102778),
+    "salta": (-24.7821269, -65.4231976),
+}
+
+
+def grabar(nombre, lat, lon, directorio=DIRECTORIO_GRABACIONES):
+    hoy = datetime.now(timezone.utc).date()
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": (hoy - timedelta(days=1)).strftime('%Y-%m-%d'),
+        "end_date": (hoy + timedelta(days=4)).strftime('%Y-%m-%d'),
+        "hourly": ",".join(we.VARIABLES_HORARIAS),
+        "timezone": "auto",
+        "format": "flatbuffers",
+    }
+    r = requests.get(we.URL_FORECAST, params=params, timeout=30)
+    r.raise_for_status()
+
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, f"{nombre}.bin"), "wb") as f:
+        f.write(r.content)
+    with open(os.path.join(directorio, f"{nombre}.json"), "w") as f:
+        json.dump({"latitude": lat, "longitude": lon, "hourly": we.VARIABLES_HORARIAS,
+                   "grabado": datetime.now(timezone.utc).isoformat()}, f, indent=2)
+    print(f"{nombre}: {len(r.content)} bytes")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Graba respuestas de Open-Meteo para el stub")
+    parser.add_argument("--directorio", default=DIRECTORIO_GRABACIONES)
+    args = parser.parse_args()
+    for nombre, (lat, lon) in UBICACIONES.items():
+        grabar(nombre, lat, lon, args.directorio)
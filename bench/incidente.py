@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import httpx
+import numpy as np
+from correr import esperar, RAIZ, BENCH
+
+# Simula una caída de Open-Meteo: calienta la cache con algunas ubicaciones, cambia el stub por uno que
+# falla (503) o no responde a tiempo y mide latencia y códigos de /predecir para ubicaciones ya vistas
+# (deberían salir con el clima vencido) y nuevas (deberían salir con 503 sin esperar los reintentos).
+
+# Corridas cortas para que los datos guardados se venzan durante la prueba
+PERIODO_MODELO = 20
+
+
+def levantar_stub(puerto, latencia_ms=0.0, prob_falla=0.0):
+    stub = subprocess.Popen([sys.executable, os.path.join(BENCH, "stub_open_meteo.py"), "--puerto", str(puerto),
+                             "--latencia-ms", str(latencia_ms), "--prob-falla", str(prob_falla)],
+                            stderr=subprocess.DEVNULL)
+    # Sólo se espera a que abra el puerto: en modo lento un pedido de prueba tardaría lo mismo que la latencia
+    limite = time.time() + 10
+    while time.time() < limite:
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", puerto)) == 0:
+                return stub
+        time.sleep(0.1)
+    raise RuntimeError("El stub no abrió el puerto")
+
+def resumir(resultados):
+    latencias = np.array([r[1] for r in resultados] or [np.nan]) * 1000
+    codigos = {}
+    for codigo, _, _ in resultados:
+        codigos[codigo] = codigos.get(codigo, 0) + 1
+    return {
+        "pedidos": len(resultados),
+        "codigos": codigos,
+        "vencidos": sum(1 for _, _, vencido in resultados if vencido),
+        "p50_ms": float(np.percentile(latencias, 50)),
+        "p99_ms": float(np.percentile(latencias, 99)),
+        "max_ms": float(np.max(latencias)),
+    }
+
+async def medir(url, conocidas, duracion, concurrencia, semilla=0):
+    rnd = random.Random(semilla)
+    resultados = {"conocidas": [], "nuevas": []}
+    fin = time.perf_counter() + duracion
+
+    async def cliente(http):
+        while time.perf_counter() < fin:
+            if rnd.random() < 0.5:
+                grupo, (lat, lon) = "conocidas", rnd.choice(conocidas)
+            else:
+                grupo, lat, lon = "nuevas", rnd.uniform(-40, -25), rnd.uniform(-70, -55)
+            inicio = time.perf_counter()
+            r = await http.post("/predecir", json={"lat": lat, "lon": lon, "lead": 0})
+            resultados[grupo].append((r.status_code, time.perf_counter() - inicio, r.json().get("vencido", False)))
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as http:
+        await asyncio.gather(*[cliente(http) for _ in range(concurrencia)])
+        circuito = (await http.get("/circuito")).json()
+    return {grupo: resumir(r) for grupo, r in resultados.items()}, circuito
+
+def correr(modo="caido", duracion=10.0, concurrencia=10, puerto_api=8000, puerto_stub=8081, ubicaciones=10):
+    entorno = dict(os.environ, OPEN_METEO_URL=f"http://127.0.0.1:{puerto_stub}/v1/forecast",
+                   CACHE_PERIODO_MODELO=str(PERIODO_MODELO), CACHE_DEMORA_MODELO="0", CACHE_COMPARTIDA="",
+                   RASTER_DIR="")
+    stub = levantar_stub(puerto_stub)
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "api:app", "--port", str(puerto_api), "--log-level",
+                            "warning"], cwd=os.path.join(RAIZ, "api"), env=entorno, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{puerto_api}"
+    try:
+        esperar(f"{url}/docs")
+        conocidas = [(-34.6 + 0.1 * i, -58.4) for i in range(ubicaciones)]
+        for lat, lon in conocidas:
+            httpx.post(f"{url}/predecir", json={"lat": lat, "lon": lon, "lead": 0}, timeout=30)
+
+        # Open-Meteo se cae y, en la corrida siguiente, todo lo guardado pasa a estar vencido
+        stub.terminate()
+        stub.wait()
+        if modo == "caido":
+            stub = levantar_stub(puerto_stub, prob_falla=1.0)
+        else:
+            stub = levantar_stub(puerto_stub, latencia_ms=30000)
+        time.sleep(PERIODO_MODELO - time.time() % PERIODO_MODELO + 0.5)
+
+        por_grupo, circuito = asyncio.run(medir(url, conocidas, duracion, concurrencia))
+    finally:
+        api.terminate()
+        api.wait()
+        stub.terminate()
+        stub.wait()
+    return {"modo": modo, **por_grupo, "circuito": circuito}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latencia de /predecir durante una caída de Open-Meteo")
+    parser.add_argument("--modo", choices=["caido", "lento"], default="caido",
+                        help="caido: el stub responde 503; lento: tarda 30 s en responder")
+    parser.add_argument("--duracion", type=float, default=10.0)
+    parser.add_argument("--concurrencia", type=int, default=10)
+    args = parser.parse_args()
+    resultado = correr(args.modo, args.duracion, args.concurrencia)
+    for clave, valor in resultado.items():
+        print(f"{clave}: {valor}")
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+
+DIRECTORIO_API = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+sys.path.insert(0, DIRECTORIO_API)
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+import stub_open_meteo as stub
+import weather as we
+
+_cwd = os.getcwd()
+os.chdir(DIRECTORIO_API)  # api.py carga el modelo con ruta relativa
+import api
+os.chdir(_cwd)
+
+# Microbenchmarks sin red: decodificación de la respuesta de Open-Meteo e inferencia del modelo
+
+
+def medir(funcion, repeticiones):
+    funcion()
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+def respuesta_de_prueba(base, variables):
+    grabaciones = stub.cargar_grabaciones()
+    grabacion = grabaciones[0] if grabaciones else stub.sintetica(base['lat'], base['lon'])
+    params = we._params_forecast(base['lat'], base['lon'], we.pd.Timestamp(base['date']).tz_localize("UTC"),
+                                 we.pd.Timestamp(base['date']).tz_localize("UTC"), variables)
+    inicio = stub._epoch(params["start_date"], grabacion.utc_offset)
+    fin = stub._epoch(params["end_date"], grabacion.utc_offset, dias=1)
+    data = stub.codificar(base['lat'], base['lon'], grabacion, inicio, fin, variables)
+    return WeatherApiResponse.GetRootAs(data, 4)
+
+def correr(repeticiones=200):
+    variables = api.esquema.variables
+    base = api.armar_base(api.Ubicacion(lat=-34.58, lon=-58.43, lead=3))
+    response = respuesta_de_prueba(base, variables)
+    datos = we.decodificar_horario(response, variables)
+    filas = we.extraer_filas([base], datos, variables)
+    lote = [dict(filas[0], id=i) for i in range(100)]
+    # 100 horas distintas de la misma celda, como un pedido de /predecir_horizonte o un tramo del backfill
+    horizonte = [dict(base, id=i, hour_integer=i % 24, date=base['date'] + we.timedelta(days=i // 24 % 3))
+                 for i in range(100)]
+
+    return {
+        "decodificar_horario_us": medir(lambda: we.decodificar_horario(response, variables), repeticiones),
+        "extraer_fila_us": medir(lambda: we.extraer_filas([base], datos, variables), repeticiones),
+        "extraer_100_filas_us": medir(lambda: we.extraer_filas(horizonte, datos, variables), repeticiones),
+        "armar_pool_1_us": medir(lambda: api.ensamblador.armar([dict(filas[0])]), repeticiones),
+        "predict_proba_1_us": medir(lambda: api.puntuar([dict(filas[0])]), repeticiones),
+        "predict_proba_100_us": medir(lambda: api.puntuar(lote), max(1, repeticiones // 10)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks de decodificación e inferencia")
+    parser.add_argument("--repeticiones", type=int, default=200)
+    args = parser.parse_args()
+    for clave, valor in correr(args.repeticiones).items():
+        print(f"{clave:>22}: {valor:10.1f}")
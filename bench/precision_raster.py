@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+# Diferencia entre el raster precalculado y la predicción en vivo (la que hace /predecir fuera del raster):
+# genera un raster, sortea ubicaciones y leads dentro de la región y compara las dos respuestas.
+# Con --stub usa stub_open_meteo.py en lugar de Open-Meteo
+
+DIRECTORIO_BENCH = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIO_API = os.path.join(DIRECTORIO_BENCH, "..", "api")
+sys.path.insert(0, DIRECTORIO_API)
+PUERTO_STUB = 8081
+
+
+def comparar(vivo, precalculado):
+    return {
+        "misma_clase": vivo["class_1st"] == precalculado["class_1st"],
+        "en_top2": precalculado["class_1st"] in (vivo["class_1st"], vivo["class_2nd"]),
+        "prob_1st": abs(vivo["prob_1st"] - precalculado["prob_1st"]),
+        "temperature": abs(vivo["temperature"] - precalculado["temperature"]),
+        "apparent_temperature": abs(vivo["apparent_temperature"] - precalculado["apparent_temperature"]),
+        "precipitation_prob": abs(vivo["precipitation_prob"] - precalculado["precipitation_prob"]),
+        "misma_hour_geo": vivo["hour_geo"] == precalculado["hour_geo"],
+    }
+
+async def correr(api, raster, directorio, puntos, semilla):
+    generador = raster.GeneradorRaster(api.modelo, api.ensamblador, api.esquema.variables, directorio)
+    inicio = time.perf_counter()
+    meta = await generador.generar()
+    generacion_s = time.perf_counter() - inicio
+    lector = raster.RasterRecomendaciones(directorio)
+
+    rng = random.Random(semilla)
+    lat_min, lat_max, lon_min, lon_max = raster.region(generador.region)
+    comparaciones, busquedas, vivos, fuera = [], [], [], 0
+    for _ in range(puntos):
+        ubicacion = api.Ubicacion(lat=rng.uniform(lat_min, lat_max), lon=rng.uniform(lon_min, lon_max),
+                                  lead=rng.randint(0, 48))
+        base = api.armar_base(ubicacion)
+        t = time.perf_counter()
+        precalculado = lector.buscar(ubicacion.lat, ubicacion.lon, base)
+        busquedas.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        vivo = (await api.predecir_filas([dict(base)])).get(0)
+        vivos.append(time.perf_counter() - t)
+        if precalculado is None or vivo is None:
+            fuera += 1
+            continue
+        comparaciones.append(comparar(vivo, precalculado))
+    await api.planificador.detener()
+    await api.we.cerrar_cliente_async()
+
+    resultado = {
+        "celdas": meta["n_lat"] * meta["n_lon"],
+        "celdas_fallidas": meta["celdas_fallidas"],
+        "generacion_s": generacion_s,
+        "puntos": puntos,
+        "sin_respuesta": fuera,
+        "busqueda_raster_us": float(np.median(busquedas) * 1e6),
+        "prediccion_vivo_ms": float(np.median(vivos) * 1000),
+    }
+    if comparaciones:
+        for clave in comparaciones[0]:
+            valores = [c[clave] for c in comparaciones]
+            nombre = clave if clave.startswith(("misma", "en_")) else f"error_{clave}"
+            resultado[nombre] = float(np.mean(valores))
+    return resultado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precisión del raster precalculado contra la predicción en vivo")
+    parser.add_argument("--puntos", type=int, default=200)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--stub", action="store_true", help="usar stub_open_meteo.py en lugar de Open-Meteo")
+    args = parser.parse_args()
+
+    stub = None
+    if args.stub:
+        stub = subprocess.Popen([sys.executable, os.path.join(DIRECTORIO_BENCH, "stub_open_meteo.py"),
+                                 "--puerto", str(PUERTO_STUB)])
+        os.environ["OPEN_METEO_URL"] = f"http://127.0.0.1:{PUERTO_STUB}/v1/forecast"
+        time.sleep(1)
+    try:
+        cwd = os.getcwd()
+        os.chdir(DIRECTORIO_API)  # api.py carga el modelo con ruta relativa
+        import api
+        import raster
+        os.chdir(cwd)
+        with tempfile.TemporaryDirectory() as directorio:
+            resultado = asyncio.run(correr(api, raster, directorio, args.puntos, args.semilla))
+    finally:
+        if stub is not None:
+            stub.terminate()
+    for clave, valor in resultado.items():
+        print(f"{clave:>22}: {valor:.3f}" if isinstance(valor, float) else f"{clave:>22}: {valor}")
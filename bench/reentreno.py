@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import shutil
+import random
+import asyncio
+import tempfile
+import argparse
+import httpx
+import numpy as np
+from almacen import filas_entrenamiento
+from carga import armar_pedido, resumir
+from correr import levantar_stub, levantar_api
+
+# Reentrenamiento incremental (api/reentrenar.py) y cambio de modelo en caliente (api/modelos.py):
+#   - arma filas etiquetadas con backfill.py contra el stub. La etiqueta sale de la sensación térmica con cortes
+#     fijos y un 10% de ruido: con el clima sintético del stub el modelo vigente responde casi siempre lo mismo,
+#     así que el candidato tiene algo que aprender
+#   - sigue entrenando el modelo vigente con esas filas y pasa las compuertas de latencia, tamaño y precisión.
+#     Un segundo candidato con más árboles muestra el rechazo por tamaño
+#   - sigue reentrenando y promoviendo sobre el último hasta que un candidato queda afuera: el tamaño se
+#     compara con el modelo del repo, así que los árboles no crecen sin límite
+#   - con la API bajo carga publica el candidato y mide errores y latencia antes, durante y después del cambio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+# Prenda por sensación térmica: hasta 12 °C, de 12 a 16, de 16 a 20 y desde 20
+CORTES = [12, 16, 20]
+PRENDAS = ["camperon", "sweater", "buzo/hoodie", "remera"]
+# Proporción de etiquetas al azar
+RUIDO = 0.1
+
+
+def etiquetar(df, semilla=0):
+    from reentrenar import REENTRENO_ETIQUETA
+    etiquetas = np.array(PRENDAS, dtype=object)[np.digitize(df["weather_apparent_temperature"], CORTES)]
+    rng = np.random.default_rng(semilla)
+    ruido = rng.random(len(df)) < RUIDO
+    etiquetas[ruido] = rng.choice(PRENDAS, int(ruido.sum()))
+    return df.assign(Ambiente="afuera", Half_of_day=np.where(df["hour_integer"] < 12, "AM", "PM"),
+                     **{REENTRENO_ETIQUETA: etiquetas})
+
+async def cargar_y_cambiar(url, directorio, version, concurrencia=10, antes=10.0, despues=10.0, semilla=0):
+    # Carga constante sobre /predecir; a los `antes` segundos se publica la versión (el paso final de
+    # reentrenar.py) y se sigue `despues` segundos más. Cada pedido queda en la fase en que empezó
+    import modelos
+    fases = {"antes": ([], [0]), "cambio": ([], [0]), "despues": ([], [0])}
+    estado = {"fase": "antes", "fin": False}
+    rnd = random.Random(semilla)
+
+    async def cliente(http):
+        while not estado["fin"]:
+            fase = estado["fase"]
+            inicio = time.perf_counter()
+            try:
+                r = await http.post("/predecir", json=armar_pedido("/predecir", rnd, 1))
+                if r.status_code != 200 or "class_1st" not in r.json():
+                    fases[fase][1][0] += 1
+            except httpx.HTTPError:
+                fases[fase][1][0] += 1
+            fases[fase][0].append(time.perf_counter() - inicio)
+
+    async with httpx.AsyncClient(base_url=url, timeout=30) as http, httpx.AsyncClient(base_url=url) as control:
+        inicio = time.perf_counter()
+        clientes = [asyncio.create_task(cliente(http)) for _ in range(concurrencia)]
+        await asyncio.sleep(antes)
+        estado["fase"] = "cambio"
+        publicado = time.perf_counter()
+        modelos.apuntar(directorio, version)
+        while (await control.get("/modelo")).json()["version"] != version:
+            await asyncio.sleep(0.05)
+        cambio_s = time.perf_counter() - publicado
+        estado["fase"] = "despues"
+        await asyncio.sleep(despues)
+        estado["fin"] = True
+        await asyncio.gather(*clientes)
+        duracion = time.perf_counter() - inicio
+        modelo = (await control.get("/modelo")).json()
+    resultado = {"hasta_tomarlo_s": cambio_s, "modelo": modelo}
+    for fase, (latencias, errores) in fases.items():
+        resultado[fase] = resumir(latencias, errores[0], duracion)
+    return resultado
+
+def correr(filas=3000, puerto_api=8000, puerto_stub=8081, latencia_ms=50.0, semilla=0):
+    import backfill
+    import modelos
+    from reentrenar import reentrenar
+    directorio = tempfile.mkdtemp(prefix="modelos_")
+    backfill.URL_HISTORICO = f"http://127.0.0.1:{puerto_stub}/v1/forecast"
+    stub = levantar_stub(puerto_stub, latencia_ms)
+    api = None
+    try:
+        df = backfill.get_data_training(filas_entrenamiento(filas, semilla), os.path.join(directorio, ".backfill"),
+                                        llamadas_por_minuto=1e6)
+        df = etiquetar(df, semilla)
+        inicio = time.perf_counter()
+        reporte = reentrenar(df, directorio)
+        reporte["pipeline_s"] = time.perf_counter() - inicio
+        # Cinco veces más árboles que lo habitual, sin promover: tiene que quedar afuera por tamaño
+        grande = reentrenar(df, directorio, promover=False, iteraciones=1000)
+        if not reporte["aprobado"]:
+            return {"reentreno": reporte, "grande": grande}
+        # La API arranca con el modelo del repo y toma el promovido cuando vuelve a aparecer el puntero
+        os.remove(os.path.join(directorio, modelos.ARCHIVO_ACTUAL))
+        api = levantar_api(puerto_api, puerto_stub, {"MODELO_DIR": directorio, "MODELO_RECARGA_S": "1",
+                                                     "RASTER_DIR": "", "CAPTURA_DIR": "", "CACHE_COMPARTIDA": ""})
+        cambio = asyncio.run(cargar_y_cambiar(f"http://127.0.0.1:{puerto_api}", directorio, reporte["version"]))
+        seguidos = [reporte]
+        while seguidos[-1]["aprobado"] and len(seguidos) < 10:
+            seguidos.append(reentrenar(df, directorio))
+        return {"reentreno": reporte, "grande": grande, "cambio": cambio, "seguidos": seguidos}
+    finally:
+        for proceso in [stub, api]:
+            if proceso is not None:
+                proceso.terminate()
+                proceso.wait()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reentrenamiento incremental y cambio de modelo en caliente")
+    parser.add_argument("--filas", type=int, default=3000, help="filas etiquetadas nuevas")
+    parser.add_argument("--puerto-api", type=int, default=8000)
+    parser.add_argument("--puerto-stub", type=int, default=8081)
+    args = parser.parse_args()
+    resultado = correr(args.filas, args.puerto_api, args.puerto_stub)
+    for clave, valor in resultado["reentreno"].items():
+        print(f"{clave:>32}: {valor:12.3f}" if isinstance(valor, float) else f"{clave:>32}: {valor}")
+    print(f"{'grande_motivos':>32}: {resultado['grande']['motivos']}")
+    if "cambio" in resultado:
+        print(f"{'hasta_tomarlo_s':>32}: {resultado['cambio']['hasta_tomarlo_s']:12.3f}")
+        print(f"{'modelo':>32}: {resultado['cambio']['modelo']}")
+        for k, r in enumerate(resultado["seguidos"]):
+            print(f"{f'seguido_{k + 1}':>32}: {r['arboles_candidato']} árboles, {r['tamano_candidato_kb']:.0f} KB, "
+                  f"{'promovido' if r['aprobado'] else r['motivos']}")
+        for fase in ["antes", "cambio", "despues"]:
+            r = resultado["cambio"][fase]
+            print(f"{fase:>32}: {r['pedidos']} pedidos, {r['errores']} errores, p50 {r['p50_ms']:.1f} ms, "
+                  f"p99 {r['p99_ms']:.1f} ms")
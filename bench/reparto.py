@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import json
+import random
+import asyncio
+import argparse
+import httpx
+import numpy as np
+from correr import levantar_stub, levantar_api
+
+# Varias instancias de la API detrás del cliente del bot (bot/cliente_api.py): con reparto por turno cada cache
+# de clima ve todas las celdas, con hashing consistente por celda cada una ve sólo las suyas. Levanta el stub de
+# Open-Meteo y 1, 2, 4... procesos de la API, manda la misma carga con los dos repartos y reporta, por instancia,
+# pedidos, tasa de aciertos de la cache de clima y pedidos a Open-Meteo. También mide qué parte de las celdas
+# cambia de instancia al sumar o quitar una, con el anillo y con hash módulo N
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+from cliente_api import ClienteAPI, AnilloConsistente, clave_celda, _hash, API_GRILLA
+
+CENTROS = [(-34.58, -58.43), (-31.42, -64.18), (-32.89, -68.85), (-26.82, -65.22), (-38.00, -57.55)]
+
+
+def celdas_aleatorias(cantidad, rnd):
+    # Centros de celdas distintas alrededor de las ciudades (la zona crece si se piden más celdas de las que entran)
+    dispersion = max(1.0, API_GRILLA * (cantidad / len(CENTROS)) ** 0.5)
+    celdas = set()
+    while len(celdas) < cantidad:
+        lat, lon = rnd.choice(CENTROS)
+        celdas.add((round((lat + rnd.uniform(-dispersion, dispersion)) / API_GRILLA),
+                    round((lon + rnd.uniform(-dispersion, dispersion)) / API_GRILLA)))
+    return [(i * API_GRILLA, j * API_GRILLA) for i, j in sorted(celdas)]
+
+def armar_carga(pedidos, cantidad_celdas, zipf=1.0, semilla=0):
+    # Popularidad de Zipf: pocas celdas (las ciudades) concentran la mayoría de los pedidos
+    rnd = random.Random(semilla)
+    celdas = celdas_aleatorias(cantidad_celdas, rnd)
+    pesos = 1 / np.arange(1, len(celdas) + 1) ** zipf
+    elegidas = np.random.default_rng(semilla).choice(len(celdas), pedidos, p=pesos / pesos.sum())
+    medio = API_GRILLA / 2 * 0.9
+    return [(round(celdas[k][0] + rnd.uniform(-medio, medio), 4), round(celdas[k][1] + rnd.uniform(-medio, medio), 4),
+             rnd.randint(0, 48)) for k in elegidas]
+
+def contadores(texto, nombre):
+    valores = {}
+    for linea in texto.splitlines():
+        if linea.startswith(nombre + "{"):
+            etiqueta, valor = linea.rsplit(" ", 1)
+            valores[etiqueta.split('resultado="')[1].split('"')[0]] = float(valor)
+    return valores
+
+def leer_metricas(urls):
+    base = {}
+    for url in urls:
+        texto = httpx.get(url.rsplit("/", 1)[0] + "/metrics", timeout=10).text
+        base[url] = {"cache": contadores(texto, "abrigo_cache_clima_total"),
+                     "open_meteo": contadores(texto, "abrigo_open_meteo_pedidos_total")}
+    return base
+
+def diferencia(antes, despues):
+    return {k: despues.get(k, 0) - antes.get(k, 0) for k in despues}
+
+async def mandar(urls, reparto, carga, concurrencia):
+    api = ClienteAPI(urls, reparto=reparto, max_concurrentes=concurrencia)
+    latencias, errores = [], 0
+    pendientes = iter(carga)
+
+    async def cliente():
+        nonlocal errores
+        for lat, lon, lead in pendientes:
+            inicio = time.perf_counter()
+            try:
+                r = await api.predecir(lat, lon, lead)
+                errores += r.status_code != 200
+            except httpx.HTTPError:
+                errores += 1
+            latencias.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    try:
+        await asyncio.gather(*[cliente() for _ in range(concurrencia)])
+    finally:
+        await api.cerrar()
+    duracion = time.perf_counter() - inicio
+    lat_ms = np.array(latencias) * 1000
+    return api.pedidos, {"pedidos": len(latencias), "errores": errores, "pedidos_por_s": len(latencias) / duracion,
+                         "p50_ms": float(np.percentile(lat_ms, 50)), "p99_ms": float(np.percentile(lat_ms, 99))}
+
+def medir(instancias, reparto, carga, concurrencia, puerto_api, puerto_stub, entorno):
+    # Procesos nuevos en cada medición: las caches arrancan vacías
+    procesos = [levantar_api(puerto_api + k, puerto_stub, entorno) for k in range(instancias)]
+    urls = [f"http://127.0.0.1:{puerto_api + k}/predecir" for k in range(instancias)]
+    try:
+        antes = leer_metricas(urls)
+        pedidos, total = asyncio.run(mandar(urls, reparto, carga, concurrencia))
+        despues = leer_metricas(urls)
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+            proceso.wait()
+
+    por_instancia = []
+    for url in urls:
+        cache = diferencia(antes[url]["cache"], despues[url]["cache"])
+        consultas = sum(cache.values())
+        por_instancia.append({"url": url, "pedidos": pedidos[url],
+                              "aciertos_cache": cache.get("acierto", 0) / consultas if consultas else None,
+                              "fallos_cache": int(cache.get("fallo", 0)),
+                              "open_meteo": int(sum(diferencia(antes[url]["open_meteo"], despues[url]["open_meteo"]).values()))})
+    consultas = sum(sum(diferencia(antes[u]["cache"], despues[u]["cache"]).values()) for u in urls)
+    aciertos = sum(diferencia(antes[u]["cache"], despues[u]["cache"]).get("acierto", 0) for u in urls)
+    total.update(instancias=instancias, reparto=reparto, aciertos_cache=aciertos / consultas if consultas else None,
+                 fallos_cache=sum(i["fallos_cache"] for i in por_instancia),
+                 open_meteo=sum(i["open_meteo"] for i in por_instancia))
+    return {"total": total, "por_instancia": por_instancia}
+
+def movimiento(claves, instancias, nodos_virtuales=100):
+    # Parte de las celdas que cambia de instancia al pasar de N a N+1 (lo ideal es 1/(N+1)), y qué tan
+    # desparejo queda el reparto (celdas de la instancia más cargada sobre el promedio)
+    urls = [f"http://api{k}/predecir" for k in range(instancias + 1)]
+    antes, despues = AnilloConsistente(urls[:-1], nodos_virtuales), AnilloConsistente(urls, nodos_virtuales)
+    claves = sorted(claves)
+    duenas = [antes.instancia(c) for c in claves]
+    por_instancia = np.unique(duenas, return_counts=True)[1]
+    hashes = [_hash(c) for c in claves]
+    return {
+        "instancias": instancias,
+        "ideal": 1 / (instancias + 1),
+        "anillo": float(np.mean([d != despues.instancia(c) for d, c in zip(duenas, claves)])),
+        "modulo": float(np.mean([h % instancias != h % (instancias + 1) for h in hashes])),
+        "desbalance": float(por_instancia.max() / por_instancia.mean()),
+    }
+
+def correr(instancias=(1, 2, 4), pedidos=3000, celdas=800, zipf=1.0, concurrencia=20, latencia_ms=50.0,
+           max_celdas=None, puerto_api=8000, puerto_stub=8081, semilla=0):
+    carga = armar_carga(pedidos, celdas, zipf, semilla)
+    entorno = {"CAPTURA_DIR": "", "RASTER_DIR": "", "CACHE_COMPARTIDA": ""}
+    if max_celdas:
+        entorno["CACHE_MAX_CELDAS"] = str(max_celdas)
+    resultados = {"pedidos": pedidos, "celdas": celdas, "celdas_pedidas": len({clave_celda(lat, lon) for lat, lon, _ in carga}),
+                  "mediciones": [], "movimiento": []}
+    stub = levantar_stub(puerto_stub, latencia_ms)
+    try:
+        for n in instancias:
+            for reparto in (["celda"] if n == 1 else ["turno", "celda"]):
+                resultados["mediciones"].append(medir(n, reparto, carga, concurrencia, puerto_api, puerto_stub, entorno))
+    finally:
+        stub.terminate()
+        stub.wait()
+    rnd = random.Random(semilla)
+    claves = {clave_celda(rnd.uniform(-55, -22), rnd.uniform(-73, -54)) for _ in range(20000)}
+    resultados["movimiento"] = [movimiento(claves, n) for n in (1, 2, 3, 4, 8)]
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache de clima con varias instancias de la API: turno contra celda")
+    parser.add_argument("--instancias", default="1,2,4", help="cantidades de instancias a medir, separadas por coma")
+    parser.add_argument("--pedidos", type=int, default=3000)
+    parser.add_argument("--celdas", type=int, default=800, help="celdas distintas de la carga")
+    parser.add_argument("--zipf", type=float, default=1.0, help="exponente de la popularidad de las celdas")
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--latencia-ms", type=float, default=50.0, help="latencia simulada de Open-Meteo")
+    parser.add_argument("--max-celdas", type=int, help="CACHE_MAX_CELDAS de cada instancia")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = correr([int(n) for n in args.instancias.split(",")], args.pedidos, args.celdas, args.zipf,
+                        args.concurrencia, args.latencia_ms, args.max_celdas)
+    print(f"{resultados['pedidos']} pedidos sobre {resultados['celdas_pedidas']} celdas")
+    for medicion in resultados["mediciones"]:
+        t = medicion["total"]
+        print(f"{t['instancias']} instancias, {t['reparto']}: {t['pedidos_por_s']:.1f} pedidos/s, p50 {t['p50_ms']:.1f} ms, "
+              f"aciertos {t['aciertos_cache']:.2f}, {t['fallos_cache']} fallos, {t['open_meteo']} pedidos a Open-Meteo, "
+              f"{t['errores']} errores")
+        for i in medicion["por_instancia"]:
+            aciertos = "-" if i["aciertos_cache"] is None else f"{i['aciertos_cache']:.2f}"
+            print(f"    {i['url']}: {i['pedidos']} pedidos, aciertos {aciertos}, {i['fallos_cache']} fallos, "
+                  f"{i['open_meteo']} a Open-Meteo")
+    for m in resultados["movimiento"]:
+        print(f"de {m['instancias']} a {m['instancias'] + 1} instancias se mudan: anillo {m['anillo']:.3f}, "
+              f"módulo {m['modulo']:.3f} (ideal {m['ideal']:.3f}); desbalance con {m['instancias']}: {m['desbalance']:.2f}")
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultados, f, indent=2)
@@ -0,0 +1,184 @@
+import os
+import glob
+import json
+import time
+import asyncio
+import argparse
+import httpx
+import numpy as np
+from correr import levantar
+
+# Vuelve a mandar a /predecir un log capturado con CAPTURA_DIR (ver api/captura.py), respetando el orden y los
+# tiempos entre pedidos a 1x, 10x, etc., o tan rápido como se pueda (--velocidad 0). Levanta la API contra el
+# stub de Open-Meteo, que sirve las respuestas grabadas en bench/respuestas (grabar.py), y reporta latencia
+# y tasa de aciertos de la cache de clima por ventana de tiempo
+
+# Métrica de /metrics con los resultados de la cache de clima
+METRICA_CACHE = "abrigo_cache_clima_total"
+
+
+def cargar(rutas):
+    # Registros de uno o más archivos (o directorios con captura_*.jsonl), ordenados por llegada
+    archivos = []
+    for ruta in rutas:
+        archivos += sorted(glob.glob(os.path.join(ruta, "captura_*.jsonl"))) if os.path.isdir(ruta) else [ruta]
+    registros = []
+    for archivo in archivos:
+        with open(archivo, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    registros.append(json.loads(linea))
+                except ValueError:
+                    # Última línea cortada si el proceso murió escribiendo
+                    continue
+    registros.sort(key=lambda r: r["t"])
+    return registros
+
+def describir(registros):
+    # Forma del tráfico capturado: lo que hace falta para dimensionar cache y lotes
+    t = np.array([r["t"] for r in registros])
+    por_segundo = np.bincount((t - t[0]).astype(int)) if len(t) else np.array([0])
+    leads = np.array([r["lead"] for r in registros])
+    celdas = {(round(r["lat"] / 0.05), round(r["lon"] / 0.05)) for r in registros}
+    return {
+        "pedidos": len(registros),
+        "duracion_s": float(t[-1] - t[0]) if len(t) else 0.0,
+        "celdas_distintas": len(celdas),
+        "pico_por_s": int(por_segundo.max()),
+        "media_por_s": float(por_segundo.mean()),
+        "lead_0": float(np.mean(leads == 0)) if len(leads) else 0.0,
+        "lead_p50": float(np.median(leads)) if len(leads) else 0.0,
+    }
+
+async def consultas_cache(http):
+    r = await http.get("/metrics")
+    valores = {}
+    for linea in r.text.splitlines():
+        if linea.startswith(METRICA_CACHE + "{"):
+            etiqueta, valor = linea.rsplit(" ", 1)
+            valores[etiqueta.split('resultado="')[1].split('"')[0]] = float(valor)
+    return valores
+
+def resumir_ventana(latencias, codigos, antes, despues):
+    lat_ms = np.array(latencias or [np.nan]) * 1000
+    consultas = {k: despues.get(k, 0) - antes.get(k, 0) for k in despues}
+    total = sum(consultas.values())
+    return {
+        "pedidos": len(latencias),
+        "errores": sum(1 for c in codigos if c != 200),
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "aciertos_cache": consultas.get("acierto", 0) / total if total else None,
+        "vencidos_cache": consultas.get("vencido", 0) / total if total else None,
+    }
+
+async def reproducir(url, registros, velocidad=1.0, concurrencia=50, ventana=5.0):
+    hechos = []  # (momento de fin, latencia, código)
+    limites = httpx.Limits(max_connections=max(concurrencia, 100))
+
+    async def mandar(http, registro):
+        inicio = time.perf_counter()
+        try:
+            r = await http.post("/predecir", json={"lat": registro["lat"], "lon": registro["lon"],
+                                                   "lead": registro["lead"]})
+            codigo = r.status_code
+        except httpx.HTTPError:
+            codigo = 0
+        hechos.append((time.perf_counter(), time.perf_counter() - inicio, codigo))
+
+    # /metrics va por otro cliente para no esperar detrás de los pedidos en el pool de conexiones
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limites) as http, \
+            httpx.AsyncClient(base_url=url, timeout=60) as http_metricas:
+        curva, fin = [], asyncio.Event()
+
+        async def muestrear():
+            # Una muestra de /metrics por ventana: la diferencia entre dos muestras es la tasa de aciertos de esa ventana
+            anterior, desde, k = await consultas_cache(http_metricas), time.perf_counter(), 0
+            while True:
+                try:
+                    await asyncio.wait_for(fin.wait(), ventana)
+                except asyncio.TimeoutError:
+                    pass
+                actual, hasta = await consultas_cache(http_metricas), time.perf_counter()
+                en_ventana = [h for h in hechos[k:] if h[0] <= hasta]
+                k += len(en_ventana)
+                curva.append(dict(resumir_ventana([h[1] for h in en_ventana], [h[2] for h in en_ventana], anterior, actual),
+                                  desde_s=desde - inicio))
+                anterior, desde = actual, hasta
+                if fin.is_set():
+                    return
+
+        inicio = time.perf_counter()
+        muestreo = asyncio.create_task(muestrear())
+        if velocidad > 0:
+            # Lazo abierto: cada pedido sale a su hora aunque los anteriores no hayan terminado
+            t0, tareas = registros[0]["t"], []
+            for registro in registros:
+                espera = inicio + (registro["t"] - t0) / velocidad - time.perf_counter()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+                tareas.append(asyncio.create_task(mandar(http, registro)))
+            await asyncio.gather(*tareas)
+        else:
+            pendientes = iter(registros)
+
+            async def cliente():
+                for registro in pendientes:
+                    await mandar(http, registro)
+
+            await asyncio.gather(*[cliente() for _ in range(concurrencia)])
+        duracion = time.perf_counter() - inicio
+        fin.set()
+        await muestreo
+
+    total = resumir_ventana([h[1] for h in hechos], [h[2] for h in hechos], {}, {})
+    total.pop("aciertos_cache")
+    total.pop("vencidos_cache")
+    total.update(duracion_s=duracion, pedidos_por_s=len(hechos) / duracion)
+    return total, curva
+
+def correr(rutas, velocidad=1.0, concurrencia=50, ventana=5.0, url=None, puerto_api=8000, puerto_stub=8081,
+           latencia_ms=50.0):
+    registros = cargar(rutas)
+    if not registros:
+        raise SystemExit("El log no tiene registros")
+    procesos = []
+    if url is None:
+        # Sin captura (no se vuelve a grabar lo que se reproduce), sin raster y sin cache compartida entre corridas
+        procesos = levantar(puerto_api, puerto_stub, latencia_ms,
+                            {"CAPTURA_DIR": "", "RASTER_DIR": "", "CACHE_COMPARTIDA": ""})
+        url = f"http://127.0.0.1:{puerto_api}"
+    try:
+        total, curva = asyncio.run(reproducir(url, registros, velocidad, concurrencia, ventana))
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+            proceso.wait()
+    return {"trafico": describir(registros), "velocidad": velocidad or "max", "total": total, "curva": curva}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduce un log de captura contra la API")
+    parser.add_argument("logs", nargs="+", help="archivos captura_*.jsonl o directorios que los contienen")
+    parser.add_argument("--velocidad", type=float, default=1.0, help="1 = tiempo real, 10 = diez veces más rápido, "
+                                                                     "0 = lo más rápido posible")
+    parser.add_argument("--concurrencia", type=int, default=50, help="clientes con --velocidad 0")
+    parser.add_argument("--ventana", type=float, default=5.0, help="segundos por punto de la curva")
+    parser.add_argument("--url", help="API ya levantada (si no, se levanta una contra el stub)")
+    parser.add_argument("--latencia-ms", type=float, default=50.0, help="latencia simulada de Open-Meteo")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultado = correr(args.logs, args.velocidad, args.concurrencia, args.ventana, args.url,
+                       latencia_ms=args.latencia_ms)
+    print(f"tráfico: {resultado['trafico']}")
+    print(f"total: {resultado['total']}")
+    print(f"{'desde_s':>8} {'pedidos':>8} {'errores':>8} {'p50_ms':>8} {'p99_ms':>8} {'aciertos':>9} {'vencidos':>9}")
+    for punto in resultado["curva"]:
+        aciertos = "-" if punto["aciertos_cache"] is None else f"{punto['aciertos_cache']:.2f}"
+        vencidos = "-" if punto["vencidos_cache"] is None else f"{punto['vencidos_cache']:.2f}"
+        print(f"{punto['desde_s']:8.1f} {punto['pedidos']:8d} {punto['errores']:8d} {punto['p50_ms']:8.1f} "
+              f"{punto['p99_ms']:8.1f} {aciertos:>9} {vencidos:>9}")
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump(resultado, f, indent=2)
@@ -0,0 +1,164 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import numpy as np
+import flatbuffers
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+# Servidor local que imita /v1/forecast de Open-Meteo devolviendo respuestas FlatBuffers grabadas con grabar.py.
+# Los valores se corren de fecha a la ventana pedida (respetando la hora del día), así que sirve para cualquier fecha.
+# Sin grabaciones, genera datos sintéticos con ciclo diario.
+
+DIRECTORIO_GRABACIONES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "respuestas")
+
+# Valores base y amplitud del ciclo diario para los datos sintéticos
+SINTETICOS = {
+    "temperature_2m": (16, 7), "apparent_temperature": (15, 8), "dew_point_2m": (9, 2),
+    "wet_bulb_temperature_2m": (12, 4), "relative_humidity_2m": (65, -20), "wind_speed_10m": (4, 2),
+    "pressure_msl": (1013, 2), "surface_pressure": (1010, 2), "cloud_cover": (40, 20),
+    "is_day": (0.5, 0.5), "shortwave_radiation": (250, 250), "uv_index": (3, 3),
+}
+
+
+class Grabacion:
+
+    def __init__(self, lat, lon, elevacion, utc_offset, variables):
+        self.lat = lat
+        self.lon = lon
+        self.elevacion = elevacion
+        self.utc_offset = utc_offset
+        self.variables = variables  # {nombre: array que arranca a las 00 hs locales}
+
+
+def cargar_grabaciones(directorio=DIRECTORIO_GRABACIONES):
+    grabaciones = []
+    if not os.path.isdir(directorio):
+        return grabaciones
+    for nombre in sorted(os.listdir(directorio)):
+        if not nombre.endswith(".json"):
+            continue
+        with open(os.path.join(directorio, nombre)) as f:
+            meta = json.load(f)
+        with open(os.path.join(directorio, nombre[:-5] + ".bin"), "rb") as f:
+            data = f.read()
+        response = WeatherApiResponse.GetRootAs(data, 4)
+        hourly = response.Hourly()
+        variables = {var: np.array(hourly.Variables(i).ValuesAsNumpy(), dtype=np.float32)
+                     for i, var in enumerate(meta["hourly"])}
+        grabaciones.append(Grabacion(meta["latitude"], meta["longitude"], response.Elevation(),
+                                     response.UtcOffsetSeconds(), variables))
+    return grabaciones
+
+def sintetica(lat, lon):
+    return Grabacion(lat, lon, 25.0, -3 * 3600, {})
+
+def valores(grabacion, variable, n_horas):
+    if variable in grabacion.variables:
+        grabados = grabacion.variables[variable]
+        return np.resize(grabados, n_horas).astype(np.float32)
+    base, amplitud = SINTETICOS.get(variable, (random.Random(variable).uniform(0, 10), 0))
+    horas = np.arange(n_horas) % 24
+    return (base + amplitud * np.sin(2 * np.pi * (horas - 9) / 24)).astype(np.float32)
+
+def codificar(lat, lon, grabacion, inicio, fin, variables):
+    # Arma un WeatherApiResponse con la parte horaria (mismos campos que lee weather.py), precedido por su largo
+    n_horas = (fin - inicio) // 3600
+    b = flatbuffers.Builder(1024 + n_horas * len(variables) * 4)
+    offsets = []
+    for i, variable in enumerate(variables):
+        vector = b.CreateNumpyVector(valores(grabacion, variable, n_horas))
+        b.StartObject(4)
+        b.PrependUOffsetTRelativeSlot(3, vector, 0)
+        offsets.append(b.EndObject())
+    b.StartVector(4, len(offsets), 4)
+    for o in reversed(offsets):
+        b.PrependUOffsetTRelative(o)
+    vector_variables = b.EndVector()
+
+    b.StartObject(4)
+    b.PrependInt64Slot(0, inicio, 0)
+    b.PrependInt64Slot(1, fin, 0)
+    b.PrependInt32Slot(2, 3600, 0)
+    b.PrependUOffsetTRelativeSlot(3, vector_variables, 0)
+    hourly = b.EndObject()
+
+    b.StartObject(16)
+    b.PrependFloat32Slot(0, lat, 0)
+    b.PrependFloat32Slot(1, lon, 0)
+    b.PrependFloat32Slot(2, grabacion.elevacion, 0)
+    b.PrependInt32Slot(6, grabacion.utc_offset, 0)
+    b.PrependUOffsetTRelativeSlot(11, hourly, 0)
+    b.Finish(b.EndObject())
+    mensaje = bytes(b.Output())
+    return len(mensaje).to_bytes(4, "little") + mensaje
+
+def _lista(query, clave):
+    return [v for valor in query.get(clave, []) for v in valor.split(",") if v]
+
+def _epoch(fecha, utc_offset, dias=0):
+    dia = datetime.strptime(fecha, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int(dia.timestamp()) + dias * 86400 - utc_offset
+
+
+class Stub(BaseHTTPRequestHandler):
+    grabaciones = []
+    latencia = 0.0
+    prob_falla = 0.0
+
+    def do_GET(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.prob_falla and random.random() < self.prob_falla:
+            self.send_error(503)
+            return
+
+        query = parse_qs(urlparse(self.path).query)
+        lats = [float(v) for v in _lista(query, "latitude")]
+        lons = [float(v) for v in _lista(query, "longitude")]
+        variables = _lista(query, "hourly")
+        hoy = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        start_date = query.get("start_date", [hoy])[0]
+        end_date = query.get("end_date", [hoy])[0]
+
+        data = b""
+        for lat, lon in zip(lats, lons):
+            grabacion = min(self.grabaciones, key=lambda g: (g.lat - lat) ** 2 + (g.lon - lon) ** 2,
+                            default=None) or sintetica(lat, lon)
+            inicio = _epoch(start_date, grabacion.utc_offset)
+            fin = _epoch(end_date, grabacion.utc_offset, dias=1)
+            data += codificar(lat, lon, grabacion, inicio, fin, variables)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def servir(puerto=8081, directorio=DIRECTORIO_GRABACIONES, latencia_ms=0.0, prob_falla=0.0):
+    Stub.grabaciones = cargar_grabaciones(directorio)
+    Stub.latencia = latencia_ms / 1000
+    Stub.prob_falla = prob_falla
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), Stub)
+    print(f"Stub de Open-Meteo en http://127.0.0.1:{puerto}/v1/forecast "
+          f"({len(Stub.grabaciones) or 'sin'} grabaciones)", file=sys.stderr)
+    servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub local de Open-Meteo")
+    parser.add_argument("--puerto", type=int, default=8081)
+    parser.add_argument("--grabaciones", default=DIRECTORIO_GRABACIONES)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="demora artificial por pedido")
+    parser.add_argument("--prob-falla", type=float, default=0.0, help="proporción de pedidos que devuelven 503")
+    args = parser.parse_args()
+    servir(args.puerto, args.grabaciones, args.latencia_ms, args.prob_falla)
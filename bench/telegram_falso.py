@@ -0,0 +1,132 @@
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Servidor local que imita la Bot API de Telegram (lo mínimo que usa bot.py) y la API de predicción.
+# El bot se apunta acá con BOT_TELEGRAM_URL y API_URL; los mensajes que manda quedan registrados por chat.
+# Sirve para polling (getUpdates) y para webhook (carga_bot.py postea los updates directo al bot).
+
+RECOMENDACION = {
+    "prob_1st": 0.72, "class_1st": "buzo", "prob_2nd": 0.18, "class_2nd": "campera",
+    "temperature": 14.2, "humidity": 63.0, "apparent_temperature": 12.9, "weather_wind_speed_10m": 3.1,
+    "hour_integer": 15, "minute": 10, "hour_geo": 12, "alt": 25.0, "precipitation_prob": 0.1, "precipitation": 0.0,
+}
+
+
+class Estado:
+
+    def __init__(self, latencia_api=0.0):
+        self.latencia_api = latencia_api
+        self.enviados = {}          # chat_id -> [(momento, texto)]
+        self.updates = []           # para getUpdates
+        self.pedidos_api = 0
+        self.ubicaciones_api = 0
+        self.metodos = set()        # métodos de la Bot API que llamó el bot
+        self._id_mensaje = 0
+        self._cond = threading.Condition()
+
+    def registrar(self, chat_id, texto):
+        with self._cond:
+            self._id_mensaje += 1
+            self.enviados.setdefault(chat_id, []).append((time.perf_counter(), texto))
+            return self._id_mensaje
+
+    def encolar(self, update):
+        with self._cond:
+            self.updates.append(update)
+            self._cond.notify_all()
+
+    def pendientes(self, offset, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: any(u["update_id"] >= offset for u in self.updates), timeout)
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            return list(self.updates)
+
+
+def mensaje(id_mensaje, chat_id, texto):
+    return {"message_id": id_mensaje, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+            "text": texto}
+
+def crear_handler(estado):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _parametros(self):
+            largo = int(self.headers.get("Content-Length", 0))
+            cuerpo = self.rfile.read(largo).decode() if largo else ""
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                return json.loads(cuerpo or "{}")
+            valores = {k: v[0] for k, v in parse_qs(cuerpo).items()}
+            valores.update({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+            return valores
+
+        def _responder(self, contenido):
+            datos = json.dumps(contenido).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_POST(self):
+            ruta = urlparse(self.path).path
+            parametros = self._parametros()
+            if ruta == "/predecir":
+                estado.pedidos_api += 1
+                time.sleep(estado.latencia_api)
+                self._responder(RECOMENDACION)
+                return
+            if ruta == "/predecir_lote":
+                estado.pedidos_api += 1
+                estado.ubicaciones_api += len(parametros["ubicaciones"])
+                time.sleep(estado.latencia_api)
+                self._responder({"resultados": [RECOMENDACION] * len(parametros["ubicaciones"])})
+                return
+
+            metodo = ruta.rsplit("/", 1)[-1]
+            estado.metodos.add(metodo)
+            if metodo == "getMe":
+                resultado = {"id": 1, "is_bot": True, "first_name": "Abrigo", "username": "abrigo_falso_bot",
+                             "can_join_groups": False, "can_read_all_group_messages": False,
+                             "supports_inline_queries": False}
+            elif metodo in ("sendMessage", "sendVideo", "editMessageText"):
+                chat_id = int(parametros.get("chat_id", 0))
+                texto = parametros.get("text") or parametros.get("caption") or ""
+                resultado = mensaje(estado.registrar(chat_id, texto), chat_id, texto)
+            elif metodo == "getUpdates":
+                offset = int(parametros.get("offset") or 0)
+                resultado = estado.pendientes(offset, float(parametros.get("timeout") or 0))
+            else:
+                # setWebhook, deleteWebhook, answerCallbackQuery, ...
+                resultado = True
+            self._responder({"ok": True, "result": resultado})
+
+        do_GET = do_POST
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def servir(puerto=8082, latencia_api=0.0):
+    # Arranca el servidor en un hilo y devuelve su estado
+    estado = Estado(latencia_api)
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), crear_handler(estado))
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return estado, servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Telegram y API de predicción falsos")
+    parser.add_argument("--puerto", type=int, default=8082)
+    parser.add_argument("--latencia-api-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    _, servidor = servir(args.puerto, args.latencia_api_ms / 1000)
+    print(f"Telegram falso en http://127.0.0.1:{args.puerto} (API_URL=http://127.0.0.1:{args.puerto}/predecir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -1,7 +1,13 @@
-import requests
 import os
 import logging
+import httpx
+from urllib.parse import urlparse
 import utils as ut
+import cliente_api as ca
+from cache_recomendaciones import recomendaciones
+from procesador_updates import ProcesadorPorChat
+from suscripciones import suscripciones, envios, programar
+from localidades import localidades
 from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton
 from telegram.error import Conflict
 from telegram.ext import (
@@ -11,14 +17,25 @@ from telegram.ext import (
     ContextTypes,
     filters,
     ConversationHandler,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    PicklePersistence,
+    PersistenceInput
 )
 
 # Estados de la conversación
-ASK_HOURS, ASK_COORDINATES, ASK_RAIN, RESPOND_RAIN, HANDLE_LOCATION = range(5)
+ASK_HOURS, ASK_COORDINATES, ASK_RAIN, RESPOND_RAIN, HANDLE_LOCATION, ASK_SUBSCRIPTION_HOUR, ASK_SUBSCRIPTION_COORDINATES = range(7)
 
 TOKEN = os.environ["TOKEN"]
-API_URL = os.environ.get("API_URL")
+# Archivo donde PTB guarda bot_data (la cache de recomendaciones) entre reinicios. Vacío: sin persistencia
+BOT_PERSISTENCIA = os.environ.get("BOT_PERSISTENCIA", "")
+# Updates procesados a la vez (los de un mismo chat siempre en orden)
+BOT_CONCURRENCIA = int(os.environ.get("BOT_CONCURRENCIA", 32))
+# URL pública del webhook (ej: https://mi-bot.herokuapp.com/webhook). Vacío: polling
+BOT_WEBHOOK_URL = os.environ.get("BOT_WEBHOOK_URL", "")
+BOT_WEBHOOK_SECRETO = os.environ.get("BOT_WEBHOOK_SECRETO", "")
+PORT = int(os.environ.get("PORT", 8443))
+# Servidor de la Bot API (para probar contra un Telegram falso local, ver bench/telegram_falso.py)
+BOT_TELEGRAM_URL = os.environ.get("BOT_TELEGRAM_URL", "")
 VIDEO_HELP_ID = "BAACAgEAAxkBAAIDlWg-WReZDKCtaoSzifGdWYoMjiKxAALNBQACtDn4RZHLQHkH-6GqNgQ" 
 
 # Configuración básica del logging
@@ -28,6 +45,8 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+# El JobQueue de las suscripciones loguea cada ejecución
+logging.getLogger("apscheduler").setLevel(logging.WARNING)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     welcome_text = (
@@ -38,6 +57,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/abrigo_3h - Recomendación para dentro de 3 horas\n"
         "/abrigo_4h - Recomendación para dentro de 4 horas\n"
         "/abrigo_nhs - Recomendación para N horas adelante (hasta 48hs)\n"
+        "/suscribir - Recibir la recomendación todos los días a la hora que elijas\n"
+        "/desuscribir - Dejar de recibir la recomendación diaria\n"
         "/help - Guía de uso del bot\n\n"
         "¡Enviá /abrigo para comenzar!"
     )
@@ -54,9 +75,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
    /abrigo\_4h \- Para dentro de 4 horas
    /abrigo\_nhs \- Para N horas adelante \(hasta 48\)
 
-2\. Enviá coordenadas en formato `latitud,longitud`
+2\. Enviá coordenadas en formato `latitud,longitud` o el nombre de tu localidad
 3\. Recibirás recomendaciones de abrigo
 4\. Podés consultar la probabilidad de lluvia
+5\. Con /suscribir recibís la recomendación todos los días a la hora que elijas
 
 *Ejemplo válido:* `\-34\.58543,\-58\.42567`
 
@@ -108,7 +130,7 @@ async def handle_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def ask_for_coordinates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
-        "Por favor, enviá la latitud y longitud de tu ubicación (ej: -34.58,-58.42). \n\n"
+        "Por favor, enviá la latitud y longitud de tu ubicación (ej: -34.58,-58.42) o el nombre de tu localidad (ej: Rosario). \n\n"
         "También podés usar /share_location para compartir directamente tu ubicación."
     )
     return ASK_COORDINATES
@@ -130,43 +152,40 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lon = update.message.location.longitude
     return await process_coordinates(update, context, lat, lon)
 
+def parse_coordinates(text):
+    # Devuelve (lat, lon) a partir de "lat,lon" o del nombre de una localidad; None si no se entiende
+    text = text.strip()
+
+    cleaned_text = text.replace("(", "").replace(")", "").replace(" ", "")
+    parts = cleaned_text.split(",")
+
+    if (len(parts) == 2 and
+        all(part.replace(".", "").lstrip("-").isdigit() for part in parts) and
+        cleaned_text.count(".") <= 2):
+        lat, lon = map(float, parts)
+        return lat, lon
+
+    localidad = localidades.resolver(text)
+    if localidad is None:
+        return None
+    return localidad.lat, localidad.lon
+
+def coordinates_error(text):
+    # Mensaje para un texto que no es ni coordenadas ni una localidad conocida, con sugerencias si las hay
+    sugerencias = localidades.sugerencias(text)
+    if sugerencias:
+        opciones = "\n".join(f"• {localidad.etiqueta()}" for localidad in sugerencias)
+        return f"🤔 No encontré \"{text.strip()}\". ¿Quisiste decir alguna de estas?\n{opciones}\n\nEscribí el nombre completo o mandá lat,lon (ej: -34.58,-58.42)"
+    return "⚠️ Formato incorrecto. Usá: lat,lon o el nombre de tu localidad \nEjemplo: -34.58,-58.42 o Rosario"
+
 async def handle_coordinates(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        text = update.message.text.strip()
-        
-        location_shortcuts = {
-            'cordoba': (-31.4580911, -64.2199552),
-            'córdoba': (-31.4580911, -64.2199552),
-            'cba': (-31.4580911, -64.2199552),
-            'casa': (-34.5821438, -58.4303663),
-            'baires': (-34.5821438, -58.4303663),
-            'caba': (-34.5821438, -58.4303663),
-            'buenos aires': (-34.5821438, -58.4303663),
-            'bs as': (-34.5821438, -58.4303663),
-            'capital federal': (-34.5821438, -58.4303663),
-        }
-        
-        lower_text = text.lower().replace(" ", "")
-        normalized_text = lower_text.replace("á", "a").replace("é", "e").replace("í", "i").replace("ó", "o").replace("ú", "u")
-        
-        lat, lon = None, None
-        for shortcut, coords in location_shortcuts.items():
-            if normalized_text == shortcut.lower().replace(" ", ""):
-                lat, lon = coords
-                break
-        
-        if lat is None or lon is None:
-            cleaned_text = text.replace("(", "").replace(")", "").replace(" ", "")
-            parts = cleaned_text.split(",")
-            
-            if (len(parts) != 2 or 
-                not all(part.replace(".", "").lstrip("-").isdigit() for part in parts) or 
-                cleaned_text.count(".") > 2):
-                await update.message.reply_text("⚠️ Formato incorrecto. Usá: lat,lon \nEjemplo: -34.58,-58.42")
-                return ASK_COORDINATES
-                
-            lat, lon = map(float, parts)
-        
+        coords = parse_coordinates(update.message.text)
+        if coords is None:
+            await update.message.reply_text(coordinates_error(update.message.text))
+            return ASK_COORDINATES
+
+        lat, lon = coords
         return await process_coordinates(update, context, lat, lon)
             
     except Exception as e:
@@ -178,63 +197,81 @@ async def handle_coordinates(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def process_coordinates(update: Update, context: ContextTypes.DEFAULT_TYPE, lat: float, lon: float):
     try:
         hours_ahead = context.user_data.get('hours_ahead', 0)
-        payload = {"lat": lat, "lon": lon, 'lead': hours_ahead}
         
         logger.info(f"Coordenadas recibidas: lat={lat}, lon={lon}, hours_ahead={hours_ahead}")
 
-        r = requests.post(API_URL, json=payload)
-        if r.status_code == 200:
+        # Si el usuario ya consultó esta ubicación y hora hace poco, se responde sin ir a la API
+        data = recomendaciones.obtener(lat, lon, hours_ahead)
+        if data is None:
+            try:
+                r = await ca.cliente.predecir(lat, lon, hours_ahead)
+            except httpx.TimeoutException:
+                logger.warning(f"Timeout consultando la API: lat={lat}, lon={lon}, hours_ahead={hours_ahead}")
+                await update.message.reply_text("⏳ La predicción está tardando demasiado. Probá de nuevo en unos minutos con /abrigo")
+                return ConversationHandler.END
+
+            if r.status_code == 503:
+                await update.message.reply_text("🌧️ El servicio del pronóstico no está respondiendo. Probá de nuevo en unos minutos con /abrigo")
+                return ConversationHandler.END
+
+            if r.status_code != 200:
+                await update.message.reply_text("⚠️ Error al consultar la predicción.")
+                return ConversationHandler.END
+
             data = r.json()
-            
-            logger.info(f"Respuesta de la API: {data}")
-
-            class_1st = data["class_1st"]
-            prob_1st = round(data["prob_1st"] * 100)
-            class_2nd = data["class_2nd"]
-            prob_2nd = round(data["prob_2nd"] * 100)
-            temperature = data['temperature']
-            humidity = data['humidity']
-            wind = data['weather_wind_speed_10m'] * 3.6
-            apparent_temperature = data['apparent_temperature']
-            emoji = ut.temperatura_emoji(apparent_temperature)
-            abrigo_1 = ut.abrigo_emoji(class_1st)
-            abrigo_2 = ut.abrigo_emoji(class_2nd)
-            hour_geo = data["hour_geo"]
-            verbo = 'será' if (data['minute'] >= 30 or hours_ahead > 0) else 'es'
-            precipitation_prob = round(data['precipitation_prob'] * 100, 1)
-            context.user_data['precipitation_prob'] = precipitation_prob
-            precipitation = data['precipitation']
-            context.user_data['precipitation'] = precipitation
-
-            time_prefix = ""
-            if hours_ahead > 0:
-                time_prefix = f"dentro de {hours_ahead} horas, "
-            
-            msg = (
-                f"📍 En tu ubicación, {time_prefix}a las {hour_geo} hs, la temperatura {verbo} de {temperature:.1f}° con una humedad de {humidity:.0f}% y viento a {wind:.1f} km/h, "
-                f"provocando una *sensación térmica de {apparent_temperature:.1f}°* {emoji}\n\n"
-                f"Te recomiendo usar: {abrigo_1} {class_1st} ({prob_1st}% prob)"
-            )
-            
-            if data["prob_1st"] <= 0.6 and (data["prob_2nd"] > 0.25 or (data["prob_1st"] - data["prob_2nd"] < 0.10)):
-                msg += f"\nSi no, podrías usar: {abrigo_2} {class_2nd} ({prob_2nd}% prob)"
-            
-            await update.message.reply_text(msg, parse_mode="Markdown")
-            
-            reply_keyboard = [
-                [InlineKeyboardButton("Sí", callback_data="rain_yes"),
-                InlineKeyboardButton("No", callback_data="rain_no"),]
-                ]
-            
-            await update.message.reply_text(
-                                "¿Querés saber si va a llover?",
-                                reply_markup=InlineKeyboardMarkup(reply_keyboard)
-                            )
-            return ASK_RAIN
-            
-        else:
-            await update.message.reply_text("⚠️ Error al consultar la predicción.")
-            return ConversationHandler.END
+            recomendaciones.guardar(lat, lon, hours_ahead, data)
+
+        logger.info(f"Respuesta de la API: {data}")
+
+        class_1st = data["class_1st"]
+        prob_1st = round(data["prob_1st"] * 100)
+        class_2nd = data["class_2nd"]
+        prob_2nd = round(data["prob_2nd"] * 100)
+        temperature = data['temperature']
+        humidity = data['humidity']
+        wind = data['weather_wind_speed_10m'] * 3.6
+        apparent_temperature = data['apparent_temperature']
+        emoji = ut.temperatura_emoji(apparent_temperature)
+        abrigo_1 = ut.abrigo_emoji(class_1st)
+        abrigo_2 = ut.abrigo_emoji(class_2nd)
+        hour_geo = data["hour_geo"]
+        verbo = 'será' if (data['minute'] >= 30 or hours_ahead > 0) else 'es'
+        precipitation_prob = round(data['precipitation_prob'] * 100, 1)
+        context.user_data['precipitation_prob'] = precipitation_prob
+        precipitation = data['precipitation']
+        context.user_data['precipitation'] = precipitation
+
+        time_prefix = ""
+        if hours_ahead > 0:
+            time_prefix = f"dentro de {hours_ahead} horas, "
+
+        lugar = localidades.etiqueta(lat, lon)
+        ubicacion = f"tu ubicación (cerca de {lugar})" if lugar else "tu ubicación"
+        
+        msg = (
+            f"📍 En {ubicacion}, {time_prefix}a las {hour_geo} hs, la temperatura {verbo} de {temperature:.1f}° con una humedad de {humidity:.0f}% y viento a {wind:.1f} km/h, "
+            f"provocando una *sensación térmica de {apparent_temperature:.1f}°* {emoji}\n\n"
+            f"Te recomiendo usar: {abrigo_1} {class_1st} ({prob_1st}% prob)"
+        )
+        
+        if data["prob_1st"] <= 0.6 and (data["prob_2nd"] > 0.25 or (data["prob_1st"] - data["prob_2nd"] < 0.10)):
+            msg += f"\nSi no, podrías usar: {abrigo_2} {class_2nd} ({prob_2nd}% prob)"
+
+        if data.get("vencido"):
+            msg += "\n\n⚠️ El servicio del pronóstico no está respondiendo, así que uso el último pronóstico disponible"
+        
+        await update.message.reply_text(msg, parse_mode="Markdown")
+        
+        reply_keyboard = [
+            [InlineKeyboardButton("Sí", callback_data="rain_yes"),
+            InlineKeyboardButton("No", callback_data="rain_no"),]
+            ]
+        
+        await update.message.reply_text(
+                            "¿Querés saber si va a llover?",
+                            reply_markup=InlineKeyboardMarkup(reply_keyboard)
+                        )
+        return ASK_RAIN
             
     except Exception as e:
         logger.error("Error en process_coordinates", exc_info=True)
@@ -312,9 +349,95 @@ async def abrigo_4h(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def abrigo_nhs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return await ask_for_hours(update, context)
 
+async def suscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not suscripciones.durable:
+        # Sin DATABASE_URL la suscripción se perdería con el próximo reinicio del dyno
+        logger.warning("/suscribir sin DATABASE_URL: no se registran suscripciones")
+        await update.message.reply_text("⚠️ Las recomendaciones diarias no están disponibles en este momento")
+        return ConversationHandler.END
+    await update.message.reply_text("¿A qué hora querés recibir la recomendación todos los días? Enviá un número entre 0 y 23 (hora de Argentina)")
+    return ASK_SUBSCRIPTION_HOUR
+
+async def handle_subscription_hour(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        hora = int(update.message.text.strip())
+        if hora < 0 or hora > 23:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text("⚠️ Por favor ingresá un número entero entre 0 y 23")
+        return ASK_SUBSCRIPTION_HOUR
+
+    context.user_data['subscription_hour'] = hora
+    await update.message.reply_text(
+        "Enviá la latitud y longitud del lugar para el que querés la recomendación (ej: -34.58,-58.42), "
+        "el nombre de la localidad "
+        "o compartí tu ubicación con el clip 📎"
+    )
+    return ASK_SUBSCRIPTION_COORDINATES
+
+async def handle_subscription_coordinates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    coords = parse_coordinates(update.message.text)
+    if coords is None:
+        await update.message.reply_text(coordinates_error(update.message.text))
+        return ASK_SUBSCRIPTION_COORDINATES
+    return await save_subscription(update, context, *coords)
+
+async def handle_subscription_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    return await save_subscription(update, context, update.message.location.latitude, update.message.location.longitude)
+
+async def save_subscription(update: Update, context: ContextTypes.DEFAULT_TYPE, lat: float, lon: float):
+    hora = context.user_data.pop('subscription_hour', 8)
+    try:
+        await suscripciones.agregar(update.effective_chat.id, lat, lon, hora)
+    except Exception as e:
+        logger.error(f"No se pudo guardar la suscripción de {update.effective_chat.id}: {e}", exc_info=True)
+        await update.message.reply_text("⚠️ No pude guardar la suscripción, probá de nuevo en un rato con /suscribir")
+        return ConversationHandler.END
+    logger.info(f"Suscripción: chat={update.effective_chat.id}, lat={lat}, lon={lon}, hora={hora} ({len(suscripciones)} suscriptos)")
+    lugar = localidades.etiqueta(lat, lon)
+    para = f" para {lugar}" if lugar else ""
+    await update.message.reply_text(f"✅ Listo, todos los días a las {hora} hs te mando la recomendación de abrigo{para}. Para cancelarla usá /desuscribir")
+    return ConversationHandler.END
+
+async def desuscribir(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        quitada = await suscripciones.quitar(update.effective_chat.id)
+    except Exception as e:
+        logger.error(f"No se pudo quitar la suscripción de {update.effective_chat.id}: {e}", exc_info=True)
+        await update.message.reply_text("⚠️ No pude cancelar la suscripción, probá de nuevo en un rato con /desuscribir")
+        return
+    if quitada:
+        await update.message.reply_text("Listo, ya no vas a recibir la recomendación diaria")
+    else:
+        await update.message.reply_text("No tenías una recomendación diaria. Podés activarla con /suscribir")
+
+async def post_init(application):
+    await ca.iniciar(application)
+    recomendaciones.vincular(application.bot_data)
+    await suscripciones.iniciar(application.bot_data)
+    envios.iniciar(application.bot)
+
+async def post_shutdown(application):
+    await envios.detener()
+    await ca.cerrar(application)
+
 def main():
     logger.info("Inicializando el bot...")
-    app = ApplicationBuilder().token(TOKEN).build()
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(ProcesadorPorChat(BOT_CONCURRENCIA))
+    )
+    if BOT_TELEGRAM_URL:
+        builder.base_url(f"{BOT_TELEGRAM_URL}/bot").base_file_url(f"{BOT_TELEGRAM_URL}/file/bot")
+    if BOT_PERSISTENCIA:
+        # Sólo bot_data: ahí está la cache de recomendaciones (el cliente HTTP no se guarda ahí). Las
+        # suscripciones van a DATABASE_URL: el disco del dyno no sobrevive a un reinicio
+        builder.persistence(PicklePersistence(BOT_PERSISTENCIA, store_data=PersistenceInput(
+            bot_data=True, chat_data=False, user_data=False, callback_data=False)))
+    app = builder.build()
     
     # Handler para abrigo_nhs
     nhs_conversation_handler = ConversationHandler(
@@ -352,14 +475,42 @@ def main():
         allow_reentry=True
     )
     
+    # Handler para la recomendación diaria
+    subscription_conversation_handler = ConversationHandler(
+        entry_points=[CommandHandler("suscribir", suscribir)],
+        states={
+            ASK_SUBSCRIPTION_HOUR: [MessageHandler(filters.TEXT & ~filters.COMMAND, handle_subscription_hour)],
+            ASK_SUBSCRIPTION_COORDINATES: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_subscription_coordinates),
+                MessageHandler(filters.LOCATION, handle_subscription_location)
+            ],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)],
+        allow_reentry=True
+    )
+
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CommandHandler("share_location", share_location))
     app.add_handler(nhs_conversation_handler)
     app.add_handler(abrigo_conversation_handler)
+    app.add_handler(subscription_conversation_handler)
+    app.add_handler(CommandHandler("desuscribir", desuscribir))
     app.add_handler(CallbackQueryHandler(rain_button_handler))
+
+    programar(app.job_queue)
     
-    app.run_polling()
+    if BOT_WEBHOOK_URL:
+        logger.info(f"Modo webhook en el puerto {PORT}: {BOT_WEBHOOK_URL}")
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=PORT,
+            url_path=urlparse(BOT_WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=BOT_WEBHOOK_URL,
+            secret_token=BOT_WEBHOOK_SECRETO or None
+        )
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,89 @@
+import os
+import time
+import logging
+from collections import OrderedDict
+
+# Tamaño de la grilla (grados) con la que se agrupan coordenadas cercanas (0.01° ≈ 1 km)
+BOT_CACHE_GRILLA = float(os.environ.get("BOT_CACHE_GRILLA", 0.01))
+# Segundos que se reutiliza una recomendación
+BOT_CACHE_TTL = float(os.environ.get("BOT_CACHE_TTL", 600))
+# Recomendaciones guardadas como máximo antes de desalojar la menos usada
+BOT_CACHE_MAX = int(os.environ.get("BOT_CACHE_MAX", 5000))
+# Cada cuántas consultas se loguea la tasa de aciertos
+BOT_CACHE_LOG_CADA = int(os.environ.get("BOT_CACHE_LOG_CADA", 100))
+
+# Clave de bot_data donde viven las entradas cuando el bot usa persistencia
+CLAVE_BOT_DATA = "cache_recomendaciones"
+
+logger = logging.getLogger(__name__)
+
+
+def hora_objetivo(lead, ahora=None):
+    # Hora (en horas desde epoch, UTC) para la que la API arma la predicción: redondea como hour_integer
+    ahora = time.time() if ahora is None else ahora
+    return int((ahora + lead * 3600 + 1800) // 3600)
+
+
+class CacheRecomendaciones:
+    # Respuestas de la API por (lat/lon en grilla, hora objetivo), para no repetir el pedido
+    # cuando un usuario vuelve a consultar la misma ubicación a los pocos minutos
+
+    def __init__(self, grilla=BOT_CACHE_GRILLA, ttl=BOT_CACHE_TTL, max_entradas=BOT_CACHE_MAX,
+                 log_cada=BOT_CACHE_LOG_CADA):
+        self.grilla = grilla
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.log_cada = log_cada
+        self.aciertos = 0
+        self.fallos = 0
+        self._entradas = OrderedDict()  # clave -> (vence, respuesta)
+
+    def vincular(self, bot_data):
+        # Con persistencia de PTB las entradas se guardan en bot_data y sobreviven a un reinicio
+        entradas = bot_data.get(CLAVE_BOT_DATA)
+        if entradas is not None:
+            self._entradas = entradas
+            self._purgar(time.time())
+            logger.info(f"Cache de recomendaciones restaurada: {len(self._entradas)} entradas")
+        bot_data[CLAVE_BOT_DATA] = self._entradas
+
+    def clave(self, lat, lon, lead):
+        return (round(lat / self.grilla), round(lon / self.grilla), hora_objetivo(lead))
+
+    def obtener(self, lat, lon, lead):
+        clave = self.clave(lat, lon, lead)
+        entrada = self._entradas.get(clave)
+        if entrada is not None and entrada[0] > time.time():
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            respuesta = entrada[1]
+        else:
+            self.fallos += 1
+            respuesta = None
+        if (self.aciertos + self.fallos) % self.log_cada == 0:
+            logger.info(f"Cache de recomendaciones: {self.tasa_aciertos():.0%} de aciertos "
+                        f"({self.aciertos}/{self.aciertos + self.fallos}), {len(self._entradas)} entradas")
+        return respuesta
+
+    def guardar(self, lat, lon, lead, respuesta):
+        # Ni errores ni respuestas con clima vencido: cuando Open-Meteo vuelva conviene pedir de nuevo
+        if "error" in respuesta or respuesta.get("vencido"):
+            return
+        ahora = time.time()
+        clave = self.clave(lat, lon, lead)
+        self._entradas[clave] = (ahora + self.ttl, respuesta)
+        self._entradas.move_to_end(clave)
+        if len(self._entradas) > self.max_entradas:
+            self._purgar(ahora)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def _purgar(self, ahora):
+        for clave in [clave for clave, (vence, _) in self._entradas.items() if vence <= ahora]:
+            del self._entradas[clave]
+
+    def tasa_aciertos(self):
+        return self.aciertos / max(self.aciertos + self.fallos, 1)
+
+
+recomendaciones = CacheRecomendaciones()
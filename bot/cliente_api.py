@@ -0,0 +1,171 @@
+import os
+import bisect
+import asyncio
+import hashlib
+import logging
+import itertools
+from collections import Counter, defaultdict
+import httpx
+
+API_URL = os.environ.get("API_URL")
+# Varias instancias de la API: URLs de /predecir separadas por coma (si no, sólo API_URL)
+API_URLS = [u.strip() for u in os.environ.get("API_URLS", "").split(",") if u.strip()] or ([API_URL] if API_URL else [])
+# Endpoint de lotes con una sola instancia (por defecto, el de /predecir con sufijo _lote)
+API_LOTE_URL = os.environ.get("API_LOTE_URL")
+# Cómo se reparten los pedidos entre instancias: "celda" (cada celda siempre a la misma, por hashing consistente)
+# o "turno" (una instancia tras otra, como un balanceador round-robin)
+API_REPARTO = os.environ.get("API_REPARTO", "celda")
+# Puntos de cada instancia en el anillo: con más, las celdas se reparten más parejo
+API_NODOS_VIRTUALES = int(os.environ.get("API_NODOS_VIRTUALES", 100))
+# Celda con la que se reparte, en grados: tiene que coincidir con CACHE_GRILLA de la API
+API_GRILLA = float(os.environ.get("API_GRILLA", 0.05))
+# Timeouts (segundos) y concurrencia máxima de pedidos a la API de predicción
+API_TIMEOUT_CONEXION = float(os.environ.get("API_TIMEOUT_CONEXION", 5))
+API_TIMEOUT_LECTURA = float(os.environ.get("API_TIMEOUT_LECTURA", 30))
+API_MAX_CONCURRENTES = int(os.environ.get("API_MAX_CONCURRENTES", 20))
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode(), digest_size=8).digest(), "big")
+
+def clave_celda(lat, lon, grilla=API_GRILLA):
+    # La misma celda que usa la cache de clima de la API (cache_clima.celda)
+    return f"{round(lat / grilla)},{round(lon / grilla)}"
+
+
+class AnilloConsistente:
+    # Hashing consistente: cada instancia ocupa nodos_virtuales puntos de un anillo de 64 bits y una clave va a
+    # la primera instancia que encuentra en sentido horario. Al sumar o quitar una instancia sólo cambian de dueño
+    # las claves de los tramos que ganó o perdió (~1/N), el resto de las caches sigue sirviendo
+
+    def __init__(self, instancias, nodos_virtuales=API_NODOS_VIRTUALES):
+        self.instancias = list(instancias)
+        puntos = sorted((_hash(f"{instancia}#{i}"), instancia)
+                        for instancia in self.instancias for i in range(nodos_virtuales))
+        self._hashes = [h for h, _ in puntos]
+        self._nodos = [instancia for _, instancia in puntos]
+
+    def instancia(self, clave, excluir=()):
+        # Dueña de la clave; si está en excluir (caída), la siguiente del anillo
+        i = bisect.bisect(self._hashes, _hash(clave))
+        for k in range(len(self._nodos)):
+            nodo = self._nodos[(i + k) % len(self._nodos)]
+            if nodo not in excluir:
+                return nodo
+        return None
+
+
+class ClienteAPI:
+    # Cliente HTTP asíncrono y de larga vida para hablar con la API de predicción. Con varias instancias cada
+    # pedido va a la dueña de su celda, así cada cache de clima sólo guarda (y descarga) su parte de las celdas
+
+    def __init__(self, urls=API_URLS, url_lote=API_LOTE_URL, reparto=API_REPARTO,
+                 nodos_virtuales=API_NODOS_VIRTUALES, grilla=API_GRILLA, timeout_conexion=API_TIMEOUT_CONEXION,
+                 timeout_lectura=API_TIMEOUT_LECTURA, max_concurrentes=API_MAX_CONCURRENTES):
+        self.urls = list(urls)
+        self.urls_lote = {url: f"{url}_lote" for url in self.urls}
+        if url_lote and len(self.urls) == 1:
+            self.urls_lote[self.urls[0]] = url_lote
+        self.reparto = reparto
+        self.grilla = grilla
+        self.anillo = AnilloConsistente(self.urls, nodos_virtuales)
+        self._turno = itertools.cycle(self.urls)
+        # Ubicaciones mandadas a cada instancia
+        self.pedidos = Counter()
+        self.timeout = httpx.Timeout(timeout_lectura, connect=timeout_conexion)
+        # Conexiones keep-alive reutilizadas entre pedidos, sin superar max_concurrentes
+        self.limites = httpx.Limits(max_connections=max_concurrentes,
+                                    max_keepalive_connections=max_concurrentes)
+        self._semaforo = asyncio.Semaphore(max_concurrentes)
+        self._cliente = None
+
+    async def iniciar(self):
+        if self._cliente is None:
+            self._cliente = httpx.AsyncClient(timeout=self.timeout, limits=self.limites)
+
+    async def cerrar(self):
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    async def post(self, url, payload):
+        await self.iniciar()
+        async with self._semaforo:
+            return await self._cliente.post(url, json=payload)
+
+    def elegir(self, lat, lon, caidas=()):
+        if self.reparto == "turno":
+            for _ in self.urls:
+                url = next(self._turno)
+                if url not in caidas:
+                    return url
+            return None
+        return self.anillo.instancia(clave_celda(lat, lon, self.grilla), caidas)
+
+    async def predecir(self, lat, lon, lead):
+        # Si la instancia no acepta la conexión se prueba con la siguiente del anillo (sólo esa celda se muda)
+        caidas = set()
+        while True:
+            url = self.elegir(lat, lon, caidas)
+            try:
+                self.pedidos[url] += 1
+                return await self.post(url, {"lat": lat, "lon": lon, "lead": lead})
+            except httpx.ConnectError:
+                caidas.add(url)
+                if len(caidas) == len(self.urls):
+                    raise
+                logger.warning(f"La API en {url} no responde, se prueba con otra instancia")
+
+    async def predecir_lote(self, ubicaciones):
+        # ubicaciones: [{"lat", "lon", "lead"}]; la API responde {"resultados": [...]} en el mismo orden
+        if len(self.urls) == 1:
+            self.pedidos[self.urls[0]] += len(ubicaciones)
+            return await self.post(self.urls_lote[self.urls[0]], {"ubicaciones": ubicaciones})
+
+        # Con varias instancias el lote se parte por dueña y los pedazos van en paralelo. La respuesta se arma
+        # con el mismo formato; si una instancia falla, sólo sus ubicaciones quedan con error
+        resultados = [None] * len(ubicaciones)
+        caidas, pendientes = set(), range(len(ubicaciones))
+        while pendientes:
+            grupos = defaultdict(list)
+            for i in pendientes:
+                url = self.elegir(ubicaciones[i]["lat"], ubicaciones[i]["lon"], caidas)
+                if url is None:
+                    resultados[i] = {"error": "Ninguna instancia de la API responde"}
+                else:
+                    grupos[url].append(i)
+            for url, indices in grupos.items():
+                self.pedidos[url] += len(indices)
+            respuestas = await asyncio.gather(*[self.post(self.urls_lote[url], {"ubicaciones": [ubicaciones[i] for i in indices]})
+                                                for url, indices in grupos.items()], return_exceptions=True)
+            pendientes = []
+            for (url, indices), r in zip(grupos.items(), respuestas):
+                if isinstance(r, httpx.ConnectError):
+                    logger.warning(f"La API en {url} no responde, sus {len(indices)} ubicaciones van a otra instancia")
+                    caidas.add(url)
+                    pendientes += indices
+                    continue
+                try:
+                    if isinstance(r, Exception):
+                        raise r
+                    data = r.json()
+                    if r.status_code != 200 or "error" in data:
+                        raise RuntimeError(data.get("error", r.status_code))
+                    for i, resultado in zip(indices, data["resultados"]):
+                        resultados[i] = resultado
+                except Exception as e:
+                    logger.error(f"Error pidiendo {len(indices)} ubicaciones a {url}: {e}")
+                    for i in indices:
+                        resultados[i] = {"error": str(e)}
+        return httpx.Response(200, json={"resultados": resultados})
+
+
+cliente = ClienteAPI()
+
+async def iniciar(application):
+    await cliente.iniciar()
+
+async def cerrar(application):
+    await cliente.cerrar()
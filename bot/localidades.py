@@ -0,0 +1,217 @@
+import os
+import csv
+import math
+import bisect
+import logging
+import unicodedata
+
+# Nomenclador offline de localidades: nombre -> coordenadas (exacto, por prefijo o aproximado) y
+# coordenadas -> localidad más cercana, sin llamar a ningún geocodificador. Se carga una vez al importar
+
+# CSV con columnas nombre,provincia,pais,lat,lon,alias (alias separados por "|"). Ante nombres repetidos
+# gana la primera fila, así que el archivo va ordenado por importancia dentro de cada provincia
+LOCALIDADES_CSV = os.environ.get("LOCALIDADES_CSV", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                 "localidades.csv"))
+# Distancia máxima para nombrar la localidad más cercana en las respuestas
+LOCALIDADES_MAX_KM = float(os.environ.get("LOCALIDADES_MAX_KM", 25))
+# Similitud mínima (Dice sobre trigramas, 0 a 1) para aceptar un nombre mal escrito
+LOCALIDADES_SIMILITUD = float(os.environ.get("LOCALIDADES_SIMILITUD", 0.6))
+# Un prefijo más corto que esto no se resuelve solo (con "sa" hay decenas de candidatos)
+LOCALIDADES_MIN_PREFIJO = 3
+
+RADIO_TIERRA_KM = 6371.0
+
+logger = logging.getLogger(__name__)
+
+
+def normalizar(texto):
+    # Minúsculas, sin tildes y con un espacio entre palabras: "  Río  Cuarto " -> "rio cuarto"
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c if c.isalnum() else " " for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+def trigramas(clave):
+    relleno = f"  {clave} "
+    return {relleno[i:i + 3] for i in range(len(relleno) - 2)}
+
+def a_esfera(lat, lon):
+    # Punto en la esfera unitaria: la distancia euclídea entre dos puntos ordena igual que la del círculo máximo
+    lat, lon = math.radians(lat), math.radians(lon)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def cuerda_a_km(cuerda):
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, cuerda / 2))
+
+
+class Localidad:
+
+    def __init__(self, nombre, provincia, pais, lat, lon):
+        self.nombre = nombre
+        self.provincia = provincia
+        self.pais = pais
+        self.lat = lat
+        self.lon = lon
+
+    def etiqueta(self):
+        # "Rosario, Santa Fe"; sin provincia cuando se llama igual que la localidad ("Córdoba")
+        return self.nombre if self.nombre == self.provincia else f"{self.nombre}, {self.provincia}"
+
+    def __repr__(self):
+        return f"Localidad({self.etiqueta()!r}, {self.lat}, {self.lon})"
+
+
+class ArbolKD:
+    # KD-tree en Python puro sobre puntos 3D. Cada nodo es (índice, eje, menores, mayores)
+
+    def __init__(self, puntos):
+        self.puntos = puntos
+        self._raiz = self._armar(list(range(len(puntos))), 0)
+
+    def _armar(self, indices, eje):
+        if not indices:
+            return None
+        indices.sort(key=lambda i: self.puntos[i][eje])
+        medio = len(indices) // 2
+        siguiente = (eje + 1) % 3
+        return (indices[medio], eje, self._armar(indices[:medio], siguiente), self._armar(indices[medio + 1:], siguiente))
+
+    def cercano(self, punto):
+        # Devuelve (índice, distancia euclídea) del punto más cercano, o (None, inf) si el árbol está vacío
+        mejor = [None, math.inf]
+
+        def visitar(nodo):
+            if nodo is None:
+                return
+            indice, eje, menores, mayores = nodo
+            p = self.puntos[indice]
+            distancia = math.dist(p, punto)
+            if distancia < mejor[1]:
+                mejor[0], mejor[1] = indice, distancia
+            diferencia = punto[eje] - p[eje]
+            cerca, lejos = (menores, mayores) if diferencia < 0 else (mayores, menores)
+            visitar(cerca)
+            # El otro lado sólo puede tener algo más cerca si el plano de corte está a menos de la mejor distancia
+            if abs(diferencia) < mejor[1]:
+                visitar(lejos)
+
+        visitar(self._raiz)
+        return mejor[0], mejor[1]
+
+
+class Localidades:
+
+    def __init__(self, archivo=LOCALIDADES_CSV, max_km=LOCALIDADES_MAX_KM, similitud=LOCALIDADES_SIMILITUD):
+        self.archivo = archivo
+        self.max_km = max_km
+        self.similitud = similitud
+        self.localidades = []
+        self._por_clave = {}        # nombre normalizado -> índice de la localidad (la primera si se repite)
+        self._sin_espacios = {}     # la misma clave sin espacios ("bsas", "mardelplata") -> índice
+        self._claves = []           # claves ordenadas, para buscar por prefijo con bisect
+        self._por_trigrama = {}     # trigrama -> claves que lo contienen
+        self._n_trigramas = {}      # clave -> cantidad de trigramas, para el puntaje
+        self._arbol = ArbolKD([])
+        self._cargar()
+
+    def _cargar(self):
+        try:
+            with open(self.archivo, encoding="utf-8", newline="") as f:
+                filas = list(csv.DictReader(f))
+        except OSError as e:
+            logger.warning(f"No se pudo leer el nomenclador {self.archivo}: {e}")
+            return
+        for fila in filas:
+            localidad = Localidad(fila["nombre"], fila["provincia"], fila["pais"], float(fila["lat"]), float(fila["lon"]))
+            indice = len(self.localidades)
+            self.localidades.append(localidad)
+            # "merlo, san luis" distingue entre localidades con el mismo nombre
+            nombres = [localidad.nombre, f"{localidad.nombre} {localidad.provincia}"]
+            nombres += [alias for alias in (fila.get("alias") or "").split("|") if alias]
+            for nombre in nombres:
+                self._por_clave.setdefault(normalizar(nombre), indice)
+                self._sin_espacios.setdefault(normalizar(nombre).replace(" ", ""), indice)
+
+        self._claves = sorted(self._por_clave)
+        for clave in self._claves:
+            self._n_trigramas[clave] = len(trigramas(clave))
+            for trigrama in trigramas(clave):
+                self._por_trigrama.setdefault(trigrama, []).append(clave)
+        self._arbol = ArbolKD([a_esfera(l.lat, l.lon) for l in self.localidades])
+        logger.info(f"Nomenclador: {len(self.localidades)} localidades, {len(self._claves)} nombres")
+
+    def __len__(self):
+        return len(self.localidades)
+
+    def _por_prefijo(self, clave):
+        indices = []
+        i = bisect.bisect_left(self._claves, clave)
+        while i < len(self._claves) and self._claves[i].startswith(clave):
+            indice = self._por_clave[self._claves[i]]
+            if indice not in indices:
+                indices.append(indice)
+            i += 1
+        return sorted(indices)
+
+    def _parecidas(self, clave):
+        # Candidatas: claves que comparten algún trigrama; puntaje: coeficiente de Dice entre los trigramas
+        propios = trigramas(clave)
+        comunes = {}
+        for trigrama in propios:
+            for candidata in self._por_trigrama.get(trigrama, ()):
+                comunes[candidata] = comunes.get(candidata, 0) + 1
+        puntajes = {}
+        for candidata, n in comunes.items():
+            puntaje = 2 * n / (len(propios) + self._n_trigramas[candidata])
+            indice = self._por_clave[candidata]
+            if puntaje > puntajes.get(indice, 0):
+                puntajes[indice] = puntaje
+        return sorted(puntajes.items(), key=lambda par: (-par[1], par[0]))
+
+    def resolver(self, texto):
+        # Localidad para un nombre escrito por el usuario: exacto, único por prefijo o parecido; si no, None
+        clave = normalizar(texto)
+        if not clave:
+            return None
+        if clave in self._por_clave:
+            return self.localidades[self._por_clave[clave]]
+        # Como los atajos de antes del nomenclador, que comparaban sin espacios: "bsas", "b s as"
+        if clave.replace(" ", "") in self._sin_espacios:
+            return self.localidades[self._sin_espacios[clave.replace(" ", "")]]
+        if len(clave) >= LOCALIDADES_MIN_PREFIJO:
+            prefijo = self._por_prefijo(clave)
+            if len(prefijo) == 1:
+                return self.localidades[prefijo[0]]
+            if prefijo:
+                # Ambiguo ("villa", "san"): mejor preguntar que adivinar
+                return None
+        parecidas = self._parecidas(clave)
+        if parecidas and parecidas[0][1] >= self.similitud:
+            return self.localidades[parecidas[0][0]]
+        return None
+
+    def sugerencias(self, texto, limite=3):
+        # Para cuando resolver no alcanza: primero las que empiezan igual, después las más parecidas
+        clave = normalizar(texto)
+        if not clave:
+            return []
+        indices = self._por_prefijo(clave) if len(clave) >= LOCALIDADES_MIN_PREFIJO else []
+        indices += [i for i, puntaje in self._parecidas(clave) if puntaje >= self.similitud / 2 and i not in indices]
+        return [self.localidades[i] for i in indices[:limite]]
+
+    def cercana(self, lat, lon, max_km=None):
+        # (localidad, distancia en km) más cercana a lat/lon, o None si está a más de max_km
+        max_km = self.max_km if max_km is None else max_km
+        indice, cuerda = self._arbol.cercano(a_esfera(lat, lon))
+        if indice is None:
+            return None
+        distancia = cuerda_a_km(cuerda)
+        if distancia > max_km:
+            return None
+        return self.localidades[indice], distancia
+
+    def etiqueta(self, lat, lon):
+        cercana = self.cercana(lat, lon)
+        return cercana[0].etiqueta() if cercana is not None else None
+
+
+localidades = Localidades()
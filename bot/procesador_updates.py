@@ -0,0 +1,37 @@
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ProcesadorPorChat(BaseUpdateProcessor):
+    # Procesa en paralelo updates de chats distintos (hasta max_concurrentes a la vez) y en orden de llegada
+    # los de un mismo chat, para que los estados del ConversationHandler (ASK_COORDINATES, ASK_RAIN...) no se pisen.
+    # Los updates en espera de su chat ocupan lugar en el límite de concurrencia
+
+    def __init__(self, max_concurrentes):
+        super().__init__(max_concurrentes)
+        self._chats = {}  # chat_id -> [lock, updates esperando o en proceso]
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+
+        entrada = self._chats.get(chat.id)
+        if entrada is None:
+            entrada = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                await coroutine
+        finally:
+            entrada[1] -= 1
+            if entrada[1] == 0:
+                del self._chats[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
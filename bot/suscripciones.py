@@ -0,0 +1,245 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import time as dtime
+from zoneinfo import ZoneInfo
+from telegram.error import RetryAfter, Forbidden, TelegramError
+import utils as ut
+import cliente_api as ca
+
+# Zona horaria en la que los usuarios eligen la hora de la recomendación diaria
+SUSCRIPCION_ZONA = ZoneInfo(os.environ.get("SUSCRIPCION_ZONA", "America/Argentina/Buenos_Aires"))
+# Tamaño de la grilla (grados) con la que se agrupan suscriptos cercanos: una sola predicción por celda (0.05° ≈ 5 km)
+SUSCRIPCION_GRILLA = float(os.environ.get("SUSCRIPCION_GRILLA", 0.05))
+# Celdas por pedido a /predecir_lote (la API acepta hasta MAX_LOTE)
+SUSCRIPCION_LOTE = int(os.environ.get("SUSCRIPCION_LOTE", 500))
+# Mensajes por segundo del envío (Telegram permite ~30 por segundo en total)
+SUSCRIPCION_MENSAJES_POR_SEG = float(os.environ.get("SUSCRIPCION_MENSAJES_POR_SEG", 25))
+
+# Postgres donde se guardan las suscripciones (en Heroku, el que agrega el add-on Heroku Postgres). El dyno
+# se reinicia una vez por día y pierde su disco, así que ni bot_data ni BOT_PERSISTENCIA las conservan:
+# sin base /suscribir no registra a nadie. Sólo con base se importa psycopg
+SUSCRIPCION_BASE = os.environ.get("DATABASE_URL", "")
+
+# Clave de bot_data donde estaban las suscripciones antes de la base: se pasan a la base al arrancar
+CLAVE_BOT_DATA = "suscripciones"
+
+TABLA = """
+CREATE TABLE IF NOT EXISTS suscripciones (
+    chat_id BIGINT PRIMARY KEY,
+    lat DOUBLE PRECISION NOT NULL,
+    lon DOUBLE PRECISION NOT NULL,
+    hora SMALLINT NOT NULL
+)
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def mensaje_diario(data):
+    prob_1st = round(data["prob_1st"] * 100)
+    wind = data["weather_wind_speed_10m"] * 3.6
+    apparent_temperature = data["apparent_temperature"]
+    precipitation_prob = round(data["precipitation_prob"] * 100, 1)
+    msg = (
+        f"🌅 ¡Buen día! A las {data['hour_geo']} hs la temperatura es de {data['temperature']:.1f}° con una humedad de "
+        f"{data['humidity']:.0f}% y viento a {wind:.1f} km/h, "
+        f"provocando una *sensación térmica de {apparent_temperature:.1f}°* {ut.temperatura_emoji(apparent_temperature)}\n\n"
+        f"Te recomiendo usar: {ut.abrigo_emoji(data['class_1st'])} {data['class_1st']} ({prob_1st}% prob)"
+    )
+    if data["prob_1st"] <= 0.6 and (data["prob_2nd"] > 0.25 or (data["prob_1st"] - data["prob_2nd"] < 0.10)):
+        msg += f"\nSi no, podrías usar: {ut.abrigo_emoji(data['class_2nd'])} {data['class_2nd']} ({round(data['prob_2nd'] * 100)}% prob)"
+    msg += (
+        f"\n\nLa probabilidad de lluvia es del {precipitation_prob}%. {ut.lluvia_msj(precipitation_prob, data['precipitation'])}"
+        "\n\nPara dejar de recibir este mensaje usá /desuscribir"
+    )
+    return msg
+
+
+class Suscripciones:
+    # Chats suscriptos a la recomendación diaria: chat_id -> (lat, lon, hora local). La base es la fuente de
+    # verdad y el job de cada hora lee la copia en memoria, que se carga al arrancar y se actualiza con cada cambio
+
+    def __init__(self, grilla=SUSCRIPCION_GRILLA, base=SUSCRIPCION_BASE):
+        self.grilla = grilla
+        self.base = base
+        self._suscriptos = {}
+        self._conexion = None
+        self._lock = threading.Lock()  # una conexión compartida por los hilos que escriben
+
+    @property
+    def durable(self):
+        return bool(self.base)
+
+    def _ejecutar(self, sql, parametros=None):
+        # Bloqueante: desde el event loop va en un hilo. Reconecta una vez si la conexión se cortó
+        import psycopg
+        with self._lock:
+            for intento in range(2):
+                try:
+                    if self._conexion is None or self._conexion.closed:
+                        self._conexion = psycopg.connect(self.base, autocommit=True)
+                    with self._conexion.cursor() as cursor:
+                        cursor.execute(sql, parametros)
+                        return cursor.fetchall() if cursor.description else cursor.rowcount
+                except psycopg.OperationalError:
+                    if self._conexion is not None:
+                        self._conexion.close()
+                    self._conexion = None
+                    if intento == 1:
+                        raise
+
+    async def iniciar(self, bot_data):
+        # Desde post_init: crea la tabla, pasa las suscripciones que hubiera en bot_data y carga todas
+        if not self.durable:
+            if bot_data.get(CLAVE_BOT_DATA):
+                # Se dejan en bot_data para pasarlas a la base cuando se configure
+                logger.warning(f"Hay {len(bot_data[CLAVE_BOT_DATA])} suscripciones en bot_data pero no "
+                               f"DATABASE_URL: no se envían")
+            return
+        anteriores = bot_data.get(CLAVE_BOT_DATA) or {}
+        await asyncio.to_thread(self._ejecutar, TABLA)
+        for chat_id, (lat, lon, hora) in anteriores.items():
+            await asyncio.to_thread(self._guardar, chat_id, lat, lon, hora)
+        filas = await asyncio.to_thread(self._ejecutar, "SELECT chat_id, lat, lon, hora FROM suscripciones")
+        self._suscriptos = {chat_id: (lat, lon, hora) for chat_id, lat, lon, hora in filas}
+        bot_data.pop(CLAVE_BOT_DATA, None)
+        logger.info(f"Suscripciones cargadas: {len(self._suscriptos)} chats ({len(anteriores)} pasadas de bot_data)")
+
+    def _guardar(self, chat_id, lat, lon, hora):
+        self._ejecutar("INSERT INTO suscripciones (chat_id, lat, lon, hora) VALUES (%s, %s, %s, %s) "
+                       "ON CONFLICT (chat_id) DO UPDATE SET lat = EXCLUDED.lat, lon = EXCLUDED.lon, hora = EXCLUDED.hora",
+                       (chat_id, lat, lon, hora))
+
+    async def agregar(self, chat_id, lat, lon, hora):
+        # Primero la base: si falla no se confirma la suscripción
+        if self.durable:
+            await asyncio.to_thread(self._guardar, chat_id, lat, lon, hora)
+        self._suscriptos[chat_id] = (lat, lon, hora)
+
+    async def quitar(self, chat_id):
+        if self.durable:
+            await asyncio.to_thread(self._ejecutar, "DELETE FROM suscripciones WHERE chat_id = %s", (chat_id,))
+        return self._suscriptos.pop(chat_id, None) is not None
+
+    def __len__(self):
+        return len(self._suscriptos)
+
+    def agrupar(self, hora):
+        # Suscriptos de la hora agrupados por celda: (lat, lon) del centro de la celda -> [chat_id]
+        grupos = {}
+        for chat_id, (lat, lon, hora_chat) in list(self._suscriptos.items()):
+            if hora_chat == hora:
+                celda = (round(lat / self.grilla) * self.grilla, round(lon / self.grilla) * self.grilla)
+                grupos.setdefault(celda, []).append(chat_id)
+        return grupos
+
+
+class EnvioPausado:
+    # Cola de mensajes que se mandan a ritmo constante para no superar el límite de Telegram.
+    # Si Telegram pide esperar (RetryAfter) se frena todo el envío; si el usuario bloqueó al bot se lo desuscribe
+
+    def __init__(self, por_segundo=SUSCRIPCION_MENSAJES_POR_SEG, bloqueado=None):
+        self.intervalo = 1 / por_segundo
+        self.bloqueado = bloqueado  # corrutina: chat_id -> None
+        self.enviados = 0
+        self.errores = 0
+        self._cola = asyncio.Queue()
+        self._proximo = 0.0
+        self._bot = None
+        self._tarea = None
+        self._envios = set()
+
+    def iniciar(self, bot):
+        self._bot = bot
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._bucle())
+
+    async def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    def encolar(self, chat_id, texto):
+        self._cola.put_nowait((chat_id, texto))
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    async def _bucle(self):
+        while True:
+            chat_id, texto = await self._cola.get()
+            espera = self._proximo - time.monotonic()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            self._proximo = max(self._proximo, time.monotonic()) + self.intervalo
+            # Cada mensaje sale en su propia tarea: una respuesta lenta de Telegram no frena el ritmo
+            envio = asyncio.create_task(self._enviar(chat_id, texto))
+            self._envios.add(envio)
+            envio.add_done_callback(self._envios.discard)
+
+    async def _enviar(self, chat_id, texto):
+        try:
+            await self._bot.send_message(chat_id, texto, parse_mode="Markdown")
+            self.enviados += 1
+        except RetryAfter as e:
+            logger.warning(f"Telegram pidió esperar {e.retry_after} s; se pausa el envío de suscripciones")
+            self._proximo = time.monotonic() + e.retry_after
+            self.encolar(chat_id, texto)
+        except Forbidden:
+            logger.info(f"El chat {chat_id} bloqueó al bot; se lo desuscribe")
+            if self.bloqueado is not None:
+                try:
+                    await self.bloqueado(chat_id)
+                except Exception as e:
+                    logger.error(f"No se pudo desuscribir al chat {chat_id}: {e}")
+        except TelegramError as e:
+            self.errores += 1
+            logger.warning(f"No se pudo mandar la recomendación diaria a {chat_id}: {e}")
+
+
+suscripciones = Suscripciones()
+envios = EnvioPausado(bloqueado=suscripciones.quitar)
+
+
+async def enviar_suscripciones(context):
+    # Job de cada hora en punto: una predicción por celda (en lotes a /predecir_lote) y un mensaje por suscripto
+    hora = context.job.data
+    grupos = suscripciones.agrupar(hora)
+    if not grupos:
+        return
+    inicio = time.perf_counter()
+    celdas = list(grupos)
+
+    async def pedir(lote):
+        try:
+            r = await ca.cliente.predecir_lote([{"lat": lat, "lon": lon, "lead": 0} for lat, lon in lote])
+            data = r.json()
+            if r.status_code != 200 or "error" in data:
+                raise RuntimeError(data.get("error", r.status_code))
+            return data["resultados"]
+        except Exception as e:
+            logger.error(f"Error pidiendo un lote de {len(lote)} celdas para las suscripciones: {e}")
+            return [{"error": str(e)}] * len(lote)
+
+    lotes = [celdas[i:i + SUSCRIPCION_LOTE] for i in range(0, len(celdas), SUSCRIPCION_LOTE)]
+    resultados = [data for lote in await asyncio.gather(*[pedir(lote) for lote in lotes]) for data in lote]
+
+    chats = 0
+    for celda, data in zip(celdas, resultados):
+        if "error" in data:
+            continue
+        texto = mensaje_diario(data)
+        for chat_id in grupos[celda]:
+            envios.encolar(chat_id, texto)
+            chats += 1
+    logger.info(f"Suscripciones de las {hora} hs: {chats} mensajes encolados para {len(celdas)} celdas "
+                f"en {len(lotes)} pedidos a la API ({time.perf_counter() - inicio:.1f} s)")
+
+def programar(job_queue):
+    # Un job diario por cada hora en punto de la zona de los usuarios
+    for hora in range(24):
+        job_queue.run_daily(enviar_suscripciones, dtime(hora, tzinfo=SUSCRIPCION_ZONA), data=hora,
+                            name=f"suscripciones_{hora:02d}")